@@ -2,48 +2,42 @@
 """
 Usage:
   python add_credits.py <input.mp4> <text.txt> <left|center|right> <#RRGGBB> <fontsize> <output.mp4>
+  python add_credits.py ... <output.mp4> --preview       (静止画 <output>_preview_01.png ...)
+  python add_credits.py ... <output.mp4> --preview-clip  (短い縮小動画 <output>_preview.mp4)
 
 修正点:
   - enable式: between(t,A,B) → gte(t\\,A)*lte(t\\,B)  (コンマのパース問題を回避)
   - y式: if() を除去し線形式のみ使用 (drawtextはif()非対応)
+  - クレジットは画像に1回だけ描画して overlay で合成 (credit_render.py)
 """
 
 import sys
-import subprocess
-import json
 import os
 
+from media_index import media_info
+from credit_render import (
+    credit_timing, read_credit_lines, render_credits, render_preview,
+)
+
 
 def get_video_info(input_file):
-    result = subprocess.run(
-        ["ffprobe", "-v", "quiet", "-print_format", "json",
-         "-show_format", "-show_streams", "-select_streams", "v:0", input_file],
-        capture_output=True, text=True, check=True
-    )
-    info = json.loads(result.stdout)
-    duration = float(info["format"]["duration"])
-    width    = info["streams"][0]["width"]
-    height   = info["streams"][0]["height"]
+    info = media_info(input_file)
+    if not info or not info["width"]:
+        raise ValueError(f"video info not available: {input_file}")
+    duration = info["duration"]
+    width    = info["width"]
+    height   = info["height"]
     return duration, width, height
 
 
-def hex_to_ffmpeg_color(hex_color):
-    return "0x" + hex_color.lstrip("#").upper()
-
-
-def escape_drawtext(text):
-    """drawtext フィルタ用エスケープ"""
-    text = text.replace("\\", "\\\\")   # バックスラッシュ (最初に処理)
-    text = text.replace("'",  "\u2019") # シングルクォートは全角代替
-    text = text.replace(":",  "\\:")
-    text = text.replace(",",  "\\,")
-    text = text.replace("[",  "\\[")
-    text = text.replace("]",  "\\]")
-    text = text.replace("%",  "\\%")
-    return text
-
-
 def main():
+    # --preview / --preview-clip: 全体をエンコードせず見え方だけを確認する
+    preview = None
+    for flag in ("--preview", "--preview-clip"):
+        if flag in sys.argv:
+            sys.argv.remove(flag)
+            preview = flag
+
     if len(sys.argv) != 7:
         print("Usage: python add_credits.py <input.mp4> <text.txt> <left|center|right> <#RRGGBB> <fontsize> <output.mp4>")
         sys.exit(1)
@@ -73,67 +67,29 @@ def main():
         print("Error: video must be longer than 10 seconds")
         sys.exit(1)
 
-    with open(text_file, "r", encoding="utf-8") as f:
-        lines = [line.rstrip("\n") for line in f.readlines()]
-
-    line_height  = int(fontsize * 1.5)
-    total_text_h = len(lines) * line_height
-
-    scroll_start = 3.0
-    scroll_end   = duration - 3.0
-    scroll_dur   = scroll_end - scroll_start
-
-    # 画面下端から登場し、テキスト全体が画面上に消え切るまでの距離
-    scroll_dist  = video_height + total_text_h
-    speed        = scroll_dist / scroll_dur   # px/sec
-
-    ffmpeg_color = hex_to_ffmpeg_color(color)
-
-    if alignment == "left":
-        x_expr = "50"
-    elif alignment == "right":
-        x_expr = "w-tw-50"
-    else:
-        x_expr = "(w-tw)/2"
-
-    # ★ enable: between() はコンマがフィルタ区切りと衝突するため
-    #           gte(t\,A)*lte(t\,B) 形式を使用
-    enable_expr = f"gte(t\\,{scroll_start})*lte(t\\,{scroll_end})"
-
-    # ★ y: if() は drawtext 非対応のため除去
-    #       t = scroll_start のとき y = h (画面下端)
-    #       t が進むにつれ上にスクロール
-    #       enable で表示期間外は描画しないので t < scroll_start でも問題なし
-
-    filters = []
-    for i, line in enumerate(lines):
-        text    = line if line.strip() else " "
-        escaped = escape_drawtext(text)
-        y_offset = i * line_height
-        y_expr  = f"h-{speed:.4f}*(t-{scroll_start})+{y_offset}"
-
-        filters.append(
-            f"drawtext=text='{escaped}'"
-            f":fontsize={fontsize}"
-            f":fontcolor={ffmpeg_color}"
-            f":x={x_expr}"
-            f":y={y_expr}"
-            f":enable='{enable_expr}'"
-        )
-
-    vf = ",".join(filters)
-
-    cmd = [
-        "ffmpeg", "-y",
-        "-i", input_file,
-        "-vf", vf,
-        "-codec:a", "copy",
-        output_file
-    ]
+    lines = read_credit_lines(text_file)
+
+    # 画面下端から登場し、テキスト全体が画面上に消え切るまでの距離を
+    # 開始3秒後～終了3秒前でスクロール
+    timing = credit_timing(duration, video_height, len(lines), fontsize)
+
+    # ★ クレジット全体を透過画像に一度だけ描画し、overlay 1つでスクロールさせる
+    #    （1行ごとの drawtext をフレーム毎に評価しないので行数に依存しない）
+    #    t = scroll_start のとき y = h (画面下端)、以後上にスクロール
+
+    if preview:
+        prefix = os.path.splitext(output_file)[0] + "_preview"
+        results = render_preview(input_file, lines, video_width, video_height, timing,
+                                 alignment, color, fontsize, prefix,
+                                 clip=preview == "--preview-clip")
+        for t, out in results:
+            print(f"  {t:7.2f}s -> {out}")
+        return
 
     print("Running ffmpeg...")
-    print(f"  Lines: {len(lines)}, Speed: {speed:.2f}px/s")
-    subprocess.run(cmd, check=True)
+    print(f"  Lines: {len(lines)}, Speed: {timing['speed']:.2f}px/s")
+    render_credits(input_file, lines, video_width, timing,
+                   alignment, color, fontsize, output_file)
     print(f"Done! Output: {output_file}")
 
 
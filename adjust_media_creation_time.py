@@ -1,13 +1,35 @@
 # -*- coding: utf-8 -*-
 import sys
 from pathlib import Path
-import subprocess
 from datetime import datetime, timedelta
 
-def adjust_media_creation_time(input_dir: Path):
+from ffmpeg_runner import run_ffmpeg, timed_stage
+from mp4_atoms import PATCHABLE_SUFFIXES, Mp4PatchError, set_creation_time
+
+
+def remux_creation_time(f: Path, new_time_str: str):
+    """ffmpeg でコピーし直して creation_time を上書き（.mts など用）"""
+    output_file = f.parent / f"{f.stem}_tmp{f.suffix}"
+    cmd = [
+        "ffmpeg", "-y", "-i", str(f),
+        "-c", "copy",
+        "-map", "0",
+        "-metadata", f"creation_time={new_time_str}",
+        str(output_file)
+    ]
+    run_ffmpeg(cmd, "creation_time", f, output_file)
+    # 元ファイルを置き換え
+    f.unlink()
+    output_file.rename(f)
+
+
+def adjust_media_creation_time(input_dir: Path, native: bool = True):
     """
     フォルダ内の動画ファイルの creation_time を
     ファイル名順に並ぶように調整
+
+    native : MP4/MOV はファイルを直接書き換える（コピーしない）
+             書き換えられないファイルだけ ffmpeg でコピーし直す
     """
     # 対象動画
     files = [f for f in input_dir.iterdir() if f.suffix.lower() in [".mp4", ".mov", ".mts"]]
@@ -22,31 +44,33 @@ def adjust_media_creation_time(input_dir: Path):
         new_time = base_time + timedelta(seconds=i)
         new_time_str = new_time.strftime("%Y-%m-%dT%H:%M:%S")  # ffmpeg 用の ISO 形式
 
+        if native and f.suffix.lower() in PATCHABLE_SUFFIXES:
+            try:
+                with timed_stage("creation_time_patch", f):
+                    set_creation_time(f, new_time)
+                print(f"{f.name} -> {new_time_str}")
+                continue
+            except Mp4PatchError as e:
+                print(f"{f.name}: 直接書き換えできないため ffmpeg で処理します ({e})")
+
         # ffmpeg で creation_time を上書き
-        output_file = f.parent / f"{f.stem}_tmp{f.suffix}"
-        cmd = [
-            "ffmpeg", "-y", "-i", str(f),
-            "-c", "copy",
-            "-map", "0",
-            "-metadata", f"creation_time={new_time_str}",
-            str(output_file)
-        ]
-        subprocess.run(cmd, check=True)
-        # 元ファイルを置き換え
-        f.unlink()
-        output_file.rename(f)
+        remux_creation_time(f, new_time_str)
         print(f"{f.name} -> {new_time_str}")
 
     print("メディア作成日時の調整が完了しました。")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python adjust_media_creation_time.py /path/to/folder")
+    args = sys.argv[1:]
+    native = "--remux" not in args
+    args = [a for a in args if a != "--remux"]
+
+    if len(args) != 1:
+        print("Usage: python adjust_media_creation_time.py /path/to/folder [--remux]")
         sys.exit(1)
 
-    folder = Path(sys.argv[1])
+    folder = Path(args[0])
     if not folder.is_dir():
         print("指定されたフォルダが存在しません")
         sys.exit(1)
 
-    adjust_media_creation_time(folder)
\ No newline at end of file
+    adjust_media_creation_time(folder, native)
\ No newline at end of file
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+音声解析（ラウドネス・RMS・無音区間）
+
+ffmpeg で音声を 32bit float の PCM にしてパイプで受け取り、一定サイズずつ
+NumPy で処理する（ファイル全体をメモリに載せない）。
+1回のデコードで、そのままの信号（RMS・ピーク・無音判定用）と
+K 特性フィルタをかけた信号（ラウドネス用）の両方を受け取る。
+
+  integrated_lufs : 統合ラウドネス（ITU-R BS.1770 のゲート付き。K 特性は近似）
+  peak_db         : サンプルピーク (dBFS)
+  rms_db          : BLOCK_SECONDS ごとの RMS (dBFS)
+  silences        : 無音区間 [[開始, 終了], ...]（秒）
+
+結果は media_index の audio テーブルにキャッシュする。
+"""
+
+import subprocess
+
+import numpy as np
+
+import resource_governor
+from ffmpeg_runner import (cancel_kill_timer, current_token, popen_options, spawn,
+                           timed_stage, wait_child)
+from media_index import get_index, media_info
+
+
+ANALYSIS_RATE = 48000
+
+# RMS・ラウドネスを計算する単位（秒）。ラウドネスは 4 単位 = 400ms の窓
+BLOCK_SECONDS = 0.1
+
+# 1回に読み込む長さ（秒）
+READ_SECONDS = 10.0
+
+# この RMS 未満が SILENCE_MIN_SECONDS 以上続いたら無音
+SILENCE_DB = -45.0
+SILENCE_MIN_SECONDS = 0.5
+
+# BS.1770 の K 特性（高域シェルフ + 低域カット）の近似
+K_WEIGHTING = ("highshelf=f=1681:g=4:width_type=q:width=0.71,"
+               "highpass=f=38:width_type=q:width=0.5")
+
+# ゲイン調整の目標ラウドネスとピークの上限
+LOUDNESS_TARGET = -16.0
+PEAK_CEILING = -1.0
+
+_CHANNELS = 4  # そのままの L/R + K 特性の L/R
+_EPS = 1e-10
+
+
+def analysis_command(file) -> list:
+    graph = (
+        f"[0:a:0]aresample={ANALYSIS_RATE},"
+        "aformat=sample_fmts=flt:channel_layouts=stereo,asplit[raw][k];"
+        f"[k]{K_WEIGHTING}[kw];[raw][kw]amerge=inputs=2[out]"
+    )
+    return [
+        "ffmpeg", "-v", "error", "-nostdin", "-i", str(file),
+        "-filter_complex", graph, "-map", "[out]",
+        "-f", "f32le", "-acodec", "pcm_f32le", "pipe:1"
+    ]
+
+
+class _Accumulator:
+    """ブロック単位の値を貯める"""
+
+    def __init__(self):
+        self.k_power = []
+        self.rms_db = []
+        self.peak = 0.0
+
+    def add(self, blocks):
+        """blocks: (ブロック数, ブロック内サンプル数, 4) の配列"""
+        x = blocks.astype(np.float64)
+        mean_square = np.mean(x * x, axis=1)
+        self.k_power.append(mean_square[:, 2] + mean_square[:, 3])
+        raw = np.sqrt((mean_square[:, 0] + mean_square[:, 1]) / 2)
+        self.rms_db.append(20 * np.log10(np.maximum(raw, _EPS)))
+        self.peak = max(self.peak, float(np.max(np.abs(x[:, :, :2]), initial=0.0)))
+
+
+def integrated_loudness(k_power) -> float:
+    """100ms ごとの K 特性パワーからゲート付き統合ラウドネス (LUFS)"""
+    if len(k_power) < 4:
+        return None
+    z = np.convolve(k_power, np.ones(4) / 4, mode="valid")  # 400ms 窓・75% 重複
+    loudness = -0.691 + 10 * np.log10(np.maximum(z, _EPS))
+    gated = z[loudness > -70.0]
+    if gated.size == 0:
+        return None
+    relative = -0.691 + 10 * np.log10(np.mean(gated)) - 10.0
+    gated = z[(loudness > -70.0) & (loudness > relative)]
+    if gated.size == 0:
+        return None
+    return float(-0.691 + 10 * np.log10(np.mean(gated)))
+
+
+def silence_spans(rms_db) -> list:
+    """RMS が SILENCE_DB 未満の連続区間（SILENCE_MIN_SECONDS 以上）"""
+    quiet = np.concatenate(([0], (rms_db < SILENCE_DB).astype(np.int8), [0]))
+    edges = np.diff(quiet)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    min_blocks = int(round(SILENCE_MIN_SECONDS / BLOCK_SECONDS))
+    return [
+        [round(float(s) * BLOCK_SECONDS, 3), round(float(e) * BLOCK_SECONDS, 3)]
+        for s, e in zip(starts, ends) if e - s >= min_blocks
+    ]
+
+
+def analyze(file) -> dict:
+    """
+    file の音声を解析する（キャッシュは使わない）
+    音声がなければ None。ffmpeg が失敗したら CalledProcessError
+    """
+    info = media_info(file)
+    if not info or not info["acodec"]:
+        return None
+
+    block = int(ANALYSIS_RATE * BLOCK_SECONDS)
+    block_bytes = block * _CHANNELS * 4
+    read_bytes = block_bytes * int(READ_SECONDS / BLOCK_SECONDS)
+    acc = _Accumulator()
+
+    token = current_token.get()
+    if token is not None:
+        token.check()
+
+    cmd = analysis_command(file)
+    governor = resource_governor.get_governor()
+    with governor.admit("audio_analysis", cmd, token, threads=1) as decision, \
+            timed_stage("audio_analysis", file,
+                        governor=resource_governor.log_fields(decision)):
+        proc = spawn(resource_governor.launch_command(cmd, decision),
+                     stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                     **popen_options(decision))
+        resource_governor.apply_priority(proc, decision)
+        if token is not None:
+            token.register(proc)
+        try:
+            pending = b""
+            while True:
+                data = proc.stdout.read(read_bytes)
+                if not data:
+                    break
+                pending += data
+                usable = len(pending) // block_bytes * block_bytes
+                if usable:
+                    acc.add(np.frombuffer(pending[:usable], dtype="<f4")
+                            .reshape(-1, block, _CHANNELS))
+                    pending = pending[usable:]
+            frames = len(pending) // (_CHANNELS * 4)
+            if frames:
+                acc.add(np.frombuffer(pending[:frames * _CHANNELS * 4], dtype="<f4")
+                        .reshape(1, frames, _CHANNELS))
+            proc.stdout.close()
+            returncode = wait_child(proc)[0]
+        finally:
+            cancel_kill_timer(proc)
+            if token is not None:
+                token.unregister(proc)
+
+    if token is not None:
+        token.check()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+    k_power = np.concatenate(acc.k_power) if acc.k_power else np.zeros(0)
+    rms_db = np.concatenate(acc.rms_db) if acc.rms_db else np.zeros(0)
+    return {
+        "integrated_lufs": integrated_loudness(k_power),
+        "peak_db": round(float(20 * np.log10(max(acc.peak, _EPS))), 2),
+        "block_seconds": BLOCK_SECONDS,
+        "rms_db": [round(float(v), 1) for v in rms_db],
+        "silences": silence_spans(rms_db),
+    }
+
+
+def analysis(file) -> dict:
+    """キャッシュ経由で解析結果を取得（音声がなければ None）"""
+    index = get_index()
+    hit, record = index.lookup(file, "audio")
+    if hit:
+        return record
+    record = analyze(file)
+    index.store(file, record, "audio")
+    return record
+
+
+# =========================
+# 解析結果の利用
+# =========================
+
+def clip_gain(record) -> float:
+    """
+    目標ラウドネスに揃えるゲイン (dB)
+    ピークが PEAK_CEILING を超えないように制限する
+    """
+    if not record or record["integrated_lufs"] is None:
+        return 0.0
+    gain = LOUDNESS_TARGET - record["integrated_lufs"]
+    return round(min(gain, PEAK_CEILING - record["peak_db"]), 1)
+
+
+def nearest_silence(silences, t: float, window: float):
+    """t から window 秒以内で最も近い無音区間の中央（なければ None）"""
+    best = None
+    for start, end in silences:
+        mid = (start + end) / 2
+        if abs(mid - t) <= window and (best is None or abs(mid - t) < abs(best - t)):
+            best = mid
+    return best
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+バッチ実行（JSON マニフェスト）
+
+GUI を使わずに複数の処理をまとめて実行する。
+ジョブの入力に "@<id>" と書くと、そのジョブの出力を入力として使う（依存関係になる）。
+依存関係のないジョブは並列に実行し、出力が入力より新しいジョブは make のように飛ばす。
+
+  {
+    "jobs": [
+      {"id": "master", "op": "concat", "input": "clips", "output": "out/master.mp4"},
+      {"id": "credit", "op": "credit", "input": "@master", "text": "credit.txt",
+       "output": "out/credit.mp4", "fontsize": 40},
+      {"id": "ppt", "op": "compress", "input": "@credit", "output": "out/ppt.mp4",
+       "remove_audio": true},
+      {"id": "seg", "op": "split", "input": "@master", "output": "out/seg",
+       "seconds": 600}
+    ]
+  }
+
+相対パスはマニフェストのあるフォルダからの相対パスとして扱う。
+"""
+
+import json
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import ffmpeg_runner
+from media_index import MEDIA_SUFFIXES
+
+
+# op ごとの定義
+#   params  : マニフェストのキー → 関数の引数名（パスとして扱うもの）
+#   output  : 出力の引数名と種類（"file" または split の "dir"）
+#   options : そのまま関数に渡せるキーと既定値
+OPERATIONS = {
+    "concat": {
+        "params": {"input": "input_dir"},
+        "output": ("output_file", "file"),
+        "options": {"workers": None, "copy_conformant": True,
+                    "rebuild": False, "mode": "files", "loudness": "dynaudnorm"},
+    },
+    "credit": {
+        "params": {"input": "input_file", "text": "text_file"},
+        "output": ("output_file", "file"),
+        "options": {"align": "center", "color": "#FFFFFF", "fontsize": 36,
+                    "start": None, "end": None, "smart": False},
+    },
+    "compress": {
+        "params": {"input": "input_file"},
+        "output": ("output_file", "file"),
+        "options": {"remove_audio": False, "chunks": 1, "target_mb": None},
+    },
+    "split": {
+        "params": {"input": "input_file"},
+        "output": ("output_dir", "dir"),
+        "options": {"seconds": None, "accurate": False, "workers": None,
+                    "silence": False},
+    },
+}
+
+PENDING, DONE, SKIPPED, FAILED, BLOCKED = (
+    "pending", "done", "up-to-date", "failed", "blocked")
+
+
+class ManifestError(ValueError):
+    """マニフェストの書き方が正しくない"""
+
+
+class BatchJob:
+    def __init__(self, spec: dict, base_dir: Path):
+        try:
+            self.id = str(spec["id"])
+            self.op = spec["op"]
+            definition = OPERATIONS[self.op]
+        except KeyError as e:
+            raise ManifestError(f"ジョブの id / op が正しくありません: {spec}") from e
+
+        unknown = set(spec) - {"id", "op", "output"} - set(definition["params"]) \
+            - set(definition["options"])
+        if unknown:
+            raise ManifestError(f"{self.id}: 不明なキー {sorted(unknown)}")
+        if "output" not in spec:
+            raise ManifestError(f"{self.id}: output がありません")
+
+        self.output_kind = definition["output"][1]
+        self.output = (base_dir / spec["output"]).resolve()
+
+        # 入力: 文字列が "@id" なら依存ジョブの出力（解決は resolve で行う）
+        self.inputs = {}
+        self.deps = set()
+        for key, arg in definition["params"].items():
+            if key not in spec:
+                raise ManifestError(f"{self.id}: {key} がありません")
+            value = str(spec[key])
+            if value.startswith("@"):
+                self.deps.add(value[1:])
+                self.inputs[arg] = value
+            else:
+                self.inputs[arg] = (base_dir / value).resolve()
+
+        self.options = {}
+        for key, default in definition["options"].items():
+            value = spec.get(key, default)
+            if value is None and key == "seconds":
+                raise ManifestError(f"{self.id}: seconds がありません")
+            if value is not None:
+                self.options[key] = value
+
+        self.status = PENDING
+        self.ran = False
+
+    def resolve(self, jobs):
+        for arg, value in self.inputs.items():
+            if isinstance(value, str):
+                self.inputs[arg] = jobs[value[1:]].output
+
+    def kwargs(self) -> dict:
+        return {**self.inputs, OPERATIONS[self.op]["output"][0]: self.output,
+                **self.options}
+
+    # ===== 更新の要否 =====
+
+    def _output_mtime(self):
+        """出力の更新時刻（split は区間ファイルのうち最も古いもの）"""
+        if self.output_kind == "dir":
+            stem = Path(self.inputs["input_file"]).stem
+            times = [p.stat().st_mtime for p in self.output.glob(f"{stem}_*.mp4")]
+            return min(times) if times else None
+        return self.output.stat().st_mtime if self.output.is_file() else None
+
+    def _input_mtime(self):
+        """入力の更新時刻（フォルダは直下の動画のうち最も新しいもの）"""
+        newest = 0.0
+        for path in self.inputs.values():
+            path = Path(path)
+            if path.is_dir():
+                times = [f.stat().st_mtime for f in path.iterdir()
+                         if f.suffix.lower() in MEDIA_SUFFIXES]
+                newest = max([newest, *times])
+            elif path.exists():
+                newest = max(newest, path.stat().st_mtime)
+        return newest
+
+    def up_to_date(self) -> bool:
+        out = self._output_mtime()
+        return out is not None and out >= self._input_mtime()
+
+
+def load_manifest(path: Path) -> dict:
+    """
+    マニフェストを読み込み {id: BatchJob} を返す（記述順）
+    依存先がない・循環している場合は ManifestError
+    """
+    path = Path(path)
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    jobs = {}
+    for spec in data.get("jobs", []):
+        job = BatchJob(spec, path.parent.resolve())
+        if job.id in jobs:
+            raise ManifestError(f"id が重複しています: {job.id}")
+        jobs[job.id] = job
+
+    for job in jobs.values():
+        missing = job.deps - set(jobs)
+        if missing:
+            raise ManifestError(f"{job.id}: 依存先がありません {sorted(missing)}")
+        job.resolve(jobs)
+
+    # 循環チェック（深さ優先）
+    state = {}
+
+    def visit(job_id, chain):
+        if state.get(job_id) == "done":
+            return
+        if state.get(job_id) == "visiting":
+            raise ManifestError("依存関係が循環しています: " + " -> ".join(chain + [job_id]))
+        state[job_id] = "visiting"
+        for dep in jobs[job_id].deps:
+            visit(dep, chain + [job_id])
+        state[job_id] = "done"
+
+    for job_id in jobs:
+        visit(job_id, [])
+
+    return jobs
+
+
+def run_manifest(jobs: dict, functions: dict, max_jobs: int = 1,
+                 force: bool = False, dry_run: bool = False) -> dict:
+    """
+    jobs      : load_manifest の結果
+    functions : op 名 → 実行する関数（キーワード引数で呼ぶ）
+    max_jobs  : 同時に実行するジョブ数
+    force     : 出力が新しくても実行する
+    dry_run   : 実行せずに、実行するジョブを表示する
+
+    依存先が失敗したジョブは実行しない。
+    戻り値: {id: 状態}
+    """
+    def ready(job):
+        return all(jobs[d].status in (DONE, SKIPPED) for d in job.deps)
+
+    def needs_run(job):
+        if force or any(jobs[d].ran for d in job.deps):
+            return True
+        return not job.up_to_date()
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, int(max_jobs))) as pool:
+        while True:
+            for job in jobs.values():
+                if job.status != PENDING or job in running.values():
+                    continue
+                if any(jobs[d].status in (FAILED, BLOCKED) for d in job.deps):
+                    job.status = BLOCKED
+                    print(f"[{job.id}] 依存ジョブが失敗したため実行しません")
+                    continue
+                if not ready(job):
+                    continue
+                if not needs_run(job):
+                    job.status = SKIPPED
+                    print(f"[{job.id}] 最新のためスキップ: {job.output}")
+                    continue
+                if dry_run:
+                    job.status = DONE
+                    job.ran = True
+                    print(f"[{job.id}] 実行予定: {job.op} -> {job.output}")
+                    continue
+                print(f"[{job.id}] 開始: {job.op} -> {job.output}")
+                if job.output_kind == "dir":
+                    job.output.mkdir(parents=True, exist_ok=True)
+                else:
+                    job.output.parent.mkdir(parents=True, exist_ok=True)
+                future = ffmpeg_runner.submit(pool, functions[job.op], **job.kwargs())
+                running[future] = job
+
+            if not running:
+                if any(job.status == PENDING for job in jobs.values()):
+                    # dry_run や BLOCKED の連鎖で状態が変わった分を処理し直す
+                    continue
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job = running.pop(future)
+                try:
+                    future.result()
+                    job.status = DONE
+                    job.ran = True
+                    print(f"[{job.id}] 完了")
+                except Exception as e:
+                    job.status = FAILED
+                    print(f"[{job.id}] 失敗: {e}")
+
+    return {job_id: job.status for job_id, job in jobs.items()}
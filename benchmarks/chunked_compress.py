@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+compress_for_powerpoint の1プロセス版と区間並列版の速度比較
+
+testsrc2 / sine で作った合成動画を両方の方法で圧縮し、実時間を比べる。
+  python benchmarks/chunked_compress.py [--duration 600] [--chunks 0]
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import movieProcess  # noqa: E402
+from synthetic import make_clip  # noqa: E402
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=600.0,
+                        help="合成動画の長さ（秒）")
+    parser.add_argument("--chunks", type=int, default=0,
+                        help="区間並列版の区間数（0: 自動）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_") as tmp:
+        tmp = Path(tmp)
+        src = tmp / "input.mp4"
+        make_clip(src, args.duration, gop=60)
+
+        single = timed(movieProcess.compress_for_powerpoint,
+                       src, tmp / "single.mp4", False, 1)
+        chunked = timed(movieProcess.compress_for_powerpoint,
+                        src, tmp / "chunked.mp4", False, args.chunks)
+
+        sizes = {name: (tmp / f"{name}.mp4").stat().st_size
+                 for name in ("single", "chunked")}
+
+    print(f"1プロセス : {single:7.1f}秒  {sizes['single'] / 1e6:.1f}MB")
+    print(f"区間並列  : {chunked:7.1f}秒  {sizes['chunked'] / 1e6:.1f}MB")
+    print(f"速度比    : {single / chunked:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
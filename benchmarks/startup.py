@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+起動時間のベンチマーク
+
+スクリプト版（python movieProcess.py）と、--exe を指定した場合は EXE 版について
+  import       : movieProcess の import にかかる時間（スクリプト版のみ）
+  window       : GUI のウィンドウが表示されるまで
+  first_job    : CLI で短い分割ジョブを1つ実行して終了するまで
+  overhead     : first_job のうち ffmpeg / ffprobe 以外の時間（起動・import など）
+を測り、各 --repeat 回の中央値と1回目（キャッシュが冷えている状態に近い値）を表示する。
+window の計測には flet と表示環境が必要（MOVIEPROCESS_STARTUP_PROBE 参照）。
+
+  python benchmarks/startup.py
+  python benchmarks/startup.py --exe dist/movieProcess.exe --exe dist/movieProcess/movieProcess.exe
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from synthetic import make_clip  # noqa: E402
+
+
+SCRIPT = Path(__file__).resolve().parent.parent / "movieProcess.py"
+
+# 起動時に読み込まれてはいけないモジュール
+LAZY_MODULES = ("tkinter", "flet", "numpy")
+
+# 最初のジョブに使うクリップの長さ（秒）。短くして起動時間を目立たせる
+CLIP_SECONDS = 2.0
+
+WINDOW_TIMEOUT = 120.0
+
+
+def measure_import(env):
+    """戻り値: (秒, 読み込まれてしまった LAZY_MODULES)"""
+    code = (
+        "import sys, time, json\n"
+        "t = time.perf_counter()\n"
+        "import movieProcess\n"
+        "print(json.dumps([time.perf_counter() - t,"
+        f" [m for m in {LAZY_MODULES!r} if m in sys.modules]]))\n"
+    )
+    out = subprocess.run([sys.executable, "-c", code], cwd=SCRIPT.parent, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    seconds, loaded = json.loads(out)
+    return seconds, loaded
+
+
+def measure_window(command, env, work: Path):
+    """GUI を起動し、ウィンドウを表示できた時刻までの秒数（測れなければ None）"""
+    probe = work / "window.json"
+    probe.unlink(missing_ok=True)
+    env = {**env, "MOVIEPROCESS_STARTUP_PROBE": str(probe)}
+    started = time.time()
+    try:
+        subprocess.run(command, env=env, timeout=WINDOW_TIMEOUT,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except subprocess.TimeoutExpired:
+        return None
+    try:
+        with open(probe, "r", encoding="utf-8") as f:
+            return json.load(f)["window"] - started
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def measure_first_job(command, env, clip: Path, work: Path):
+    """戻り値: (全体の秒数, ffmpeg / ffprobe 以外の秒数)"""
+    out_dir = work / "split"
+    shutil.rmtree(out_dir, ignore_errors=True)
+    log = work / "timing.jsonl"
+    log.unlink(missing_ok=True)
+    env = {**env, "MOVIEPROCESS_TIMING_LOG": str(log)}
+
+    started = time.perf_counter()
+    subprocess.run([*command, "split", str(clip), str(out_dir), "1"], env=env,
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    total = time.perf_counter() - started
+
+    # probe 段階（ffprobe）と ffmpeg の実行時間を除いた残りが起動のコスト
+    external = 0.0
+    with open(log, "r", encoding="utf-8") as f:
+        for line in f:
+            event = json.loads(line)
+            external += event.get("wall") or 0.0
+    return total, max(0.0, total - external)
+
+
+def summarize(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {"first": round(values[0], 3), "median": round(statistics.median(values), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="起動時間のベンチマーク")
+    parser.add_argument("--exe", type=Path, action="append", default=[],
+                        help="比較する EXE（複数指定可: 1ファイル版とフォルダ版など）")
+    parser.add_argument("--repeat", type=int, default=5, help="各計測の回数")
+    parser.add_argument("--no-window", action="store_true",
+                        help="GUI の計測をしない（表示環境がない場合）")
+    parser.add_argument("--output", type=Path, help="結果の保存先（JSON）")
+    args = parser.parse_args()
+    repeat = max(1, args.repeat)
+
+    work = Path(tempfile.mkdtemp(prefix="movieprocess_startup_"))
+    # キャッシュは作業フォルダに置き、各計測で共通にする
+    # （2回目以降は ffmpeg の確認・ffprobe の結果がキャッシュから返る）
+    os.environ["MOVIEPROCESS_CACHE_DIR"] = str(work / "cache")
+    env = dict(os.environ)
+    try:
+        clip = make_clip(work / "clip.mp4", CLIP_SECONDS)
+
+        targets = [("script", [sys.executable, str(SCRIPT)])]
+        targets += [(str(exe), [str(exe.resolve())]) for exe in args.exe]
+
+        results = {}
+        imports = [measure_import(env) for _ in range(repeat)]
+        results["import"] = summarize([s for s, _ in imports])
+        loaded = sorted({m for _, mods in imports for m in mods})
+        print(f"{'import':10s} {results['import']['median']:7.3f}s"
+              + (f"  注意: 起動時に読み込まれたモジュール {loaded}" if loaded else ""))
+
+        for name, command in targets:
+            result = {}
+            if not args.no_window:
+                result["window"] = summarize(
+                    [measure_window(command, env, work) for _ in range(repeat)])
+            jobs = [measure_first_job(command, env, clip, work) for _ in range(repeat)]
+            result["first_job"] = summarize([t for t, _ in jobs])
+            result["overhead"] = summarize([o for _, o in jobs])
+            results[name] = result
+            for key, value in result.items():
+                text = "測定できません" if value is None else \
+                    f"{value['median']:7.3f}s (1回目 {value['first']:.3f}s)"
+                print(f"{name} {key:10s} {text}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print("結果:", args.output)
+
+
+if __name__ == "__main__":
+    main()
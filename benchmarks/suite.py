@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+処理速度のベンチマーク
+
+合成メディア（synthetic.py）で convert_video / concat_videos / split_video /
+add_credit / compress_for_powerpoint を実行し、ケースごとに
+  wall  : 実時間（秒）
+  cpu   : CPU 時間（ffmpeg 子プロセス + このプロセス、秒）
+  rss   : ffmpeg 子プロセスの最大メモリ使用量（バイト）
+  rtf   : 実時間に対する処理速度（動画の長さ / wall）
+  bytes : 出力サイズ
+を JSON に保存する。--baseline を指定すると比較し、悪化があれば終了コード 1。
+
+  python benchmarks/suite.py --output results.json
+  python benchmarks/suite.py --baseline results.json --tolerance 0.15
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from synthetic import make_clip, make_credit_text  # noqa: E402
+
+
+# 入力クリップ: 解像度・フレームレート・回転・コンテナの組み合わせ
+CLIPS = [
+    ("hd_30", {"size": "1920x1080", "rate": "30", "suffix": ".mp4"}),
+    ("hd_2997_rot90", {"size": "1920x1080", "rate": "30000/1001",
+                       "rotation": 90, "suffix": ".mov"}),
+    ("hd_60", {"size": "1280x720", "rate": "60", "suffix": ".mts"}),
+    ("sd_25", {"size": "720x576", "rate": "25", "suffix": ".mp4"}),
+    ("vertical_rot270", {"size": "1080x1920", "rate": "30",
+                         "rotation": 270, "suffix": ".mov"}),
+]
+
+# クリップ1本の長さ（秒、--scale で倍率を変える）
+CLIP_SECONDS = 20.0
+
+CREDIT_LINES = (20, 200, 1000)
+
+SPLIT_SECONDS = 10
+
+# 比較する指標と、悪化とみなす最小の差（小さな揺れは無視する）
+COMPARED_METRICS = {"wall": 0.25, "cpu": 0.25, "rss": 16 * 1024 ** 2, "bytes": 0}
+
+
+# =========================
+# 測定
+# =========================
+
+class _Recorder:
+    """ffmpeg_runner の end イベントを集める"""
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        if event["event"] == "end" and "returncode" in event:
+            self.events.append(event)
+
+
+def _output_size(path: Path):
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return path.stat().st_size if path.exists() else None
+
+
+def measure(fn, args, media_duration, output: Path):
+    """fn(*args) を1回実行して指標を返す"""
+    import ffmpeg_runner
+
+    recorder = _Recorder()
+    ffmpeg_runner.add_listener(recorder)
+    try:
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        fn(*args)
+        wall = time.perf_counter() - started
+        own_cpu = time.process_time() - cpu_started
+    finally:
+        ffmpeg_runner.remove_listener(recorder)
+
+    child_cpu = sum(e["cpu"] or 0.0 for e in recorder.events)
+    rss = [e["rss"] for e in recorder.events if e.get("rss")]
+    return {
+        "wall": round(wall, 3),
+        "cpu": round(child_cpu + own_cpu, 3),
+        "rss": max(rss) if rss else None,
+        "rtf": round(media_duration / wall, 3) if wall > 0 else None,
+        "bytes": _output_size(output),
+        "ffmpeg_runs": len(recorder.events),
+    }
+
+
+def run_case(results, name, fn, args, media_duration, output, repeat):
+    """repeat 回実行し、各指標の中央値を記録する"""
+    runs = [measure(fn, args, media_duration, output) for _ in range(repeat)]
+    result = {}
+    for key in runs[0]:
+        values = [r[key] for r in runs if r[key] is not None]
+        result[key] = statistics.median(values) if values else None
+    result["media_duration"] = media_duration
+    results[name] = result
+    print(f"{name:28s} wall={result['wall']:7.2f}s cpu={result['cpu']:7.2f}s "
+          f"rtf={result['rtf'] or 0:6.2f}x", flush=True)
+
+
+# =========================
+# ケース
+# =========================
+
+def run_suite(work: Path, scale: float = 1.0, repeat: int = 1, only=None):
+    import movieProcess
+
+    def selected(name):
+        return not only or name.split("/")[0] in only
+
+    clips_dir = work / "clips"
+    clips_dir.mkdir()
+    seconds = CLIP_SECONDS * scale
+    clips = {}
+    for n, (name, spec) in enumerate(CLIPS):
+        spec = dict(spec)
+        suffix = spec.pop("suffix")
+        clips[name] = make_clip(clips_dir / f"{n:02d}_{name}{suffix}", seconds,
+                                frequency=220 * (n + 1), **spec)
+
+    results = {}
+    out = work / "out"
+    out.mkdir()
+
+    for name, clip in clips.items():
+        if selected("convert"):
+            dst = out / f"convert_{name}.mp4"
+            run_case(results, f"convert/{name}", movieProcess.convert_video,
+                     (clip, dst), seconds, dst, repeat)
+
+    master = out / "master.mp4"
+    master_seconds = seconds * len(clips)
+    for mode in ("files", "stream"):
+        if selected("concat") or mode == "files":
+            dst = out / f"concat_{mode}.mp4"
+            run_case(results, f"concat/{mode}", movieProcess.concat_videos,
+                     (clips_dir, dst, None,
+                      True, True, mode),
+                     master_seconds, dst, repeat)
+    os.replace(out / "concat_files.mp4", master)
+
+    if selected("split"):
+        for accurate in (False, True):
+            dst = out / f"split_{'accurate' if accurate else 'fast'}"
+            dst.mkdir()
+            run_case(results, f"split/{'accurate' if accurate else 'fast'}",
+                     movieProcess.split_video,
+                     (master, dst, SPLIT_SECONDS, accurate),
+                     master_seconds, dst, repeat)
+
+    if selected("credit"):
+        for lines in CREDIT_LINES:
+            text = make_credit_text(work / f"credit_{lines}.txt", lines)
+            dst = out / f"credit_{lines}.mp4"
+            run_case(results, f"credit/{lines}_lines", movieProcess.add_credit,
+                     (master, text, "center", "#FFFFFF", 36, dst),
+                     master_seconds, dst, repeat)
+
+    if selected("compress"):
+        for remove_audio in (False, True):
+            label = "no_audio" if remove_audio else "audio"
+            dst = out / f"compress_{label}.mp4"
+            run_case(results, f"compress/{label}",
+                     movieProcess.compress_for_powerpoint,
+                     (master, dst, remove_audio),
+                     master_seconds, dst, repeat)
+
+    return results
+
+
+# =========================
+# 比較
+# =========================
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """
+    baseline より tolerance（割合）以上悪化した指標
+    戻り値: [(ケース, 指標, 基準値, 今回の値), ...]
+    """
+    regressions = []
+    for case, base in baseline.get("results", {}).items():
+        current = results.get(case)
+        if current is None:
+            continue
+        for metric, min_delta in COMPARED_METRICS.items():
+            b, c = base.get(metric), current.get(metric)
+            if b is None or c is None:
+                continue
+            if c > b * (1 + tolerance) and c - b > min_delta:
+                regressions.append((case, metric, b, c))
+    return regressions
+
+
+def machine_info():
+    try:
+        ffmpeg = subprocess.run(["ffmpeg", "-version"], capture_output=True,
+                                text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        ffmpeg = None
+    return {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "ffmpeg": ffmpeg,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="処理速度のベンチマーク")
+    parser.add_argument("--output", type=Path, default=Path("benchmark_results.json"),
+                        help="結果の保存先")
+    parser.add_argument("--baseline", type=Path,
+                        help="比較する以前の結果（悪化があれば終了コード 1）")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="悪化とみなす割合（0.15 = 15%%）")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="合成クリップの長さの倍率")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="各ケースの実行回数（中央値を記録）")
+    parser.add_argument("--only", nargs="*",
+                        choices=["convert", "concat", "split", "credit", "compress"],
+                        help="実行するケースの種類")
+    parser.add_argument("--keep", action="store_true",
+                        help="作業フォルダを削除しない")
+    args = parser.parse_args()
+
+    work = Path(tempfile.mkdtemp(prefix="movieprocess_bench_"))
+    # キャッシュ・ログは作業フォルダに置き、普段の環境に影響させない
+    os.environ["MOVIEPROCESS_CACHE_DIR"] = str(work / "cache")
+    os.environ["MOVIEPROCESS_TIMING_LOG"] = str(work / "timing.jsonl")
+
+    try:
+        results = run_suite(work, args.scale, max(1, args.repeat), args.only)
+    finally:
+        if args.keep:
+            print("作業フォルダ:", work)
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+    data = {
+        "machine": machine_info(),
+        "settings": {"scale": args.scale, "repeat": args.repeat},
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print("結果:", args.output)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("machine") != data["machine"]:
+            print("注意: 基準の測定環境が異なります", file=sys.stderr)
+        if baseline.get("settings") != data["settings"]:
+            print("注意: 基準の測定条件（--scale / --repeat）が異なります", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        for case, metric, b, c in regressions:
+            print(f"悪化: {case} {metric} {b} -> {c} ({(c / b - 1) * 100:+.0f}%)")
+        if regressions:
+            sys.exit(1)
+        print("基準からの悪化はありません")
+
+
+if __name__ == "__main__":
+    main()
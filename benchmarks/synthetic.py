@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+ベンチマーク用の合成メディア
+
+ffmpeg の testsrc2（映像）と sine（音声）から毎回同じ内容の動画を作る。
+ネットワークや手元の素材がなくても同じ条件で測定できる。
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ffmpeg_runner import run_ffmpeg  # noqa: E402
+
+
+# コンテナごとの出力形式
+FORMATS = {".mp4": "mp4", ".mov": "mov", ".mts": "mpegts"}
+
+
+def make_clip(path: Path, duration: float, size: str = "1280x720",
+              rate: str = "30", rotation: int = 0, frequency: int = 440,
+              gop: int = None):
+    """
+    path     : 出力先（拡張子で .mp4 / .mov / .mts を選ぶ）
+    size     : "幅x高さ"
+    rate     : フレームレート（"30000/1001" 形式も可）
+    rotation : 表示回転（度）。0 以外は回転情報を付けて詰め替える
+    gop      : キーフレーム間隔（フレーム数）。None なら x264 の既定
+    """
+    path = Path(path)
+    target = path.with_name(f"{path.stem}.norot{path.suffix}") if rotation else path
+
+    cmd = [
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi", "-i", f"testsrc2=s={size}:r={rate}:d={duration}",
+        "-f", "lavfi",
+        "-i", f"sine=frequency={frequency}:sample_rate=48000:d={duration}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-b:a", "128k",
+        "-fflags", "+bitexact", "-shortest",
+    ]
+    if gop:
+        cmd += ["-g", str(gop)]
+    cmd += ["-f", FORMATS[path.suffix.lower()], str(target)]
+    run_ffmpeg(cmd, "bench_input", output=target, duration=duration)
+
+    if rotation:
+        # -display_rotation は入力側オプション（ffmpeg 6.0 以降）
+        cmd = [
+            "ffmpeg", "-y", "-v", "error",
+            "-display_rotation", str(rotation), "-i", str(target),
+            "-c", "copy", "-f", FORMATS[path.suffix.lower()], str(path)
+        ]
+        run_ffmpeg(cmd, "bench_input", target, path, duration)
+        target.unlink()
+
+    return path
+
+
+def make_credit_text(path: Path, lines: int):
+    """lines 行のクレジットテキスト（記号を含めてエスケープも測る）"""
+    roles = ["監督", "撮影", "編集", "音響", "出演", "Special Thanks"]
+    with open(path, "w", encoding="utf-8") as f:
+        for n in range(lines):
+            if n % 7 == 6:
+                f.write("\n")
+            else:
+                f.write(f"{roles[n % len(roles)]}: Name {n:04d} [50%, a:b]\n")
+    return Path(path)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+1本の長い動画を時間で区切って並列エンコードする
+
+キーフレーム位置で N 個の区間に分け、同じ設定で映像だけを並列にエンコードし、
+concat demuxer でストリームコピーしてつなぐ。
+音声は区間の継ぎ目で途切れないよう、全体を1回だけエンコードして多重化する。
+
+1プロセスの x264 は解像度が小さいとスレッドを増やしても速くならないため、
+コア数の多いマシンでは区間ごとにプロセスを分けた方が速い。
+farm（encode_farm.Coordinator）を渡すと、区間のエンコードを他のマシンに任せる。
+"""
+
+import bisect
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import ffmpeg_runner
+from encode_farm import make_task, run_task
+from ffmpeg_runner import run_ffmpeg
+from media_index import keyframe_times
+
+
+# 1区間あたりのエンコーダのスレッド数
+CHUNK_THREADS = 4
+
+# これより短い区間には分けない（秒）。起動・シークのコストの方が大きくなる
+CHUNK_MIN_SECONDS = 60.0
+
+
+def chunk_count(duration: float, cpu_count: int) -> int:
+    """動画の長さとコア数から区間数を決める（1 なら分割しない）"""
+    by_cpu = max(1, cpu_count // CHUNK_THREADS)
+    by_length = max(1, int(duration // CHUNK_MIN_SECONDS))
+    return min(by_cpu, by_length)
+
+
+def plan_chunks(keyframes, duration: float, count: int):
+    """
+    [0, duration) を count 個に等分し、各境界を最も近いキーフレームに合わせる
+    戻り値: [(開始, 終了), ...]（重複した境界はまとめる）
+    """
+    bounds = [0.0]
+    for n in range(1, count):
+        target = duration * n / count
+        i = bisect.bisect_left(keyframes, target)
+        candidates = keyframes[max(i - 1, 0):i + 1]
+        t = min(candidates, key=lambda k: abs(k - target)) if candidates else target
+        if bounds[-1] < t < duration:
+            bounds.append(t)
+    bounds.append(duration)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def chunk_task(input_file, start, end, out, video_filter, video_args,
+               threads=CHUNK_THREADS) -> dict:
+    """区間の映像だけをエンコードするタスク（encode_farm 参照）"""
+    return make_task("encode_chunk", input_file, out, video_filter, video_args,
+                     start=start, end=end, threads=threads)
+
+
+def encode_chunk(input_file, start, end, out, video_filter, video_args,
+                 threads=CHUNK_THREADS):
+    """区間の映像だけをエンコード"""
+    run_task(chunk_task(input_file, start, end, out, video_filter, video_args,
+                        threads))
+
+
+def encode_audio(input_file, out, audio_args, duration=None):
+    """音声だけを全体で1回エンコード"""
+    cmd = ["ffmpeg", "-y", "-v", "error", "-i", str(input_file),
+           "-vn", *audio_args, str(out)]
+    run_ffmpeg(cmd, "encode_audio", input_file, out, duration)
+
+
+def encode_chunked(input_file, output_file, duration, video_filter,
+                   video_args, audio_args=None, count=None, cpu_count=1,
+                   extra_args=(), farm=None):
+    """
+    input_file を count 個（None なら chunk_count で決める）に分けて並列エンコード
+    audio_args : 音声のエンコード設定。None なら音声なし
+    extra_args : 最終出力に付けるオプション（-movflags +faststart など）
+    farm       : encode_farm.Coordinator。区間をワーカーでエンコードする
+                 （入力と出力先はワーカーから見える共有ストレージに置く）
+    戻り値: 実際の区間数
+    """
+    if count is None:
+        if farm is not None:
+            cpu_count = max(cpu_count, farm.capacity() * CHUNK_THREADS)
+        count = chunk_count(duration, cpu_count)
+    chunks = plan_chunks(keyframe_times(input_file), duration, max(1, count))
+
+    work_dir = Path(tempfile.mkdtemp(prefix=".chunks_", dir=Path(output_file).parent))
+    try:
+        parts = [work_dir / f"chunk_{n:03d}.mp4" for n in range(len(chunks))]
+        audio = work_dir / "audio.m4a" if audio_args is not None else None
+        threads = max(1, min(CHUNK_THREADS, cpu_count // len(chunks) or 1))
+
+        with ThreadPoolExecutor(max_workers=len(chunks) + 1) as pool:
+            futures = []
+            if audio is not None:
+                futures.append(ffmpeg_runner.submit(
+                    pool, encode_audio, input_file, audio, audio_args, duration))
+            if farm is None:
+                futures += [
+                    ffmpeg_runner.submit(pool, encode_chunk, input_file, s, e, part,
+                                         video_filter, video_args, threads)
+                    for (s, e), part in zip(chunks, parts)
+                ]
+            else:
+                # スレッド数はワーカー側の ffmpeg に任せる
+                failed = farm.run([
+                    chunk_task(Path(input_file).resolve(), s, e, part.resolve(),
+                               video_filter, video_args, 0)
+                    for (s, e), part in zip(chunks, parts)
+                ])
+                if failed:
+                    raise RuntimeError(f"{len(failed)} 区間のエンコードに失敗しました: "
+                                       f"{failed[0][1]}")
+                missing = [p.name for p in parts if not p.is_file()]
+                if missing:
+                    raise RuntimeError(f"ワーカーの出力が見つかりません: {missing}")
+            for future in futures:
+                future.result()
+
+        concat_list = work_dir / "list.txt"
+        with open(concat_list, "w", encoding="utf-8") as f:
+            for p in parts:
+                f.write(f"file '{p}'\n")
+
+        cmd = ["ffmpeg", "-y", "-v", "error",
+               "-f", "concat", "-safe", "0", "-i", str(concat_list)]
+        if audio is not None:
+            cmd += ["-i", str(audio), "-map", "0:v", "-map", "1:a?"]
+        cmd += ["-c", "copy", *extra_args, str(output_file)]
+        run_ffmpeg(cmd, "join", concat_list, output_file, duration)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return len(chunks)
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+クレジットロール描画エンジン
+
+クレジット全体を透過 PNG（縦長の1枚、長い場合は数枚のタイル）に一度だけ
+drawtext で描画し、動画には overlay 1つ（タイルごとに1つ）で合成する。
+フレームごとの drawtext 評価が不要になり、エンコード速度が行数に依存しない。
+
+スクロール量・開始/終了タイミング・x 位置は従来の drawtext 版と同じ計算。
+プレビュー（render_preview）も同じタイル・同じ overlay 式を使い、
+数フレームだけを描画する。
+"""
+
+import bisect
+import math
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import ffmpeg_runner
+import smart_cut
+from ffmpeg_runner import run_ffmpeg
+from media_index import keyframe_times
+
+
+# スクロールは開始3秒後から終了3秒前まで
+SCROLL_MARGIN = 3.0
+
+# 1枚のタイルの最大高さ（px）。これを超える場合は複数枚に分ける
+TILE_MAX_HEIGHT = 8192
+
+# 再エンコード区間が全体のこの割合を超えるなら全体を描画した方が簡単で速い
+SMART_RENDER_MAX_RATIO = 0.8
+
+# プレビューする位置（スクロール区間に対する割合）
+# 区間のちょうど端ではクレジットが画面外にあるため、少し内側を見る
+PREVIEW_POINTS = (0.1, 0.5, 0.9)
+
+# 動画でプレビューするときの長さ（秒、区間の中央）と縮小率
+PREVIEW_CLIP_SECONDS = 4.0
+PREVIEW_SCALE = 0.5
+
+
+# =========================
+# 共通
+# =========================
+
+def hex_to_ffmpeg_color(hex_color):
+    return "0x" + hex_color.lstrip("#").upper()
+
+
+def escape_drawtext(text):
+    """drawtext フィルタ用エスケープ"""
+    text = text.replace("\\", "\\\\")   # バックスラッシュ (最初に処理)
+    text = text.replace("'",  "\u2019") # シングルクォートは全角代替
+    text = text.replace(":",  "\\:")
+    text = text.replace(",",  "\\,")
+    text = text.replace("[",  "\\[")
+    text = text.replace("]",  "\\]")
+    text = text.replace("%",  "\\%")
+    return text
+
+
+def read_credit_lines(text_file):
+    """改行ごとに1行。空行は高さを保つために空白1文字にする"""
+    with open(text_file, "r", encoding="utf-8") as f:
+        return [line.rstrip("\n") if line.strip() else " " for line in f]
+
+
+def align_x_expr(align):
+    """drawtext の x 式（w は動画幅、tw はテキスト幅）"""
+    if align == "left":
+        return "50"
+    if align == "right":
+        return "w-tw-50"
+    return "(w-tw)/2"
+
+
+def credit_timing(duration, video_height, line_count, fontsize,
+                  start=None, end=None):
+    """
+    スクロールのタイミングと速度
+    画面下端から登場し、テキスト全体が画面上に消え切るまでを
+    開始 SCROLL_MARGIN 秒後～終了 SCROLL_MARGIN 秒前に収める
+    start / end を指定した場合はその区間（秒）でスクロールする
+    """
+    line_height  = int(fontsize * 1.5)
+    total_text_h = line_count * line_height
+
+    scroll_start = SCROLL_MARGIN if start is None else float(start)
+    scroll_end   = duration - SCROLL_MARGIN if end is None else float(end)
+    if not 0 <= scroll_start < scroll_end <= duration:
+        raise ValueError("クレジットの表示区間が動画の範囲外です")
+    scroll_dur   = scroll_end - scroll_start
+    scroll_dist  = video_height + total_text_h
+    speed        = scroll_dist / scroll_dur  # px/sec
+
+    return {
+        "duration": duration,
+        "line_height": line_height,
+        "total_text_h": total_text_h,
+        "scroll_start": scroll_start,
+        "scroll_end": scroll_end,
+        "speed": speed,
+    }
+
+
+# =========================
+# クレジット画像の作成
+# =========================
+
+def render_credit_tiles(lines, width, fontsize, color, align, line_height, out_dir,
+                        first_line=0):
+    """
+    クレジットを透過 PNG に描画する
+    first_line : lines がクレジット全体の何行目からか（一部だけ描画する場合）
+    戻り値: [(PNG のパス, クレジット先頭からの y オフセット), ...]
+    """
+    out_dir = Path(out_dir)
+    ffmpeg_color = hex_to_ffmpeg_color(color)
+    x_expr = align_x_expr(align)
+
+    per_tile = max(1, TILE_MAX_HEIGHT // line_height)
+    tiles = []
+
+    for start in range(0, len(lines), per_tile):
+        chunk = lines[start:start + per_tile]
+        tile_h = len(chunk) * line_height
+
+        filters = []
+        for i, line in enumerate(chunk):
+            filters.append(
+                f"drawtext=text='{escape_drawtext(line)}'"
+                f":fontsize={fontsize}"
+                f":fontcolor={ffmpeg_color}"
+                f":x={x_expr}"
+                f":y={i * line_height}"
+            )
+
+        png = out_dir / f"credit_{first_line + start:06d}.png"
+        cmd = [
+            "ffmpeg", "-y", "-v", "error",
+            "-f", "lavfi",
+            "-i", f"color=c=black@0.0:s={width}x{tile_h},format=rgba",
+            "-vf", ",".join(filters),
+            "-frames:v", "1",
+            str(png)
+        ]
+        run_ffmpeg(cmd, "credit_layer", output=png)
+        tiles.append((png, (first_line + start) * line_height))
+
+    return tiles
+
+
+def credit_filter_graph(tiles, timing, t_offset=0.0, input_index=1):
+    """
+    overlay でタイルを合成する filter_complex
+    y は従来の drawtext と同じ  h - speed*(t - scroll_start) + オフセット
+    t_offset : 入力の先頭が元動画の何秒目か（一部だけ描画する場合に使う）
+    タイル画像は1フレームだけなので overlay は最後のフレームを使い続ける
+    """
+    speed = timing["speed"]
+    start = timing["scroll_start"] - t_offset
+    end   = timing["scroll_end"] - t_offset
+    enable_expr = f"gte(t,{start})*lte(t,{end})"
+
+    chains = []
+    prev = "0:v"
+    for k, (_, y_offset) in enumerate(tiles):
+        label = "v" if k == len(tiles) - 1 else f"c{k}"
+        chains.append(
+            f"[{prev}][{input_index + k}:v]overlay=x=0"
+            f":y='H-{speed:.4f}*(t-({start}))+{y_offset}'"
+            f":enable='{enable_expr}'[{label}]"
+        )
+        prev = label
+
+    return ";".join(chains)
+
+
+# =========================
+# 実行
+# =========================
+
+def render_credits(input_file, lines, width, timing,
+                   align, color, fontsize, output_file):
+    """
+    input_file に lines のクレジットロールを合成して output_file に保存
+    timing : credit_timing の結果
+    """
+    work_dir = tempfile.mkdtemp(prefix="credit_")
+    try:
+        tiles = render_credit_tiles(lines, width, fontsize, color, align,
+                                    timing["line_height"], work_dir)
+
+        cmd = ["ffmpeg", "-y", "-i", str(input_file)]
+        for png, _ in tiles:
+            cmd += ["-i", str(png)]
+        cmd += [
+            "-filter_complex", credit_filter_graph(tiles, timing),
+            "-map", "[v]", "-map", "0:a?",
+            "-codec:a", "copy",
+            str(output_file)
+        ]
+        run_ffmpeg(cmd, "credit", input_file, output_file, timing["duration"])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# =========================
+# 部分再エンコード（スマートレンダー）
+# =========================
+
+def smart_render_range(keyframes, timing, duration):
+    """
+    クレジット区間を含むキーフレーム境界の区間 (k0, k1)
+    k0: scroll_start 以前の最後のキーフレーム（なければ動画の先頭）
+    k1: scroll_end より後の最初のキーフレーム（なければ動画の終わり）
+    keyframes は media_index.keyframe_times の値（-ss と同じ start_time 基準）
+    """
+    if not keyframes:
+        return 0.0, duration
+    i = bisect.bisect_right(keyframes, timing["scroll_start"]) - 1
+    k0 = keyframes[i] if i >= 0 else 0.0
+    j = bisect.bisect_right(keyframes, timing["scroll_end"])
+    k1 = keyframes[j] if j < len(keyframes) else duration
+    return k0, k1
+
+
+def render_credits_smart(input_file, lines, info, timing,
+                         align, color, fontsize, output_file):
+    """
+    クレジットが表示されるキーフレーム区間だけを再エンコードし、
+    前後は映像をストリームコピーしてつなぎ直す。音声は全体をそのままコピー。
+    対応していないコーデックや区間が長すぎる場合は render_credits に任せる。
+
+    info : media_index のレコード
+    戻り値: "smart" または "full"
+    """
+    duration = info["duration"]
+
+    k0, k1 = smart_render_range(keyframe_times(input_file), timing, duration)
+
+    if not smart_cut.supports(info) or (k1 - k0) > duration * SMART_RENDER_MAX_RATIO:
+        render_credits(input_file, lines, info["width"], timing,
+                       align, color, fontsize, output_file)
+        return "full"
+
+    work_dir = Path(tempfile.mkdtemp(prefix="credit_"))
+    try:
+        tiles = render_credit_tiles(lines, info["width"], fontsize, color, align,
+                                    timing["line_height"], work_dir)
+        parts = []
+
+        if k0 > 0:
+            parts.append(work_dir / "head.ts")
+            smart_cut.copy_range(input_file, 0.0, k0, parts[-1], info)
+
+        parts.append(work_dir / "mid.ts")
+        smart_cut.encode_range(
+            input_file, k0, k1, parts[-1], info,
+            extra_inputs=[png for png, _ in tiles],
+            filter_complex=credit_filter_graph(tiles, timing, t_offset=k0))
+
+        if k1 < duration:
+            parts.append(work_dir / "tail.ts")
+            smart_cut.copy_range(input_file, k1, None, parts[-1], info)
+
+        smart_cut.join_parts(parts, input_file, output_file, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return "smart"
+
+
+# =========================
+# プレビュー
+# =========================
+
+def preview_times(timing, points=PREVIEW_POINTS):
+    """スクロール区間の中のプレビューする時刻"""
+    start, end = timing["scroll_start"], timing["scroll_end"]
+    return [start + (end - start) * p for p in points]
+
+
+def visible_lines(timing, video_height, line_count, t0, t1=None):
+    """
+    t0～t1 秒の間に画面に入る行の範囲 (先頭, 末尾+1)
+    y = h - speed*(t - scroll_start) + 行 * line_height（credit_filter_graph と同じ）
+    """
+    t1 = t0 if t1 is None else t1
+    lh = timing["line_height"]
+    moved0 = timing["speed"] * (t0 - timing["scroll_start"])
+    moved1 = timing["speed"] * (t1 - timing["scroll_start"])
+    first = max(0, math.floor((moved0 - video_height) / lh) - 1)
+    last = min(line_count, math.ceil(moved1 / lh) + 1)
+    return first, max(first, last)
+
+
+def _preview_frame(input_file, lines, width, height, timing, t,
+                   align, color, fontsize, out, work_dir):
+    """t 秒のフレーム1枚に、その時点で見える行だけを合成する"""
+    first, last = visible_lines(timing, height, len(lines), t)
+    tile_dir = Path(tempfile.mkdtemp(dir=work_dir))
+    tiles = render_credit_tiles(lines[first:last] or [" "], width, fontsize, color,
+                                align, timing["line_height"], tile_dir, first)
+    cmd = ["ffmpeg", "-y", "-v", "error", "-ss", f"{t}", "-i", str(input_file)]
+    for png, _ in tiles:
+        cmd += ["-i", str(png)]
+    cmd += [
+        "-filter_complex", credit_filter_graph(tiles, timing, t_offset=t),
+        "-map", "[v]", "-frames:v", "1",
+        str(out)
+    ]
+    run_ffmpeg(cmd, "credit_preview", input_file, out)
+
+
+def _preview_clip(input_file, lines, width, height, timing,
+                  align, color, fontsize, out, work_dir):
+    """スクロール区間の中央 PREVIEW_CLIP_SECONDS 秒を縮小して書き出す"""
+    mid = preview_times(timing, (0.5,))[0]
+    t0 = max(timing["scroll_start"], mid - PREVIEW_CLIP_SECONDS / 2)
+    t1 = min(timing["scroll_end"], t0 + PREVIEW_CLIP_SECONDS)
+    first, last = visible_lines(timing, height, len(lines), t0, t1)
+    tiles = render_credit_tiles(lines[first:last] or [" "], width, fontsize, color,
+                                align, timing["line_height"], work_dir, first)
+    cmd = ["ffmpeg", "-y", "-v", "error", "-ss", f"{t0}", "-t", f"{t1 - t0}",
+           "-i", str(input_file)]
+    for png, _ in tiles:
+        cmd += ["-i", str(png)]
+    cmd += [
+        "-filter_complex",
+        credit_filter_graph(tiles, timing, t_offset=t0)
+        + f";[v]scale=trunc(iw*{PREVIEW_SCALE}/2)*2:-2[p]",
+        "-map", "[p]", "-an",
+        "-c:v", "libx264", "-preset", "ultrafast", "-crf", "28",
+        str(out)
+    ]
+    run_ffmpeg(cmd, "credit_preview", input_file, out, t1 - t0)
+    return t0
+
+
+def render_preview(input_file, lines, width, height, timing,
+                   align, color, fontsize, out_prefix, clip=False):
+    """
+    クレジットの見え方だけを確認する（動画全体はエンコードしない）
+    clip=False : preview_times の各時刻の静止画 <out_prefix>_01.png, ...
+    clip=True  : 区間の中央を縮小した短い動画 <out_prefix>.mp4
+    描画するのはその時点で画面に入る行だけで、y・速度・エスケープは本番と同じ
+    戻り値: [(元動画での時刻, ファイル), ...]
+    """
+    out_prefix = Path(out_prefix)
+    work_dir = tempfile.mkdtemp(prefix="credit_preview_")
+    try:
+        if clip:
+            out = out_prefix.with_name(out_prefix.name + ".mp4")
+            t0 = _preview_clip(input_file, lines, width, height, timing,
+                               align, color, fontsize, out, work_dir)
+            return [(t0, out)]
+
+        times = preview_times(timing)
+        outs = [out_prefix.with_name(f"{out_prefix.name}_{k + 1:02d}.png")
+                for k in range(len(times))]
+        with ThreadPoolExecutor(max_workers=len(times)) as pool:
+            futures = [
+                ffmpeg_runner.submit(pool, _preview_frame, input_file, lines,
+                                     width, height, timing, t, align, color,
+                                     fontsize, out, work_dir)
+                for t, out in zip(times, outs)
+            ]
+            for future in futures:
+                future.result()
+        return list(zip(times, outs))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
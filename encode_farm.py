@@ -0,0 +1,607 @@
+# -*- coding: utf-8 -*-
+"""
+複数マシンでのエンコード（コーディネータとワーカー）
+
+コーディネータ（結合・圧縮を実行するマシン）が TCP または Unix ソケットで待ち受け、
+ワーカーが接続してエンコードタスクを1つずつ受け取る。
+タスクは入力の区間・フィルタ・エンコード設定をまとめた dict で、ワーカーは
+task_command で ffmpeg のコマンドを組み立てて実行し、共有ストレージ上の
+出力先に書き出す（一時ファイルに書いてから置き換える）。
+失敗したタスクや、実行中に接続が切れたワーカーのタスクは、別のワーカーで
+最大 retries 回までやり直す。
+
+プロトコル: 1行1メッセージの JSON
+  ワーカー → {"type": "hello", "worker": 名前, "nonce": ...}
+  コーディネータ → {"type": "challenge", "nonce": ..., "proof": ...}
+  ワーカー → {"type": "auth", "proof": ...}
+  ワーカー → {"type": "next"}
+  コーディネータ → {"type": "task", "task": {...}} / {"type": "wait"} / {"type": "bye"}
+  ワーカー → {"type": "done", "id": ...} / {"type": "failed", "id": ..., "error": ...}
+
+アドレスは "ホスト:ポート" または "unix:/パス"。既定はこのマシンからの接続だけ。
+ワーカーが WORKER_WAIT_SECONDS 秒接続しなければ、コーディネータのマシンで
+ワーカーを動かして続ける（待ち続けて止まらないように）。
+コーディネータとワーカーは、環境変数 MOVIEPROCESS_FARM_TOKEN の値を互いに
+持っていることを確かめ合う（proof はトークンと相手の nonce の HMAC で、
+トークン自体は送らない）。ワーカーは任意の ffmpeg を実行し出力を書くため、
+このマシンの中だけでもトークンは必須（同じマシンの他のユーザーも接続できる）。
+コーディネータはトークンが設定されていなければ、ループバックで待ち受けるときに限り
+ランダムなトークンを作って表示する（--local-workers にはそのまま渡す）。
+"""
+
+import contextvars
+import hashlib
+import hmac
+import ipaddress
+import itertools
+import json
+import os
+import secrets
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from ffmpeg_runner import JobCancelled, current_token, run_ffmpeg
+
+
+FARM_PORT = 8765
+DEFAULT_ADDRESS = f"127.0.0.1:{FARM_PORT}"
+
+# 失敗したタスクをやり直す回数
+TASK_RETRIES = 2
+
+# タスクがないときにワーカーを待たせる時間（秒）
+WAIT_SECONDS = 1.0
+
+# ワーカーがコーディネータに再接続するまでの間隔（秒）
+RECONNECT_SECONDS = 2.0
+
+# この秒数ワーカーが1つも接続していなければ、このマシンでワーカーを動かす
+WORKER_WAIT_SECONDS = 60.0
+
+# そのときに動かすワーカーの同時実行数（スレッド数は resource_governor が調整する）
+LOCAL_FALLBACK_SLOTS = max(1, (os.cpu_count() or 1) // 4)
+
+
+def farm_token():
+    return os.environ.get("MOVIEPROCESS_FARM_TOKEN") or None
+
+
+def parse_address(address: str):
+    """戻り値: (アドレスファミリ, ソケットアドレス)"""
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    if not host:
+        raise ValueError(f"アドレスは ホスト:ポート または unix:パス です: {address}")
+    return socket.AF_INET, (host.strip("[]"), int(port))
+
+
+def format_address(family, addr) -> str:
+    if family == socket.AF_UNIX:
+        return f"unix:{addr}"
+    return f"{addr[0]}:{addr[1]}"
+
+
+def is_loopback(address: str) -> bool:
+    """このマシンの中だけで使うアドレスか（Unix ソケット・127.0.0.1・::1・localhost）"""
+    family, addr = parse_address(address)
+    if family == socket.AF_UNIX:
+        return True
+    host = addr[0]
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        pass
+    if not host:
+        return False
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except OSError:
+        return False
+    return bool(infos) and all(
+        ipaddress.ip_address(info[4][0]).is_loopback for info in infos)
+
+
+def require_token(token):
+    """トークンがなければ ValueError"""
+    if not token:
+        raise ValueError(
+            "環境変数 MOVIEPROCESS_FARM_TOKEN にコーディネータと共通の"
+            "トークンを設定してください")
+
+
+def _proof(token, role: str, nonce) -> str:
+    """token を持っていることの証明（token がなければ None）"""
+    if not token:
+        return None
+    message = f"{role}:{nonce}".encode("utf-8")
+    return hmac.new(token.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def _verify(token, role: str, nonce, proof) -> bool:
+    if not token:
+        return False
+    expected = _proof(token, role, nonce)
+    return isinstance(proof, str) and hmac.compare_digest(proof, expected)
+
+
+# =========================
+# タスク
+# =========================
+
+def make_task(stage: str, input_file, output_file, video_filter, video_args,
+              audio_filter=None, audio_args=None, start=0.0, end=None,
+              threads: int = 0, duration=None) -> dict:
+    """
+    エンコードタスク（JSON にできる dict）
+    audio_args : None なら音声なし
+    start, end : 入力の区間（秒）。end が None なら最後まで
+    """
+    return {
+        "stage": stage,
+        "input": str(input_file),
+        "output": str(output_file),
+        "start": start,
+        "end": end,
+        "video_filter": video_filter,
+        "video_args": list(video_args),
+        "audio_filter": audio_filter,
+        "audio_args": list(audio_args) if audio_args is not None else None,
+        "threads": threads,
+        "duration": duration if end is None else end - start,
+    }
+
+
+def task_command(task: dict, output=None) -> list:
+    """タスクの ffmpeg コマンド（output を指定すると出力先を置き換える）"""
+    cmd = ["ffmpeg", "-y"]
+    start = task.get("start") or 0.0
+    if start > 0:
+        cmd += ["-ss", f"{start}"]
+    cmd += ["-i", task["input"]]
+    if task.get("end") is not None:
+        cmd += ["-t", f"{task['end'] - start}"]
+    if task.get("video_filter"):
+        cmd += ["-vf", task["video_filter"]]
+    if task.get("audio_args") is None:
+        cmd.append("-an")
+    elif task.get("audio_filter"):
+        cmd += ["-af", task["audio_filter"]]
+    cmd += task["video_args"]
+    if task.get("audio_args") is not None:
+        cmd += task["audio_args"]
+    threads = task.get("threads") or 0
+    if threads > 0:
+        cmd += ["-threads", str(threads), "-filter_threads", str(threads)]
+    cmd.append(str(output or task["output"]))
+    return cmd
+
+
+def run_task(task: dict, output=None):
+    """タスクをこのマシンで実行する（失敗時は CalledProcessError）"""
+    output = output or task["output"]
+    run_ffmpeg(task_command(task, output), task["stage"], task["input"],
+               output, task.get("duration"))
+
+
+# =========================
+# コーディネータ
+# =========================
+
+class _Task:
+    def __init__(self, id, spec, run):
+        self.id = id
+        self.spec = spec
+        self.run = run              # 所属する run() の識別子（None なら待つ人なし）
+        self.attempts = 0
+        self.failed_on = set()      # 失敗したワーカー名
+        self.worker = None
+        self.error = None
+        self.state = "pending"      # pending / running / done / failed
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.coordinator._serve(self.rfile, self.wfile)
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+else:
+    _UnixServer = None
+
+
+def _send(wfile, message: dict):
+    wfile.write(json.dumps(message, ensure_ascii=False).encode("utf-8") + b"\n")
+    wfile.flush()
+
+
+def _receive(rfile):
+    """1メッセージ読む（接続が切れたら None）"""
+    line = rfile.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+class Coordinator:
+    """
+    with Coordinator("0.0.0.0:8765") as farm:   # ループバック以外はトークンが必要
+        failed = farm.run(tasks)   # すべて終わるまで待つ
+    """
+
+    def __init__(self, address: str = DEFAULT_ADDRESS, retries: int = TASK_RETRIES,
+                 token=None, worker_wait=WORKER_WAIT_SECONDS):
+        """
+        worker_wait : ワーカーが1つも接続していない状態がこの秒数続いたら
+                      このマシンでワーカーを動かす（None なら待ち続ける）
+        """
+        self.family, self._bind = parse_address(address)
+        self.retries = retries
+        self.worker_wait = worker_wait
+        self.token = token if token is not None else farm_token()
+        self.address = None
+        self.workers = {}           # 名前 → 同時実行数（接続数）
+        self._pending = deque()
+        self._tasks = {}
+        self._ids = itertools.count()
+        self._runs = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._server = None
+        self._local = []
+        self._stop_local = threading.Event()
+
+    # ----- 起動・終了 -----
+
+    def start(self):
+        if not self.token:
+            address = format_address(self.family, self._bind)
+            if not is_loopback(address):
+                raise ValueError(
+                    f"{address} は他のマシンから接続できるため、環境変数 "
+                    "MOVIEPROCESS_FARM_TOKEN に共通のトークンを設定してください")
+            self.token = secrets.token_hex(16)
+            print("ワーカー用のトークン（このマシンで worker を動かすときは "
+                  "MOVIEPROCESS_FARM_TOKEN に設定）:", self.token)
+        if self.family == socket.AF_UNIX:
+            if _UnixServer is None:
+                raise OSError("この環境では Unix ソケットを使えません")
+            Path(self._bind).unlink(missing_ok=True)
+            self._server = _UnixServer(self._bind, _Handler)
+        else:
+            self._server = _TCPServer(self._bind, _Handler)
+        self._server.coordinator = self
+        self.address = format_address(self.family, self._server.server_address)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            if self.family == socket.AF_UNIX:
+                Path(self._bind).unlink(missing_ok=True)
+        self._stop_local.set()
+        for thread in self._local:
+            thread.join()
+
+    def __enter__(self):
+        return self if self._server is not None else self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start_local_workers(self, count: int, slots: int = 1):
+        """
+        このマシンでワーカーを count 個動かす（試験・単体マシン用）
+        接続が切れても再接続し、close() で終了する
+        """
+        host = "127.0.0.1" if self.family == socket.AF_INET else None
+        address = self.address if host is None else \
+            f"{host}:{self._server.server_address[1]}"
+        for n in range(count):
+            # キャンセル時に実行中の ffmpeg も止まるよう呼び出し元のトークンを引き継ぐ
+            thread = threading.Thread(
+                target=contextvars.copy_context().run, args=(run_worker, address),
+                kwargs={"slots": slots, "name": f"local-{n}", "token": self.token,
+                        "stop": self._stop_local},
+                daemon=True)
+            thread.start()
+            self._local.append(thread)
+
+    def capacity(self) -> int:
+        """接続中のワーカーの合計同時実行数"""
+        with self._cond:
+            return sum(self.workers.values())
+
+    # ----- タスクの実行 -----
+
+    def run(self, specs, on_done=None) -> list:
+        """
+        specs をワーカーに割り当て、すべて終わるまで待つ
+        on_done(spec) : 1タスク終わるごとに呼ぶ（コーディネータのスレッドから）
+        戻り値: 失敗したタスク [(spec, エラー), ...]
+        """
+        token = current_token.get()
+        run_id = next(self._runs)
+        with self._cond:
+            tasks = [_Task(f"{run_id}-{next(self._ids)}", spec, run_id) for spec in specs]
+            for task in tasks:
+                self._tasks[task.id] = task
+                self._pending.append(task)
+            self._cond.notify_all()
+
+        reported = set()
+        warned = False
+        idle_since = time.monotonic()
+        try:
+            while True:
+                with self._cond:
+                    finished = [t for t in tasks if t.state in ("done", "failed")]
+                    if len(finished) == len(tasks):
+                        break
+                    if self.workers:
+                        idle_since = time.monotonic()
+                    elif not warned:
+                        print("ワーカーの接続を待っています:", self.address)
+                        warned = True
+                    fallback = (not self.workers and not self._local
+                                and self.worker_wait is not None
+                                and time.monotonic() - idle_since >= self.worker_wait)
+                    self._cond.wait(WAIT_SECONDS)
+                    if self._closed:
+                        raise RuntimeError("コーディネータが終了しました")
+                if fallback:
+                    print(f"ワーカーが {self.worker_wait:g} 秒接続しないため、"
+                          "このマシンで実行します")
+                    self.start_local_workers(1, LOCAL_FALLBACK_SLOTS)
+                for task in finished:
+                    if task.id not in reported:
+                        reported.add(task.id)
+                        if task.state == "done" and on_done is not None:
+                            on_done(task.spec)
+                if token is not None:
+                    token.check()
+        except JobCancelled:
+            with self._cond:
+                for task in tasks:
+                    if task.state == "pending":
+                        self._pending.remove(task)
+                        task.state = "failed"
+            raise
+        finally:
+            with self._cond:
+                for task in tasks:
+                    if task.state == "running":
+                        task.run = None  # 終わったときに片付ける
+                    else:
+                        self._tasks.pop(task.id, None)
+
+        for task in tasks:
+            if task.state == "done" and task.id not in reported and on_done is not None:
+                on_done(task.spec)
+        return [(t.spec, t.error) for t in tasks if t.state == "failed"]
+
+    def _take(self, worker: str):
+        """worker に渡すタスク（なければ None）。_cond を持った状態で呼ぶ"""
+        for task in self._pending:
+            # 失敗したワーカーには渡さない（他にワーカーがいない場合を除く）
+            if worker not in task.failed_on or len(task.failed_on) >= len(self.workers):
+                self._pending.remove(task)
+                task.state = "running"
+                task.worker = worker
+                task.attempts += 1
+                return task
+        return None
+
+    def _missing_output(self, task_id):
+        """done と報告されたタスクの出力がなければそのエラー文（あれば None）"""
+        with self._cond:
+            task = self._tasks.get(task_id)
+        if task is None or Path(task.spec["output"]).is_file():
+            return None
+        return f"出力ファイルがありません: {task.spec['output']}"
+
+    def _finish(self, task_id, worker: str, error=None):
+        with self._cond:
+            task = self._tasks.get(task_id)
+            if task is None or task.state != "running" or task.worker != worker:
+                return
+            if task.run is None:
+                del self._tasks[task.id]
+                return
+            if error is None:
+                task.state = "done"
+            else:
+                print(f"タスク失敗 ({worker}, {task.attempts} 回目):",
+                      Path(task.spec["output"]).name, error)
+                task.failed_on.add(worker)
+                task.error = error
+                if task.attempts > self.retries:
+                    task.state = "failed"
+                else:
+                    task.state = "pending"
+                    task.worker = None
+                    self._pending.appendleft(task)
+            self._cond.notify_all()
+
+    def _serve(self, rfile, wfile):
+        """ワーカー1接続分の処理（サーバーのスレッドで動く）"""
+        try:
+            hello = _receive(rfile)
+        except ValueError:
+            return
+        if not hello or hello.get("type") != "hello":
+            return
+        nonce = secrets.token_hex(16)
+        _send(wfile, {"type": "challenge", "nonce": nonce,
+                      "proof": _proof(self.token, "coordinator", hello.get("nonce"))})
+        try:
+            auth = _receive(rfile)
+        except ValueError:
+            return
+        if not auth or auth.get("type") != "auth" \
+                or not _verify(self.token, "worker", nonce, auth.get("proof")):
+            _send(wfile, {"type": "bye", "reason": "token"})
+            return
+        worker = str(hello.get("worker") or "worker")
+        with self._cond:
+            self.workers[worker] = self.workers.get(worker, 0) + 1
+            self._cond.notify_all()
+        print("ワーカー接続:", worker)
+
+        current = None
+        try:
+            while True:
+                message = _receive(rfile)
+                if message is None:
+                    break
+                kind = message.get("type")
+                if kind == "done":
+                    # --map の誤りなどで出力がこちらから見えなければ失敗として扱う
+                    self._finish(message.get("id"), worker,
+                                 self._missing_output(message.get("id")))
+                    current = None
+                elif kind == "failed":
+                    self._finish(message.get("id"), worker, str(message.get("error")))
+                    current = None
+                elif kind == "next":
+                    with self._cond:
+                        if self._closed:
+                            _send(wfile, {"type": "bye"})
+                            return
+                        task = self._take(worker)
+                        if task is None:
+                            self._cond.wait(WAIT_SECONDS)
+                            task = self._take(worker)
+                    if task is None:
+                        _send(wfile, {"type": "wait"})
+                    else:
+                        current = task.id
+                        _send(wfile, {"type": "task", "id": task.id, "task": task.spec})
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self._cond:
+                self.workers[worker] -= 1
+                if not self.workers[worker]:
+                    del self.workers[worker]
+            if current is not None:
+                self._finish(current, worker, "ワーカーとの接続が切れました")
+            print("ワーカー切断:", worker)
+
+
+# =========================
+# ワーカー
+# =========================
+
+def map_path(path: str, path_map) -> str:
+    """コーディネータ側のパスをこのマシンのパスに置き換える（前方一致）"""
+    for src, dst in path_map:
+        if path.startswith(src):
+            return dst + path[len(src):]
+    return path
+
+
+def _part_path(output: Path, worker: str, task_id: str) -> Path:
+    safe = "".join(c if c.isalnum() else "_" for c in f"{worker}-{task_id}")
+    return output.with_name(f".{output.stem}.{safe}.part{output.suffix}")
+
+
+def _work(address, name, token, path_map, persistent, stop):
+    family, addr = parse_address(address)
+    while not stop.is_set():
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.connect(addr)
+        except OSError:
+            sock.close()
+            if not persistent:
+                return
+            stop.wait(RECONNECT_SECONDS)
+            continue
+
+        rfile, wfile = sock.makefile("rb"), sock.makefile("wb")
+        try:
+            nonce = secrets.token_hex(16)
+            _send(wfile, {"type": "hello", "worker": name, "nonce": nonce})
+            challenge = _receive(rfile)
+            connected = challenge is not None and challenge.get("type") == "challenge"
+            # トークンを持たないコーディネータのタスクは実行しない
+            if connected and not _verify(token, "coordinator", nonce,
+                                         challenge.get("proof")):
+                print("コーディネータのトークンが一致しません:", address)
+                return
+            if connected:
+                _send(wfile, {"type": "auth",
+                              "proof": _proof(token, "worker", challenge.get("nonce"))})
+            while connected and not stop.is_set():
+                _send(wfile, {"type": "next"})
+                message = _receive(rfile)
+                if message is None or message.get("type") == "bye":
+                    break
+                if message.get("type") != "task":
+                    continue
+
+                task = dict(message["task"])
+                task["input"] = map_path(task["input"], path_map)
+                output = Path(map_path(task["output"], path_map))
+                part = _part_path(output, name, message["id"])
+                try:
+                    run_task(task, part)
+                    os.replace(part, output)
+                except Exception as e:
+                    part.unlink(missing_ok=True)
+                    _send(wfile, {"type": "failed", "id": message["id"],
+                                  "error": f"{type(e).__name__}: {e}"})
+                else:
+                    _send(wfile, {"type": "done", "id": message["id"]})
+        except (OSError, ValueError):
+            pass
+        finally:
+            rfile.close()
+            wfile.close()
+            sock.close()
+
+        if not persistent:
+            return
+        stop.wait(RECONNECT_SECONDS)
+
+
+def run_worker(address: str, slots: int = 1, name=None, token=None,
+               path_map=(), persistent: bool = True, stop=None):
+    """
+    address の コーディネータからタスクを受け取って実行する
+    slots      : 同時に実行するタスクの数
+    path_map   : [(コーディネータ側のパスの先頭, このマシンでのパス), ...]
+    persistent : コーディネータが終了・未起動でも再接続を続ける（False なら終了する）
+    stop       : threading.Event。セットされたら実行中のタスクの後で終了する
+    """
+    name = name or socket.gethostname()
+    stop = stop or threading.Event()
+    token = token if token is not None else farm_token()
+    require_token(token)
+    threads = [
+        threading.Thread(target=contextvars.copy_context().run, daemon=True,
+                         args=(_work, address, f"{name}#{n}" if slots > 1 else name,
+                               token, list(path_map), persistent, stop))
+        for n in range(max(1, int(slots)))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
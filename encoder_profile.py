@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+エンコード設定のマシン別プロファイル
+
+短い試験エンコードでプリセット・スレッド数・同時実行数ごとの速度と
+画質（SSIM）・サイズを測り、このマシンに合った設定をキャッシュフォルダの
+encoder_profile.json に保存する。各処理はここから設定を読む。
+プロファイルがない・別のマシンで作られたものなら従来の既定値を使う。
+"""
+
+import json
+import os
+import platform
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import ffmpeg_runner
+import resource_governor
+from ffmpeg_runner import run_ffmpeg
+from media_index import cache_dir
+
+
+PROFILE_VERSION = 1
+
+# プロファイルがないときの設定（threads 0 は ffmpeg の自動設定）
+DEFAULTS = {
+    "convert": {"preset": "fast", "crf": 20, "threads": 0,
+                "workers": max(1, (os.cpu_count() or 1) // 4)},
+    "compress": {"preset": "veryfast", "crf": 28, "threads": 0},
+}
+
+# 試すプリセット（速い順）
+PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast", "medium")
+
+# 既定のプリセットと比べてこれ以上画質・サイズが悪くなるものは選ばない
+SSIM_TOLERANCE = 0.002
+SIZE_TOLERANCE = 1.10
+
+# 同時実行数の候補のうち、最速の値からこの割合以内なら少ない方を選ぶ
+CONCURRENCY_MARGIN = 0.05
+
+
+def profile_path() -> Path:
+    """プロファイルの保存先（環境変数 MOVIEPROCESS_ENCODER_PROFILE で変更可）"""
+    env = os.environ.get("MOVIEPROCESS_ENCODER_PROFILE")
+    return Path(env) if env else cache_dir() / "encoder_profile.json"
+
+
+def machine_id() -> dict:
+    return {
+        "node": platform.node(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def load_profile():
+    """このマシンのプロファイル（なければ None）"""
+    try:
+        with open(profile_path(), "r", encoding="utf-8") as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if profile.get("version") != PROFILE_VERSION or profile.get("machine") != machine_id():
+        return None
+    return profile
+
+
+def settings(operation: str) -> dict:
+    """operation（"convert" / "compress"）のエンコード設定"""
+    profile = load_profile() or {}
+    return {**DEFAULTS[operation], **profile.get(operation, {}).get("settings", {})}
+
+
+# =========================
+# 試験エンコード
+# =========================
+
+def make_sample(path: Path, seconds: float):
+    """試験用の合成動画（ノイズ入りで実際の撮影素材に近い負荷にする）"""
+    cmd = [
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "lavfi",
+        "-i", f"testsrc2=s=1920x1080:r=30:d={seconds},noise=alls=12:allf=t+u",
+        "-c:v", "libx264", "-preset", "ultrafast", "-crf", "10",
+        "-pix_fmt", "yuv420p", str(path)
+    ]
+    run_ffmpeg(cmd, "calibrate_sample", output=path, duration=seconds)
+
+
+def _encode(sample, video_filter, preset, crf, threads, out, seconds):
+    """戻り値: (実時間, 出力サイズ)"""
+    cmd = ["ffmpeg", "-y", "-v", "error", "-i", str(sample), "-an",
+           "-t", f"{seconds}", "-vf", video_filter,
+           "-c:v", "libx264", "-preset", preset, "-crf", str(crf)]
+    if threads:
+        cmd += ["-threads", str(threads)]
+    cmd.append(str(out))
+    started = time.perf_counter()
+    run_ffmpeg(cmd, "calibrate", sample, out, seconds)
+    return time.perf_counter() - started, Path(out).stat().st_size
+
+
+def _filter_path(path: Path) -> str:
+    """フィルタ引数に書くパス（: と \\ をエスケープ）"""
+    return str(path).replace("\\", "/").replace(":", "\\:")
+
+
+def measure_ssim(encoded, sample, video_filter, seconds, work_dir: Path) -> float:
+    """元動画に同じフィルタをかけたものと比べた平均 SSIM"""
+    stats = work_dir / f"{Path(encoded).stem}_ssim.log"
+    cmd = [
+        "ffmpeg", "-y", "-v", "error",
+        "-i", str(encoded), "-t", f"{seconds}", "-i", str(sample),
+        "-lavfi", f"[1:v]{video_filter}[ref];"
+                  f"[0:v][ref]ssim=stats_file='{_filter_path(stats)}'",
+        "-f", "null", os.devnull
+    ]
+    run_ffmpeg(cmd, "calibrate_ssim", encoded, None, seconds)
+    with open(stats, "r", encoding="utf-8") as f:
+        values = [float(m.group(1)) for m in re.finditer(r"All:([0-9.]+)", f.read())]
+    return sum(values) / len(values) if values else 0.0
+
+
+def _choose_preset(trials, default_preset):
+    """既定のプリセットと同等の画質・サイズに収まるもののうち最速"""
+    base = next((t for t in trials if t["preset"] == default_preset), None)
+    if base is None:
+        return default_preset
+    ok = [
+        t for t in trials
+        if t["ssim"] >= base["ssim"] - SSIM_TOLERANCE
+        and t["bytes"] <= base["bytes"] * SIZE_TOLERANCE
+    ]
+    return max(ok, key=lambda t: t["fps"])["preset"]
+
+
+def calibrate(operations: dict, sample=None, seconds: float = 10.0,
+              presets=PRESETS) -> dict:
+    """
+    operations : {"convert": 映像フィルタ, "compress": 映像フィルタ}
+    sample     : 試験に使う動画（None なら合成動画）
+
+    1. 各プリセットを1本ずつエンコードし、速度・サイズ・SSIM を測る
+    2. 選んだプリセットでスレッド数（compress）または
+       同時実行数 × スレッド数（convert）を変えて速度を測る
+    結果を profile_path() に保存して返す
+    convert の threads は選んだ同時実行数での値（他の並列数では
+    movieProcess.convert_threads が合計スレッド数が同じになるよう割り振る）
+    """
+    cpu = os.cpu_count() or 1
+    work_dir = Path(tempfile.mkdtemp(prefix="calibrate_"))
+    profile = {
+        "version": PROFILE_VERSION,
+        "machine": machine_id(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+    }
+    # 同時実行数・スレッド数そのものを測るため resource_governor の調整は外す
+    with resource_governor.bypassed():
+        try:
+            if sample is None:
+                sample = work_dir / "sample.mp4"
+                make_sample(sample, seconds)
+
+            for operation, video_filter in operations.items():
+                base = DEFAULTS[operation]
+                trials = []
+                for preset in presets:
+                    out = work_dir / f"{operation}_{preset}.mp4"
+                    wall, size = _encode(sample, video_filter, preset, base["crf"],
+                                         0, out, seconds)
+                    ssim = measure_ssim(out, sample, video_filter, seconds, work_dir)
+                    trials.append({"preset": preset, "fps": round(seconds / wall, 3),
+                                   "bytes": size, "ssim": round(ssim, 5)})
+                    print(f"[{operation}] {preset:10s} {seconds / wall:6.2f}x "
+                          f"{size / 1e6:6.2f}MB SSIM={ssim:.4f}")
+                preset = _choose_preset(trials, base["preset"])
+
+                # 同時実行数（compress は1本だけなのでスレッド数のみ）
+                levels = [1]
+                if operation == "convert":
+                    while levels[-1] * 2 <= cpu:
+                        levels.append(levels[-1] * 2)
+
+                scaling = []
+                for workers in levels:
+                    if operation == "compress":
+                        thread_options = sorted({0, cpu, max(1, cpu // 2)})
+                    else:
+                        # コアを均等に分けた数とその半分・2倍
+                        share = max(1, cpu // workers)
+                        thread_options = sorted({max(1, share // 2), share, share * 2})
+                    for threads in thread_options:
+                        started = time.perf_counter()
+                        with ThreadPoolExecutor(max_workers=workers) as pool:
+                            futures = [
+                                ffmpeg_runner.submit(
+                                    pool, _encode, sample, video_filter, preset,
+                                    base["crf"], threads,
+                                    work_dir / f"{operation}_c{workers}_{n}.mp4", seconds)
+                                for n in range(workers)
+                            ]
+                            for future in futures:
+                                future.result()
+                        throughput = workers * seconds / (time.perf_counter() - started)
+                        scaling.append({"workers": workers, "threads": threads,
+                                        "throughput": round(throughput, 3)})
+                        print(f"[{operation}] 並列 {workers:2d} × {threads:2d} スレッド: "
+                              f"{throughput:6.2f}x")
+
+                best = max(s["throughput"] for s in scaling)
+                chosen = min(
+                    (s for s in scaling if s["throughput"] >= best * (1 - CONCURRENCY_MARGIN)),
+                    key=lambda s: (s["workers"], s["threads"]))
+
+                chosen_settings = {"preset": preset, "crf": base["crf"],
+                                   "threads": chosen["threads"]}
+                if operation == "convert":
+                    chosen_settings["workers"] = chosen["workers"]
+                profile[operation] = {"settings": chosen_settings,
+                                      "presets": trials, "scaling": scaling}
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    path = profile_path()
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    return profile
@@ -0,0 +1,546 @@
+# -*- coding: utf-8 -*-
+"""
+ffmpeg 共通実行部
+
+すべての ffmpeg 呼び出しをここに通し、-progress pipe:1 の出力から
+進捗イベント（frame / fps / speed / 書き込みバイト数）を作る。
+終了時には処理段階ごとの実時間・CPU 時間を JSON Lines のログに追記する。
+起動は resource_governor の許可を得てから行い、その判断も "governor" として残す。
+
+イベントは listeners に登録した関数に渡される（CLI の表示・GUI の進捗表示）。
+  {"event": "start" | "progress" | "end", "stage": ..., "input": ..., ...}
+"""
+
+import contextvars
+import json
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import resource_governor
+from media_index import cache_dir
+
+
+# 進捗イベントを受け取る関数のリスト（fn(event: dict)）
+listeners = []
+
+_log_lock = threading.Lock()
+
+
+def timing_log_path() -> Path:
+    """段階ごとの所要時間ログ（環境変数 MOVIEPROCESS_TIMING_LOG で変更可）"""
+    env = os.environ.get("MOVIEPROCESS_TIMING_LOG")
+    return Path(env) if env else cache_dir() / "timing.jsonl"
+
+
+def add_listener(fn):
+    listeners.append(fn)
+
+
+def remove_listener(fn):
+    if fn in listeners:
+        listeners.remove(fn)
+
+
+def emit(event: dict):
+    event.setdefault("time", time.time())
+    for fn in list(listeners):
+        try:
+            fn(event)
+        except Exception:
+            pass
+    if event["event"] == "end":
+        with _log_lock:
+            with open(timing_log_path(), "a", encoding="utf-8") as f:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+# =========================
+# キャンセル
+# =========================
+
+class JobCancelled(Exception):
+    """ジョブがキャンセルされた"""
+
+
+class CancelToken:
+    """
+    ジョブ単位のキャンセル通知
+    実行中の ffmpeg を終了させ、以後の ffmpeg 起動を JobCancelled で止める
+    """
+
+    def __init__(self, job_id=None):
+        self.job_id = job_id
+        self.cancelled = False
+        self._procs = set()
+        self._lock = threading.Lock()
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled(self.job_id)
+
+    def register(self, proc):
+        with self._lock:
+            self._procs.add(proc)
+            cancelled = self.cancelled
+        if cancelled:
+            _terminate(proc)
+
+    def unregister(self, proc):
+        with self._lock:
+            self._procs.discard(proc)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            procs = list(self._procs)
+        for proc in procs:
+            _terminate(proc)
+
+
+def spawn(cmd, **kwargs):
+    """
+    subprocess.Popen と同じだが、_terminate と wait_child が使う
+    回収用のロックと強制終了タイマーの置き場を付ける
+    """
+    proc = subprocess.Popen(cmd, **kwargs)
+    proc.reap_lock = threading.Lock()
+    proc.kill_timer = None
+    return proc
+
+
+def _signal(proc, kill: bool):
+    """
+    回収前の子プロセスにだけシグナルを送る（reap_lock を持って呼ぶ）
+    POSIX では Popen.terminate() が内部で waitpid して回収してしまうことがあるため
+    os.kill を直接使う。回収済みなら returncode が入っているので送らない
+    """
+    if proc.returncode is not None:
+        return
+    if sys.platform == "win32":
+        if kill:
+            proc.kill()
+        else:
+            proc.terminate()
+    else:
+        os.kill(proc.pid, signal.SIGKILL if kill else signal.SIGTERM)
+
+
+def _terminate(proc, timeout=5.0):
+    """
+    ffmpeg を終了させる（timeout 秒たっても残っていれば強制終了）
+    終了の待ち合わせは run_ffmpeg 側で行う
+    回収（wait_child）と同じロックを取るので、回収後に pid が再利用されていても
+    別のプロセスにシグナルを送ることはない
+    """
+    lock = getattr(proc, "reap_lock", None) or threading.Lock()
+    with lock:
+        if proc.returncode is not None:
+            return
+        _signal(proc, kill=False)
+
+    def kill():
+        with lock:
+            _signal(proc, kill=True)
+
+    timer = threading.Timer(timeout, kill)
+    timer.daemon = True
+    proc.kill_timer = timer
+    timer.start()
+
+
+def cancel_kill_timer(proc):
+    """終了を待ち終えたら、_terminate が仕掛けた強制終了タイマーを止める"""
+    timer = getattr(proc, "kill_timer", None)
+    if timer is not None:
+        timer.cancel()
+
+
+# 実行中のジョブのトークン（スレッドプールに渡すときは submit を使う）
+current_token = contextvars.ContextVar("current_token", default=None)
+
+
+def submit(pool, fn, *args, **kwargs):
+    """
+    pool.submit と同じだが、呼び出し元のトークンをワーカースレッドに引き継ぐ
+    """
+    ctx = contextvars.copy_context()
+    return pool.submit(ctx.run, fn, *args, **kwargs)
+
+
+# True の間に起動する ffmpeg は別のプロセスグループで動かす（detached を使う）
+_detach = contextvars.ContextVar("detach_children", default=False)
+
+
+@contextmanager
+def detached():
+    """
+    この中（submit で渡したスレッドを含む）で起動する ffmpeg には
+    端末の Ctrl+C（SIGINT）を届けない。中断しても実行中の変換を最後まで終わらせたい
+    watch などで使う（止めるときは CancelToken を使う）
+    """
+    reset = _detach.set(True)
+    try:
+        yield
+    finally:
+        _detach.reset(reset)
+
+
+def popen_options(decision) -> dict:
+    """subprocess.Popen に渡す追加の引数（resource_governor.popen_options に detached 分を足す）"""
+    options = resource_governor.popen_options(decision)
+    if not _detach.get():
+        return options
+    if sys.platform == "win32":
+        options["creationflags"] = (options.get("creationflags", 0)
+                                    | subprocess.CREATE_NEW_PROCESS_GROUP)
+    else:
+        options["start_new_session"] = True
+    return options
+
+
+# =========================
+# CPU 時間
+# =========================
+
+def _windows_cpu_time(proc):
+    """Windows: GetProcessTimes で子プロセスの CPU 時間（秒）"""
+    import ctypes
+    from ctypes import wintypes
+
+    times = [wintypes.FILETIME() for _ in range(4)]
+    ok = ctypes.windll.kernel32.GetProcessTimes(
+        wintypes.HANDLE(int(proc._handle)), *[ctypes.byref(t) for t in times])
+    if not ok:
+        return None
+    kernel, user = times[2], times[3]
+    to_100ns = lambda t: (t.dwHighDateTime << 32) | t.dwLowDateTime
+    return (to_100ns(kernel) + to_100ns(user)) / 1e7
+
+
+def _reap(proc):
+    """
+    終了済み（ゾンビ）の子プロセスを回収する（reap_lock を持って呼ぶ）
+    戻り値: (終了コード, rusage)。回収済みなら rusage は None
+    """
+    try:
+        _, status, usage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        return proc.wait(), None
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, usage
+
+
+def wait_child(proc):
+    """
+    子プロセスの終了を待ち、(終了コード, CPU 時間, 最大メモリ使用量 [バイト]) を返す
+    POSIX では wait4 でその子プロセスだけの rusage を取る
+    終了を待つ間はロックを持たず（waitid の WNOWAIT で回収せずに待つ）、
+    回収と returncode の設定だけを _terminate と同じロックの中で行う
+    """
+    lock = getattr(proc, "reap_lock", None) or threading.Lock()
+    if hasattr(os, "wait4"):
+        if hasattr(os, "waitid"):
+            try:
+                os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+            except ChildProcessError:
+                pass
+            with lock:
+                returncode, usage = _reap(proc)
+        else:
+            # macOS など waitid がない環境は WNOHANG で見に行く
+            while True:
+                with lock:
+                    pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+                    if pid:
+                        proc.returncode = returncode = os.waitstatus_to_exitcode(status)
+                        break
+                time.sleep(0.05)
+        if usage is None:
+            # キャンセル処理の側で回収済み
+            return returncode, None, None
+        # ru_maxrss は Linux では KB、macOS ではバイト
+        rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+        return returncode, usage.ru_utime + usage.ru_stime, rss
+    proc.wait()
+    try:
+        cpu = _windows_cpu_time(proc)
+    except Exception:
+        cpu = None
+    return proc.returncode, cpu, None
+
+
+# =========================
+# 実行
+# =========================
+
+def _parse_progress(block: dict, duration):
+    """-progress の1ブロックを進捗イベントに変換"""
+    def num(key, cast=float):
+        try:
+            return cast(block.get(key, "").rstrip("x"))
+        except ValueError:
+            return None
+
+    out_time = num("out_time_us")
+    out_time = out_time / 1e6 if out_time is not None else None
+    event = {
+        "event": "progress",
+        "frames": num("frame", int),
+        "fps": num("fps"),
+        "speed": num("speed"),
+        "out_time": out_time,
+        "bytes": num("total_size", int),
+    }
+    if duration and out_time is not None:
+        event["percent"] = max(0.0, min(100.0, out_time / duration * 100))
+    return event
+
+
+def run_ffmpeg(cmd, stage: str, input=None, output=None, duration=None,
+               outputs=None):
+    """
+    subprocess.run(cmd, check=True) の代わりに使う
+    stage    : 処理段階の名前（"convert", "concat", "split" など）
+    input / output : ログ用のパス
+    duration : 出力の長さ（秒）。わかれば進捗率を計算する
+    outputs  : 出力が複数あるとき、cmd の中の出力の引数をすべて渡す
+               （スレッド数の指定先。省略時は最後の引数だけが出力）
+    失敗時は subprocess.CalledProcessError
+    """
+    cmd = list(cmd)
+    cmd[1:1] = ["-nostdin", "-nostats", "-progress", "pipe:1"]
+
+    token = current_token.get()
+    if token is not None:
+        token.check()
+
+    base = {
+        "stage": stage,
+        "job": token.job_id if token is not None else None,
+        "input": str(input) if input is not None else None,
+        "output": str(output) if output is not None else None,
+    }
+
+    # 同時実行数・スレッド数・優先度は resource_governor が決める
+    with resource_governor.get_governor().admit(stage, cmd, token) as decision:
+        cmd = resource_governor.child_command(cmd, decision, outputs)
+        governor = resource_governor.log_fields(decision)
+        emit({"event": "start", **base, "governor": governor})
+
+        started = time.perf_counter()
+        last = {}
+        proc = spawn(resource_governor.launch_command(cmd, decision),
+                     stdout=subprocess.PIPE, text=True,
+                     encoding="utf-8", errors="replace",
+                     **popen_options(decision))
+        resource_governor.apply_priority(proc, decision)
+        if token is not None:
+            token.register(proc)
+        try:
+            block = {}
+            for line in proc.stdout:
+                key, _, value = line.strip().partition("=")
+                block[key] = value
+                if key == "progress":
+                    last = _parse_progress(block, duration)
+                    emit({**base, **last})
+                    block = {}
+            proc.stdout.close()
+
+            returncode, cpu, rss = wait_child(proc)
+        except BaseException:
+            # ログの書き込み失敗・Ctrl+C などで抜けるときも ffmpeg を残さない
+            # （パイプを先に閉じ、進捗の書き込みで止まらないようにする）
+            try:
+                proc.stdout.close()
+            except OSError:
+                pass
+            _terminate(proc)
+            wait_child(proc)
+            raise
+        finally:
+            cancel_kill_timer(proc)
+            if token is not None:
+                token.unregister(proc)
+        wall = time.perf_counter() - started
+        decision["rss"] = rss
+
+    out_bytes = last.get("bytes")
+    if output is not None and Path(output).is_file():
+        out_bytes = Path(output).stat().st_size
+
+    emit({
+        "event": "end", **base,
+        "returncode": returncode,
+        "frames": last.get("frames"),
+        "fps": last.get("fps"),
+        "speed": last.get("speed"),
+        "bytes": out_bytes,
+        "wall": round(wall, 3),
+        "cpu": round(cpu, 3) if cpu is not None else None,
+        "rss": rss,
+        "governor": governor,
+    })
+
+    if token is not None:
+        token.check()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+
+@contextmanager
+def timed_stage(stage: str, input=None, **extra):
+    """
+    ffmpeg 以外の処理（ffprobe による走査など）の所要時間を記録する
+    CPU 時間はこのプロセス全体の値（並列実行中は他スレッド分も含む）
+    """
+    token = current_token.get()
+    base = {
+        "stage": stage,
+        "job": token.job_id if token is not None else None,
+        "input": str(input) if input is not None else None,
+    }
+    emit({"event": "start", **base})
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    try:
+        yield
+    finally:
+        emit({
+            "event": "end", **base, **extra,
+            "wall": round(time.perf_counter() - started, 3),
+            "cpu": round(time.process_time() - cpu_started, 3),
+        })
+
+
+# =========================
+# ffmpeg の確認
+# =========================
+
+def _capability_list(flag: str, pattern: str) -> list:
+    out = subprocess.run(["ffmpeg", "-hide_banner", flag], capture_output=True,
+                         text=True, encoding="utf-8", errors="replace",
+                         check=True).stdout
+    return sorted(set(re.findall(pattern, out, re.MULTILINE)))
+
+
+def _supports_option_files() -> bool:
+    """
+    オプションの値をファイルから読む -/オプション（ffmpeg 7.0 以降）が使えるか
+    バージョン表記はビルドによってまちまちなので、実際に小さなグラフで試す
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf-8",
+                                     delete=False) as script:
+        script.write("anullsrc=d=0.01[a]")
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-v", "error", "-nostdin",
+             "-/filter_complex", script.name, "-map", "[a]", "-f", "null", "-"],
+            capture_output=True)
+        return result.returncode == 0
+    finally:
+        os.unlink(script.name)
+
+
+def filter_script_args(path) -> list:
+    """
+    filter_complex をファイルから読む引数
+    ffmpeg 7 以降は -/filter_complex（-filter_complex_script は非推奨で警告が出る）
+    """
+    caps = ffmpeg_capabilities()
+    if caps is not None and caps.get("option_files"):
+        return ["-/filter_complex", str(path)]
+    return ["-filter_complex_script", str(path)]
+
+
+def ffmpeg_capabilities(refresh: bool = False):
+    """
+    PATH 上の ffmpeg のバージョン・エンコーダ・フィルタ（見つからなければ None）
+    ffmpeg の起動は数百 ms かかるため、結果はキャッシュフォルダに保存し、
+    実行ファイルのパス・サイズ・更新時刻が変わらない限り再利用する
+      {"path", "size", "mtime_ns", "version", "encoders": [...], "filters": [...],
+       "option_files": -/オプション が使えるか}
+    """
+    exe = shutil.which("ffmpeg")
+    if exe is None:
+        return None
+    st = os.stat(exe)
+    identity = {"path": exe, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    path = cache_dir() / "ffmpeg_capabilities.json"
+    if not refresh:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if all(cached.get(k) == v for k, v in identity.items()) \
+                    and "option_files" in cached:
+                return cached
+        except (OSError, ValueError):
+            pass
+
+    try:
+        version = subprocess.run(["ffmpeg", "-version"], capture_output=True,
+                                 text=True, encoding="utf-8", errors="replace",
+                                 check=True).stdout.splitlines()[0]
+        # " V....D libx264  ..." / " TSC scale  V->V  ..."
+        encoders = _capability_list("-encoders", r"^ [VAS][A-Z.]{5} ([\w-]+)")
+        filters = _capability_list("-filters", r"^ [A-Z.]{2,3} (\S+)\s+\S+->\S+")
+        option_files = _supports_option_files()
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        return None
+
+    caps = {**identity, "version": version, "encoders": encoders, "filters": filters,
+            "option_files": option_files}
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(caps, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return caps
+
+
+# =========================
+# コンソール表示
+# =========================
+
+_last_print = {}
+
+
+def print_progress(event: dict):
+    """CLI 用：進捗を1秒に1回程度、終了時に所要時間を表示"""
+    name = Path(event["output"] or event["input"] or "").name
+    key = (event["stage"], name)
+    if event["event"] == "progress":
+        now = time.monotonic()
+        if now - _last_print.get(key, 0.0) < 1.0:
+            return
+        _last_print[key] = now
+        parts = [f"[{event['stage']}] {name}"]
+        if event.get("frames") is not None:
+            parts.append(f"frame={event['frames']}")
+        if event.get("fps") is not None:
+            parts.append(f"fps={event['fps']:.1f}")
+        if event.get("speed") is not None:
+            parts.append(f"speed={event['speed']:.2f}x")
+        if event.get("percent") is not None:
+            parts.append(f"{event['percent']:.0f}%")
+        print(" ".join(parts), file=sys.stderr, flush=True)
+    elif event["event"] == "end":
+        _last_print.pop(key, None)
+        cpu = f"{event['cpu']:.1f}s" if event.get("cpu") is not None else "-"
+        line = f"[{event['stage']}] {name} wall={event['wall']:.1f}s cpu={cpu}"
+        waited = (event.get("governor") or {}).get("waited")
+        if waited and waited >= 1.0:
+            line += f" 待ち={waited:.1f}s ({event['governor']['reason']})"
+        print(line, file=sys.stderr, flush=True)
+
+
+listeners.append(print_progress)
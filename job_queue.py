@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+バックグラウンドジョブキュー
+
+GUI のボタンから処理を直接呼ぶ代わりにジョブとして登録し、
+同時実行数の上限つきで別スレッドで順に実行する。
+キャンセルすると実行中の ffmpeg を終了させ、途中まで書いた出力を削除する。
+"""
+
+import itertools
+import threading
+from collections import deque
+from pathlib import Path
+
+from ffmpeg_runner import CancelToken, JobCancelled, current_token
+
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = (
+    "queued", "running", "done", "failed", "cancelled")
+
+
+class Job:
+    """キューに登録された1つの処理"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name, func, args, kwargs, outputs):
+        self.id = next(self._ids)
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.outputs = [Path(p) for p in outputs]
+        self.status = QUEUED
+        self.error = None
+        self.token = CancelToken(self.id)
+        self._before = {}
+
+    def _existing_outputs(self) -> dict:
+        """
+        出力パスに今あるファイルと (更新時刻, サイズ)
+        ファイル名に * を含む場合はワイルドカードとして扱う（分割の連番など）
+        """
+        found = {}
+        for p in self.outputs:
+            targets = p.parent.glob(p.name) if "*" in p.name else [p]
+            for t in targets:
+                try:
+                    st = t.stat()
+                except OSError:
+                    continue
+                if t.is_file():
+                    found[t] = (st.st_mtime_ns, st.st_size)
+        return found
+
+    def snapshot_outputs(self):
+        """開始前に出力パスにあったファイルを覚えておく（remove_outputs で残す）"""
+        self._before = self._existing_outputs()
+
+    def remove_outputs(self):
+        """
+        途中まで書いた出力ファイルを削除
+        開始前からあって変更されていないファイル（前回の分割の連番など）は残す
+        削除できないファイル（終了直後の ffmpeg がまだ開いているなど）は残して表示する
+        """
+        for t, stamp in self._existing_outputs().items():
+            if self._before.get(t) != stamp:
+                try:
+                    t.unlink(missing_ok=True)
+                except OSError as e:
+                    print("出力を削除できません:", t, e)
+
+
+class JobQueue:
+    """
+    limit 件まで同時に実行するジョブキュー
+    ジョブの状態が変わるたびに listeners の fn(job) を呼ぶ
+    """
+
+    def __init__(self, limit: int = 1):
+        self.limit = max(1, int(limit))
+        self.jobs = {}
+        self.listeners = []
+        self._queue = deque()
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def _notify(self, job):
+        for fn in list(self.listeners):
+            try:
+                fn(job)
+            except Exception:
+                pass
+
+    def submit(self, name, func, *args, outputs=(), **kwargs) -> Job:
+        """
+        outputs : キャンセル時に削除する出力パス
+        """
+        job = Job(name, func, args, kwargs, outputs)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._queue.append(job)
+        self._notify(job)
+        self._dispatch()
+        return job
+
+    def set_limit(self, limit: int):
+        with self._lock:
+            self.limit = max(1, int(limit))
+        self._dispatch()
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        with self._lock:
+            if job.status == QUEUED:
+                self._queue.remove(job)
+                job.status = CANCELLED
+                queued = True
+            else:
+                queued = False
+        if queued:
+            self._notify(job)
+        elif job.status == RUNNING:
+            job.token.cancel()
+
+    def _dispatch(self):
+        started = []
+        with self._lock:
+            while self._running < self.limit and self._queue:
+                job = self._queue.popleft()
+                job.status = RUNNING
+                self._running += 1
+                started.append(job)
+        for job in started:
+            self._notify(job)
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _run(self, job):
+        current_token.set(job.token)
+        job.snapshot_outputs()
+        try:
+            job.func(*job.args, **job.kwargs)
+            job.token.check()
+            job.status = DONE
+        except Exception as e:
+            # 並列処理の中でキャンセルされると別の例外にまとめられることがある
+            if isinstance(e, JobCancelled) or job.token.cancelled:
+                job.status = CANCELLED
+            else:
+                job.status = FAILED
+                job.error = e
+        finally:
+            # 片付けに失敗しても枠は必ず返す（返さないと待機中のジョブが止まる）
+            try:
+                if job.status == CANCELLED:
+                    job.remove_outputs()
+            finally:
+                with self._lock:
+                    self._running -= 1
+                self._notify(job)
+                self._dispatch()
@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+メディア情報インデックス
+
+ffprobe の結果 (-show_format -show_streams を1回) を SQLite に保存し、
+パス・サイズ・更新時刻が変わらない限り再利用する。
+同じフォルダを再処理するときは stat だけで済み、ffprobe は起動しない。
+"""
+
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+
+
+# 処理対象の動画の拡張子
+MEDIA_SUFFIXES = (".mp4", ".mov", ".mts")
+
+# parse_probe のレコードの版（項目を増やしたら上げる。古いレコードは取り直す）
+PROBE_VERSION = 3
+
+
+# =========================
+# キャッシュ保存先
+# =========================
+
+def cache_dir() -> Path:
+    """
+    キャッシュ用フォルダ
+    環境変数 MOVIEPROCESS_CACHE_DIR があればそちらを優先する
+    """
+    env = os.environ.get("MOVIEPROCESS_CACHE_DIR")
+    if env:
+        path = Path(env)
+    elif sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local"
+        path = Path(base) / "movieProcess"
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+        path = Path(base) / "movieProcess"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+# =========================
+# ffprobe 解析
+# =========================
+
+def _parse_rate(rate) -> float:
+    """'30000/1001' 形式のフレームレートを float に変換"""
+    try:
+        num, _, den = str(rate).partition("/")
+        den = float(den) if den else 1.0
+        return float(num) / den if den else 0.0
+    except ValueError:
+        return 0.0
+
+
+def _parse_creation_time(tags):
+    creation_str = (tags or {}).get("creation_time")
+    if not creation_str:
+        return None
+    try:
+        dt = datetime.fromisoformat(creation_str.replace("Z", "+00:00"))
+        return dt.timestamp()
+    except ValueError:
+        return None
+
+
+def _rotation(stream) -> int:
+    """回転情報（tags.rotate または displaymatrix の side data）"""
+    rotate = stream.get("tags", {}).get("rotate")
+    if rotate is not None:
+        try:
+            return int(float(rotate)) % 360
+        except ValueError:
+            pass
+    for side in stream.get("side_data_list", []):
+        if "rotation" in side:
+            return int(float(side["rotation"])) % 360
+    return 0
+
+
+def parse_probe(data: dict) -> dict:
+    """
+    ffprobe の JSON からよく使う項目だけを抜き出したレコードを作る
+    """
+    fmt = data.get("format", {})
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+
+    try:
+        duration = float(fmt.get("duration", 0.0))
+    except ValueError:
+        duration = 0.0
+
+    record = {
+        "version": PROBE_VERSION,
+        "duration": duration,
+        "creation_time": _parse_creation_time(fmt.get("tags")),
+        "format_name": fmt.get("format_name"),
+        "bit_rate": int(fmt["bit_rate"]) if fmt.get("bit_rate", "").isdigit() else None,
+        "width": None,
+        "height": None,
+        "vcodec": None,
+        "pix_fmt": None,
+        "fps": 0.0,
+        "rotation": 0,
+        "sample_aspect_ratio": None,
+        "time_base": None,
+        # 部分再エンコードで元に合わせるエンコーダ設定（smart_cut.encoder_args）
+        "profile": None,
+        "level": None,
+        "refs": None,
+        "has_b_frames": None,
+        "color_range": None,
+        "color_space": None,
+        "color_transfer": None,
+        "color_primaries": None,
+        "acodec": None,
+        "channels": 0,
+        "channel_layout": None,
+        "sample_rate": 0,
+    }
+
+    if video:
+        record.update({
+            "width": video.get("width"),
+            "height": video.get("height"),
+            "vcodec": video.get("codec_name"),
+            "pix_fmt": video.get("pix_fmt"),
+            "fps": _parse_rate(video.get("avg_frame_rate")) or _parse_rate(video.get("r_frame_rate")),
+            "rotation": _rotation(video),
+            "sample_aspect_ratio": video.get("sample_aspect_ratio"),
+            "time_base": video.get("time_base"),
+            "profile": video.get("profile"),
+            "level": video.get("level"),
+            "refs": video.get("refs"),
+            "has_b_frames": video.get("has_b_frames"),
+            "color_range": video.get("color_range"),
+            "color_space": video.get("color_space"),
+            "color_transfer": video.get("color_transfer"),
+            "color_primaries": video.get("color_primaries"),
+        })
+
+    if audio:
+        record.update({
+            "acodec": audio.get("codec_name"),
+            "channels": audio.get("channels", 0),
+            "channel_layout": audio.get("channel_layout"),
+            "sample_rate": int(audio.get("sample_rate", 0) or 0),
+        })
+
+    return record
+
+
+def probe_command(file) -> list:
+    return [
+        "ffprobe", "-v", "error", "-print_format", "json",
+        "-show_format", "-show_streams", str(file)
+    ]
+
+
+# ffprobe がファイルを読めたうえで「メディアではない」と判断したときのエラー
+INVALID_MEDIA_MESSAGES = ("Invalid data found when processing input",)
+
+
+def is_invalid_media(returncode, stderr) -> bool:
+    """
+    ffprobe の失敗が「解析できないファイル」によるものか
+    （ロック中・ネットワークの一時的なエラー・強制終了などは False）
+    """
+    return bool(returncode and returncode > 0 and stderr
+                and any(m in stderr for m in INVALID_MEDIA_MESSAGES))
+
+
+def probe(file) -> dict:
+    """ffprobe を1回だけ実行してレコードを返す"""
+    result = subprocess.run(probe_command(file),
+                            capture_output=True, text=True, check=True)
+    return parse_probe(json.loads(result.stdout))
+
+
+def keyframe_command(file) -> list:
+    """映像のパケットだけを読む（デコードしないので速い）"""
+    return [
+        "ffprobe", "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags:format=start_time",
+        "-of", "csv=print_section=1", str(file)
+    ]
+
+
+def parse_keyframes(text: str) -> list:
+    """
+    キーフレーム（flags に K を含むパケット）の時刻を昇順で返す
+    時刻はファイルの start_time からの秒数にする（入力の -ss と同じ基準。
+    .mts などは pts が 0 から始まらない）
+    """
+    times = []
+    start_time = 0.0
+    for line in text.splitlines():
+        section, _, rest = line.partition(",")
+        try:
+            if section == "packet":
+                pts_time, _, flags = rest.partition(",")
+                if "K" in flags:
+                    times.append(float(pts_time))
+            elif section == "format":
+                start_time = float(rest)
+        except ValueError:
+            pass
+    return sorted(round(t - start_time, 6) for t in times)
+
+
+def probe_keyframes(file) -> list:
+    result = subprocess.run(keyframe_command(file),
+                            capture_output=True, text=True, check=True)
+    return parse_keyframes(result.stdout)
+
+
+# =========================
+# インデックス本体
+# =========================
+
+class MediaIndex:
+    """
+    パス・サイズ・mtime をキーにしたメディア情報キャッシュ
+    複数スレッドから呼ばれてもよいように接続はロックで守る
+
+    media     : parse_probe のレコード
+    keyframes : 映像のキーフレーム時刻のリスト
+    audio     : audio_analysis の解析結果
+    """
+
+    TABLES = ("media", "keyframes", "audio")
+
+    def __init__(self, db_path: Path = None):
+        self.db_path = Path(db_path) if db_path else cache_dir() / "media_index.sqlite3"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        for table in self.TABLES:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                " path TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " record TEXT NOT NULL)"
+            )
+        self._conn.commit()
+
+    @staticmethod
+    def _key(file):
+        path = Path(file).resolve()
+        st = path.stat()
+        return str(path), st.st_size, st.st_mtime_ns
+
+    def lookup(self, file, table="media"):
+        """
+        キャッシュだけを見る（ffprobe は実行しない）
+        戻り値: (ヒットしたか, レコード)
+        """
+        path, size, mtime_ns = self._key(file)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT size, mtime_ns, record FROM {table} WHERE path = ?", (path,)
+            ).fetchone()
+        if row and row[0] == size and row[1] == mtime_ns:
+            record = json.loads(row[2])
+            if table == "media":
+                # 以前の形式の None は一時的な失敗も含むので取り直す
+                if record is None or record.get("version") != PROBE_VERSION:
+                    return False, None
+                if record.get("invalid"):
+                    return True, None
+            return True, record
+        return False, None
+
+    def store(self, file, record, table="media"):
+        """record が None のときは「メディアではない」として記録する"""
+        if table == "media" and record is None:
+            record = {"version": PROBE_VERSION, "invalid": True}
+        path, size, mtime_ns = self._key(file)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {table} (path, size, mtime_ns, record)"
+                " VALUES (?, ?, ?, ?)",
+                (path, size, mtime_ns, json.dumps(record))
+            )
+            self._conn.commit()
+
+    def get(self, file):
+        """
+        レコードを返す。キャッシュにないか古い場合だけ ffprobe を実行する。
+        ffprobe が解析できないファイルは None。キャッシュするのは ffprobe が
+        メディアではないと判断した場合だけで、一時的な失敗（コピー中でロックされている・
+        NAS の応答がないなど）は次回また ffprobe を実行する（is_invalid_media 参照）。
+        """
+        hit, record = self.lookup(file)
+        if hit:
+            return record
+        try:
+            record = probe(file)
+        except subprocess.CalledProcessError as e:
+            if not is_invalid_media(e.returncode, e.stderr):
+                return None
+            record = None
+        except ValueError:
+            record = None
+        self.store(file, record)
+        return record
+
+    def keyframes(self, file) -> list:
+        """
+        キーフレーム時刻のリスト（キャッシュになければ ffprobe で取得）
+        start_time からの秒数（parse_keyframes 参照）
+        """
+        hit, record = self.lookup(file, "keyframes")
+        # 以前の形式（pts_time のリストのまま）は取り直す
+        if hit and isinstance(record, dict) and record.get("base") == "start_time":
+            return record["times"]
+        times = probe_keyframes(file)
+        self.store(file, {"base": "start_time", "times": times}, "keyframes")
+        return times
+
+    def prune(self):
+        """存在しなくなったファイルのエントリを削除"""
+        removed = 0
+        with self._lock:
+            for table in self.TABLES:
+                paths = [r[0] for r in self._conn.execute(f"SELECT path FROM {table}")]
+                gone = [(p,) for p in paths if not os.path.exists(p)]
+                self._conn.executemany(f"DELETE FROM {table} WHERE path = ?", gone)
+                removed += len(gone)
+            self._conn.commit()
+        return removed
+
+
+_default_index = None
+_default_lock = threading.Lock()
+
+
+def get_index() -> MediaIndex:
+    global _default_index
+    with _default_lock:
+        if _default_index is None:
+            _default_index = MediaIndex()
+        return _default_index
+
+
+def media_info(file):
+    """共通インデックス経由でメディア情報を取得（失敗時は None）"""
+    return get_index().get(file)
+
+
+def keyframe_times(file) -> list:
+    """共通インデックス経由でキーフレーム時刻を取得"""
+    return get_index().keyframes(file)
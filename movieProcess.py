@@ -1,125 +1,683 @@
 # -*- coding: utf-8 -*-
 
 import subprocess
-import json
 import sys
 import os
+import json
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
 import argparse
+import contextlib
 from pathlib import Path
-from datetime import datetime
-import tkinter as tk
-from tkinter import filedialog
-import flet as ft
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import batch
+import chunk_encode
+import encode_farm
+import encoder_profile
+import media_index
+import size_target
+import probe_engine
+import proxy
+import smart_cut
+import watch_folder
+import ffmpeg_runner
+from ffmpeg_runner import run_ffmpeg, timed_stage
+from job_queue import JobQueue
+from media_index import MEDIA_SUFFIXES, media_info, keyframe_times
+from credit_render import (
+    SCROLL_MARGIN, credit_timing, read_credit_lines, render_credits,
+    render_credits_smart, render_preview,
+)
 
 # =========================
 # frozen 対応（EXE対策）
 # =========================
-if getattr(sys, "frozen", False):
-    os.chdir(os.path.dirname(sys.executable))
-else:
-    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+def app_dir() -> Path:
+    """EXE またはこのスクリプトのあるフォルダ"""
+    if getattr(sys, "frozen", False):
+        return Path(sys.executable).parent
+    return Path(__file__).resolve().parent
+
+
+def use_bundled_ffmpeg():
+    """
+    app_dir に置いた ffmpeg を PATH より優先して使う
+    （以前は起動時に app_dir へ chdir していたが、相対パスの引数が
+    使えなくなるため PATH の先頭に追加する方式にした）
+    """
+    os.environ["PATH"] = str(app_dir()) + os.pathsep + os.environ.get("PATH", "")
 
 TARGET_WIDTH, TARGET_HEIGHT = 1280, 720
+TARGET_FPS = 30
+TARGET_PIX_FMT = "yuv420p"
+TARGET_VCODEC, TARGET_ACODEC, TARGET_CHANNELS = "h264", "aac", 2
+TARGET_PROFILE = "High"            # ffprobe の表記（libx264 には -profile:v high）
+TARGET_SAMPLE_RATE = 48000
+TARGET_TIMESCALE = 15360           # 映像トラックの time_base は 1/TARGET_TIMESCALE
+
+# エンコード設定（crf・プリセット・スレッド数・並列数）は calibrate で作った
+# このマシンのプロファイルから使うときに読む（convert_settings 参照）
+CPU_COUNT = os.cpu_count() or 1
+
+# encode_farm を使うとき、同時にワーカーへ渡しておくクリップの上限
+FARM_MAX_PENDING = 32
+
+# 結合用の変換パラメータ（中間ファイルのキャッシュキーにも使う）
+# 映像の設定は convert_video_args
+CONVERT_AUDIO_FILTER = "dynaudnorm"
+CONVERT_AUDIO_ARGS = ["-c:a", "aac", "-b:a", "192k", "-ac", "2",
+                      "-ar", str(TARGET_SAMPLE_RATE)]
+# 中間ファイル（mp4）だけに付ける mux の設定（tee などには使えない）
+CONVERT_MUX_ARGS = ["-video_track_timescale", str(TARGET_TIMESCALE)]
+
+# 音量の揃え方
+#   dynaudnorm : クリップごとに動的に正規化（従来どおり）
+#   gain       : 音声解析で求めた一定のゲインをクリップごとにかけて
+#                ラウドネスを揃える（audio_analysis 参照）
+LOUDNESS_MODES = ("dynaudnorm", "gain")
+NO_GAIN_FILTER = "anull"
+
+# tmp_concat に残す中間ファイルの上限（古く使われていないものから削除）
+TRANSCODE_CACHE_MAX_BYTES = 50 * 1024 ** 3
+
+# 書きかけのファイル（*.part.mp4）がこの秒数更新されていなければ中断の残りとして削除
+TRANSCODE_PART_MAX_AGE = 24 * 3600
+
+# 結合モード "auto" の判定基準（recommend_concat_mode 参照）
+STREAM_CONCAT_MAX_CLIPS = 30
+STREAM_CONCAT_MIN_BYTES = 10 * 1024 ** 3
+CONCAT_MODES = ("files", "stream", "auto")
+
+# PowerPoint 用圧縮の設定
+# 映像の設定は ppt_video_args
+PPT_VIDEO_FILTER = "scale=960:-2,fps=15"
+PPT_AUDIO_BITRATE = 96000
+PPT_AUDIO_ARGS = ["-c:a", "aac", "-b:a", str(PPT_AUDIO_BITRATE)]
 
 
 # =========================
 # 共通関数
 # =========================
 
+def duration_from(info) -> float:
+    """media_index のレコードから長さ（読めなければ 0.0）"""
+    return info["duration"] if info else 0.0
+
+
+def creation_time_from(file: Path, info) -> float:
+    """レコードから作成日時（なければファイルの更新時刻）"""
+    if info and info["creation_time"] is not None:
+        return info["creation_time"]
+    return file.stat().st_mtime
+
+
 def get_video_duration(file: Path) -> float:
     try:
-        cmd = [
-            "ffprobe", "-v", "error",
-            "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            str(file)
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return float(result.stdout.strip())
+        return duration_from(media_info(file))
     except Exception:
         return 0.0
-    
+
 def check_ffmpeg():
-    try:
-        subprocess.run(
-            ["ffmpeg", "-version"],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            check=True
-        )
-        return True
-    except Exception:
-        return False
+    """ffmpeg が使えるか（結果はキャッシュされる。ffmpeg_capabilities 参照）"""
+    return ffmpeg_runner.ffmpeg_capabilities() is not None
 
 def get_media_creation_time(file: Path) -> float:
     try:
-        cmd = [
-            "ffprobe", "-v", "quiet", "-print_format", "json",
-            "-show_entries", "format_tags=creation_time", str(file)
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        data = json.loads(result.stdout)
-        creation_str = data.get("format", {}).get("tags", {}).get("creation_time")
-        if creation_str:
-            dt = datetime.fromisoformat(creation_str.replace("Z", "+00:00"))
-            return dt.timestamp()
+        info = media_info(file)
     except Exception:
-        pass
-    return file.stat().st_mtime
+        info = None
+    return creation_time_from(file, info)
+
+
+def scan_media(input_dir: Path, min_duration: float = 1.0):
+    """
+    フォルダ直下の動画を並列に ffprobe し（probe_engine）、
+    min_duration 秒を超えるものを作成日時順に返す
+    """
+    candidates = [f for f in input_dir.iterdir()
+                  if f.suffix.lower() in MEDIA_SUFFIXES]
+    found = []
+    for f, info in probe_engine.iter_probe(candidates):
+        if duration_from(info) > min_duration:
+            found.append((creation_time_from(f, info), f))
+    return [f for _, f in sorted(found)]
 
 
 # =========================
-# 動画変換
+# エンコード設定
 # =========================
 
-def convert_video(infile: Path, outfile: Path):
+def convert_settings() -> dict:
+    """
+    結合用の変換設定（calibrate で作ったプロファイル、なければ
+    encoder_profile.DEFAULTS）。calibrate 後に起動し直さなくても反映されるよう毎回読む
+    """
+    return encoder_profile.settings("convert")
+
+
+def default_workers() -> int:
+    """並列変換のワーカー数（プロファイルがなければ1ジョブあたり約4スレッドになる数）"""
+    return convert_settings()["workers"]
+
 
-    vf_filter = (
+def convert_threads(workers: int, settings=None) -> int:
+    """
+    workers 本を同時に変換するときの1本あたりのスレッド数
+    プロファイルのスレッド数は校正したときの並列数での値なので、
+    合計（threads × workers）が同じになるように割り振る
+    """
+    settings = settings or convert_settings()
+    if settings["threads"]:
+        return max(1, round(settings["threads"] * settings["workers"] / workers))
+    return max(1, CPU_COUNT // workers)
+
+
+def convert_video_args(settings=None) -> list:
+    """結合用の映像エンコード設定"""
+    settings = settings or convert_settings()
+    return ["-c:v", "libx264", "-crf", str(settings["crf"]),
+            "-preset", settings["preset"], "-profile:v", "high"]
+
+
+def ppt_video_args() -> list:
+    """PowerPoint 用の映像エンコード設定"""
+    settings = encoder_profile.settings("compress")
+    args = ["-c:v", "libx264", "-crf", str(settings["crf"]),
+            "-preset", settings["preset"]]
+    if settings["threads"]:
+        args += ["-threads", str(settings["threads"])]
+    return args
+
+
+# =========================
+# 動画変換
+# =========================
+
+def concat_vf_filter() -> str:
+    return (
         f"scale='min({TARGET_WIDTH}/iw,{TARGET_HEIGHT}/ih)*iw':"
         f"'min({TARGET_WIDTH}/iw,{TARGET_HEIGHT}/ih)*ih',"
         f"pad={TARGET_WIDTH}:{TARGET_HEIGHT}:(ow-iw)/2:(oh-ih)/2,"
-        "fps=30,format=yuv420p"
+        f"fps={TARGET_FPS},format={TARGET_PIX_FMT},setsar=1"
+    )
+
+
+def clip_audio_filter(infile: Path, loudness: str = "dynaudnorm") -> str:
+    """クリップにかける音声フィルタ（LOUDNESS_MODES 参照）"""
+    if loudness not in LOUDNESS_MODES:
+        raise ValueError(f"loudnessは{', '.join(LOUDNESS_MODES)}のいずれかです")
+    if loudness == "dynaudnorm":
+        return CONVERT_AUDIO_FILTER
+    info = media_info(infile)
+    if not info or not info["acodec"]:
+        return NO_GAIN_FILTER  # 音声がない
+    import audio_analysis  # numpy の読み込みは起動時間に響くので使うときだけ
+    try:
+        gain = audio_analysis.clip_gain(audio_analysis.analysis(infile))
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        # 1本の解析に失敗しても結合は続ける（そのクリップはゲインなし）
+        print("音声解析に失敗したためゲインなし:", infile.name, e)
+        gain = 0.0
+    if abs(gain) < 0.5:
+        return NO_GAIN_FILTER
+    return f"volume={gain}dB"
+
+
+def convert_task(infile: Path, outfile: Path, threads: int = 0,
+                 audio_filter: str = CONVERT_AUDIO_FILTER) -> dict:
+    """convert_video のエンコードタスク（encode_farm のワーカーにも渡せる）"""
+    return encode_farm.make_task(
+        "convert", infile, outfile, concat_vf_filter(),
+        [*convert_video_args(), *CONVERT_MUX_ARGS],
+        audio_filter, CONVERT_AUDIO_ARGS, threads=threads,
+        duration=get_video_duration(infile))
+
+
+def convert_video(infile: Path, outfile: Path, threads: int = 0,
+                  audio_filter: str = CONVERT_AUDIO_FILTER):
+    """
+    threads      : libx264 に渡すスレッド数（0 なら ffmpeg の自動設定）
+    audio_filter : 音声フィルタ（clip_audio_filter 参照）
+    """
+    encode_farm.run_task(convert_task(infile, outfile, threads, audio_filter))
+
+
+def is_concat_conformant(info) -> bool:
+    """
+    convert_video の出力と同じ形式（解像度・fps・画素形式・SAR・コーデック・
+    プロファイル・time_base・サンプリング周波数）か
+    """
+    if not info:
+        return False
+    return (
+        info["width"] == TARGET_WIDTH
+        and info["height"] == TARGET_HEIGHT
+        and abs(info["fps"] - TARGET_FPS) < 0.01
+        and info["pix_fmt"] == TARGET_PIX_FMT
+        and info["sample_aspect_ratio"] in (None, "1:1", "0:1")   # 0:1 は未指定
+        and info["vcodec"] == TARGET_VCODEC
+        and info["profile"] == TARGET_PROFILE
+        and info["time_base"] == f"1/{TARGET_TIMESCALE}"
+        and info["rotation"] == 0
+        and info["acodec"] == TARGET_ACODEC
+        and info["channels"] == TARGET_CHANNELS
+        and info["sample_rate"] == TARGET_SAMPLE_RATE
     )
 
+
+REMUX_ARGS = ["-map", "0:v:0", "-map", "0:a:0", "-c", "copy"]
+COPY_VIDEO_ARGS = ["-map", "0:v:0", "-map", "0:a:0", "-c:v", "copy"]
+
+
+def remux_video(infile: Path, outfile: Path):
+    """再エンコードせずに映像・音声1本ずつを mp4 に詰め替える"""
     cmd = [
         "ffmpeg", "-y", "-i", str(infile),
-        "-vf", vf_filter,
-        "-af", "dynaudnorm",
-        "-c:v", "libx264", "-crf", "20", "-preset", "fast",
-        "-c:a", "aac", "-b:a", "192k", "-ac", "2",
+        *REMUX_ARGS,
         str(outfile)
     ]
 
-    subprocess.run(cmd, check=True)
+    run_ffmpeg(cmd, "remux", infile, outfile, get_video_duration(infile))
+
+
+def copy_video_clip(infile: Path, outfile: Path,
+                    audio_filter: str = CONVERT_AUDIO_FILTER):
+    """映像はそのままコピーし、音声だけ audio_filter をかけて再エンコードする"""
+    cmd = [
+        "ffmpeg", "-y", "-i", str(infile),
+        *COPY_VIDEO_ARGS,
+        "-af", audio_filter,
+        *CONVERT_AUDIO_ARGS,
+        str(outfile)
+    ]
+
+    run_ffmpeg(cmd, "copy_video", infile, outfile, get_video_duration(infile))
+
+
+def clip_mode(infile: Path, copy_conformant: bool = True,
+              audio_filter: str = CONVERT_AUDIO_FILTER) -> str:
+    """
+    中間ファイルの作り方
+      "copy"       : 詰め替えのみ（形式が合っていて音声フィルタが不要）
+      "copy_video" : 映像はコピーし、音声だけフィルタをかけて再エンコード
+                     （形式が合っていて dynaudnorm・ゲインをかける）
+      "encode"     : 映像・音声とも再エンコード
+    """
+    if not copy_conformant or not is_concat_conformant(media_info(infile)):
+        return "encode"
+    if audio_filter == NO_GAIN_FILTER:
+        return "copy"
+    return "copy_video"
+
+
+def prepare_clip(infile: Path, outfile: Path, threads: int = 0,
+                 copy_conformant: bool = True,
+                 audio_filter: str = CONVERT_AUDIO_FILTER) -> str:
+    """
+    結合用の中間ファイルを作る
+    すでに結合形式に合っているクリップは映像をコピー、それ以外は再エンコード
+    戻り値: "copy"・"copy_video"・"encode"（clip_mode 参照）
+    """
+    mode = clip_mode(infile, copy_conformant, audio_filter)
+    if mode == "copy":
+        remux_video(infile, outfile)
+    elif mode == "copy_video":
+        copy_video_clip(infile, outfile, audio_filter)
+    else:
+        convert_video(infile, outfile, threads, audio_filter)
+    return mode
+
+
+# =========================
+# 中間ファイルキャッシュ
+# =========================
+
+def transcode_cache_key(infile: Path, mode: str,
+                        audio_filter: str = CONVERT_AUDIO_FILTER) -> str:
+    """
+    入力ファイル（パス・サイズ・mtime）と変換パラメータから作るハッシュ
+    パラメータが変われば別のキーになるので古い中間ファイルは使われない
+    """
+    st = infile.stat()
+    params = {
+        "src": str(infile.resolve()),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "mode": mode,
+    }
+    if mode == "copy":
+        params["args"] = REMUX_ARGS
+    elif mode == "copy_video":
+        params.update({
+            "args": COPY_VIDEO_ARGS,
+            "af": audio_filter,
+            "audio": CONVERT_AUDIO_ARGS,
+        })
+    else:
+        params.update({
+            "vf": concat_vf_filter(),
+            "af": audio_filter,
+            "video": [*convert_video_args(), *CONVERT_MUX_ARGS],
+            "audio": CONVERT_AUDIO_ARGS,
+        })
+    data = json.dumps(params, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def cached_prepare_clip(infile: Path, cache_dir: Path, threads: int = 0,
+                        copy_conformant: bool = True, rebuild: bool = False,
+                        loudness: str = "dynaudnorm", farm=None):
+    """
+    キャッシュにあればそれを使い、なければ prepare_clip で作成する
+    farm : encode_farm.Coordinator。再エンコードをワーカーに任せる
+           （入力とキャッシュフォルダはワーカーから見える共有ストレージに置く）
+    戻り値: (中間ファイル, "cached" / "copy" / "copy_video" / "encode" / "farm")
+    """
+    audio_filter = clip_audio_filter(infile, loudness)
+    mode = clip_mode(infile, copy_conformant, audio_filter)
+    key = transcode_cache_key(infile, mode, audio_filter)
+    out = cache_dir / f"{key}.mp4"
+
+    if out.exists() and not rebuild:
+        os.utime(out)  # LRU 用に最終利用時刻を更新
+        return out, "cached"
+
+    if farm is not None and mode == "encode":
+        # ワーカーは一時ファイルに書いてから out に置き換える
+        failed = farm.run([convert_task(infile.resolve(), out.resolve(), 0,
+                                        audio_filter)])
+        if failed:
+            raise RuntimeError(failed[0][1])
+        if not out.is_file():
+            raise RuntimeError(f"ワーカーの出力が見つかりません: {out}")
+        return out, "farm"
+
+    # 途中で失敗しても壊れたファイルがキャッシュに残らないよう別名で作る
+    part = cache_dir / f"{key}.part.mp4"
+    try:
+        prepare_clip(infile, part, threads, copy_conformant, audio_filter)
+    except BaseException:
+        part.unlink(missing_ok=True)
+        raise
+    os.replace(part, out)
+    return out, mode
+
+
+def evict_transcode_cache(cache_dir: Path,
+                          max_bytes: int = TRANSCODE_CACHE_MAX_BYTES,
+                          keep=()):
+    """
+    合計サイズが max_bytes を超えたら、最後に使われた時刻が古い順に削除
+    keep に含まれるファイル（今回の結合で使うもの）は削除しない
+    合計はキャッシュの本体（キーの名前のファイル）だけで数え、書きかけの
+    ファイル（{キー}.part.mp4・ワーカーの .～.part.mp4）は含めない。
+    書きかけのファイルは TRANSCODE_PART_MAX_AGE 以上古ければ削除する
+    キャッシュ導入前の中間ファイル（temp_{番号}.mp4）はもう使われないので削除する
+    """
+    keep = {Path(k) for k in keep}
+    for p in cache_dir.glob("temp_*.mp4"):
+        if p.stem[len("temp_"):].isdigit() and p not in keep:
+            try:
+                p.unlink()
+                print("旧形式の中間ファイルを削除:", p.name)
+            except OSError:
+                pass
+
+    now = time.time()
+    for p in cache_dir.glob("*.part.mp4"):
+        try:
+            if now - p.stat().st_mtime > TRANSCODE_PART_MAX_AGE:
+                p.unlink()
+                print("書きかけのファイルを削除:", p.name)
+        except OSError:
+            pass
+
+    # watch と concat が同じフォルダを使うので、途中で消えたファイルは飛ばす
+    cached = []
+    for p in cache_dir.glob("*.mp4"):
+        if len(p.stem) != 32:
+            continue
+        try:
+            cached.append((p, p.stat()))
+        except OSError:
+            pass
+    total = sum(st.st_size for _, st in cached)
+    entries = [(p, st) for p, st in cached if p not in keep]
+
+    for p, st in sorted(entries, key=lambda e: e[1].st_mtime):
+        if total <= max_bytes:
+            break
+        try:
+            p.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # 他のプロセスが読んでいる（Windows）
+            continue
+        else:
+            print("キャッシュ削除:", p.name)
+        total -= st.st_size
 
 
 # =========================
 # 結合
 # =========================
 
-def concat_videos(input_dir: Path, output_file: Path):
+def convert_videos_parallel(files, cache_dir: Path,
+                            workers: int = None,
+                            copy_conformant: bool = True,
+                            rebuild: bool = False,
+                            loudness: str = "dynaudnorm",
+                            farm=None):
+    """
+    files     : 入力ファイルのリスト（結合する順）
+    cache_dir : 中間ファイルの保存先
+    workers   : 同時に実行する変換の数（None ならプロファイルの値）
+    copy_conformant : 結合形式に合っているクリップは映像を再エンコードしない
+    rebuild   : キャッシュを使わずに作り直す
+    loudness  : 音量の揃え方（LOUDNESS_MODES）
+    farm      : encode_farm.Coordinator。再エンコードを他のマシンに分散する
+
+    スレッド数はプロファイルの合計スレッド数（なければ CPU コア数）を
+    ワーカー数で分割する（convert_threads 参照）。
+    1本失敗しても他のジョブは最後まで実行し、失敗分をまとめて返す。
+    戻り値: (files と同じ順の中間ファイルのリスト, 失敗リスト)
+    """
+    if workers is None:
+        workers = default_workers()
+    workers = max(1, min(int(workers), len(files) or 1))
+    threads = convert_threads(workers)
+    if farm is not None:
+        # スレッドはワーカーの完了を待つだけなので、全クリップをまとめて渡す
+        workers = max(1, min(len(files), FARM_MAX_PENDING))
+
+    outputs = [None] * len(files)
+    failed = []
+
+    labels = {"cached": "キャッシュ利用", "copy": "コピー完了",
+              "copy_video": "映像コピー・音声変換完了", "encode": "変換完了",
+              "farm": "変換完了（ワーカー）"}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            ffmpeg_runner.submit(pool, cached_prepare_clip, src, cache_dir,
+                                 threads, copy_conformant, rebuild,
+                                 loudness, farm): (i, src)
+            for i, src in enumerate(files)
+        }
+        for future in as_completed(futures):
+            i, src = futures[future]
+            try:
+                out, mode = future.result()
+                outputs[i] = out
+                print(f"{labels[mode]}:", src.name, "->", out.name)
+            except Exception as e:
+                print("変換失敗:", src.name, e)
+                failed.append((src, e))
+
+    return outputs, failed
+
+
+def open_farm(address: str = None, local_workers: int = 0):
+    """
+    encode_farm のコーディネータを起動する（with 文で使う）
+    address も local_workers も指定がなければ何もしない（as の値は None）
+    """
+    if not address and not local_workers:
+        return contextlib.nullcontext()
+    farm = encode_farm.Coordinator(address or "127.0.0.1:0").start()
+    print("コーディネータ:", farm.address)
+    farm.start_local_workers(local_workers)
+    return farm
 
-    tmp_dir = input_dir / "tmp_concat"
-    tmp_dir.mkdir(exist_ok=True)
 
-    files = [
-        f for f in input_dir.iterdir()
-        if f.suffix.lower() in [".mp4", ".mov", ".mts"]
-        and get_video_duration(f) > 1.0
+def recommend_concat_mode(files, workers: int = None) -> str:
+    """
+    どちらの結合モードが速いかの目安
+
+    files  : クリップごとに並列変換 → 中間ファイルを concat demuxer で結合
+             クリップ数が多いほど並列化が効き、再実行時はキャッシュが使える。
+             ただし出力と同程度の中間ファイルの書き込み・読み戻しが発生する。
+    stream : 1つの ffmpeg で全入力を filter_complex の concat で結合し1回だけエンコード
+             中間ファイルなし。エンコーダが1つなので並列度は x264 のスレッドのみ。
+             入力を全部同時に開くため、クリップ数が多いとメモリを消費する。
+
+    判定:
+      - クリップ数が STREAM_CONCAT_MAX_CLIPS を超える → files
+      - クリップ数がワーカー数以下（並列化の効果がない）→ stream
+      - 合計サイズが STREAM_CONCAT_MIN_BYTES 以上（NAS などで I/O が支配的）→ stream
+      - それ以外 → files
+    """
+    if workers is None:
+        workers = default_workers()
+    if len(files) > STREAM_CONCAT_MAX_CLIPS:
+        return "files"
+    if len(files) <= workers:
+        return "stream"
+    total = sum(f.stat().st_size for f in files)
+    if total >= STREAM_CONCAT_MIN_BYTES:
+        return "stream"
+    return "files"
+
+
+def concat_filter_graph(files, loudness: str = "dynaudnorm") -> tuple:
+    """
+    stream モード用の filter_complex
+    各入力を convert_video と同じ形に正規化してから concat フィルタで繋ぐ
+    音声のない入力は無音を生成して補う
+    戻り値: (追加の入力引数, フィルタ文字列)
+    """
+    extra_inputs = []
+    chains = []
+    pads = []
+    n = len(files)
+    silent = 0
+
+    for i, f in enumerate(files):
+        info = media_info(f) or {}
+        chains.append(f"[{i}:v:0]{concat_vf_filter()}[v{i}]")
+        if info.get("acodec"):
+            a_src = f"[{i}:a:0]"
+        else:
+            # 無音入力はファイル入力の後ろに追加する
+            idx = n + silent
+            silent += 1
+            extra_inputs += ["-f", "lavfi", "-t", str(info.get("duration", 0.0)),
+                             "-i", f"anullsrc=r={TARGET_SAMPLE_RATE}:cl=stereo"]
+            a_src = f"[{idx}:a]"
+        chains.append(
+            f"{a_src}{clip_audio_filter(f, loudness)},"
+            f"aformat=sample_rates={TARGET_SAMPLE_RATE}:channel_layouts=stereo[a{i}]"
+        )
+        pads.append(f"[v{i}][a{i}]")
+
+    chains.append(f"{''.join(pads)}concat=n={n}:v=1:a=1[v][a]")
+    return extra_inputs, ";\n".join(chains)
+
+
+def concat_videos_stream(files, output_file: Path, loudness: str = "dynaudnorm"):
+    """
+    中間ファイルを作らずに1回の ffmpeg で正規化・結合・エンコードする
+    """
+    extra_inputs, graph = concat_filter_graph(files, loudness)
+
+    # 入力が多いとコマンドラインが長くなるのでフィルタはファイルで渡す
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf-8",
+                                     delete=False) as script:
+        script.write(graph)
+
+    cmd = ["ffmpeg", "-y"]
+    for f in files:
+        cmd += ["-i", str(f)]
+    cmd += extra_inputs
+    cmd += [
+        *ffmpeg_runner.filter_script_args(script.name),
+        "-map", "[v]", "-map", "[a]",
+        *convert_video_args(),
+        *CONVERT_AUDIO_ARGS,
+        str(output_file)
     ]
 
-    files = sorted(files, key=get_media_creation_time)
+    try:
+        run_ffmpeg(cmd, "concat_stream", output=output_file,
+                   duration=sum(get_video_duration(f) for f in files))
+    finally:
+        os.unlink(script.name)
+
+
+def concat_videos(input_dir: Path, output_file: Path,
+                  workers: int = None,
+                  copy_conformant: bool = True,
+                  rebuild: bool = False,
+                  mode: str = "files",
+                  loudness: str = "dynaudnorm",
+                  farm=None):
+    """
+    mode     : "files"（クリップごとに変換して結合）, "stream"（1パス）, "auto"
+               速さの目安は recommend_concat_mode を参照
+    loudness : 音量の揃え方（LOUDNESS_MODES）
+    farm     : encode_farm.Coordinator。"files" の変換を他のマシンに分散する
+               （結合はこのマシンで作成日時順に行う）
+    """
+    if mode not in CONCAT_MODES:
+        raise ValueError(f"modeは{', '.join(CONCAT_MODES)}のいずれかです")
+
+    with timed_stage("probe", input_dir):
+        files = scan_media(input_dir)
 
     if not files:
         print("動画がありません")
         return
 
-    converted_files = []
+    if mode == "auto":
+        mode = "files" if farm is not None else recommend_concat_mode(files, workers)
+        print("結合モード:", mode)
 
-    for i, f in enumerate(files, 1):
-        out = tmp_dir / f"temp_{i}.mp4"
-        convert_video(f, out)
-        converted_files.append(out)
+    if mode == "stream":
+        concat_videos_stream(files, output_file, loudness)
+        print("結合完了:", output_file)
+        return
+
+    tmp_dir = input_dir / "tmp_concat"
+    tmp_dir.mkdir(exist_ok=True)
+
+    # 中間ファイルは入力と変換パラメータのハッシュ名で tmp_concat に保存し、
+    # 次回以降は変更のないクリップを再利用する。並び順は files のまま。
+    converted_files, failed = convert_videos_parallel(
+        files, tmp_dir, workers, copy_conformant, rebuild, loudness, farm)
+
+    if failed:
+        names = ", ".join(src.name for src, _ in failed)
+        raise RuntimeError(
+            f"{len(failed)} 件の変換に失敗しました: {names}"
+            f"（変換済みファイルは {tmp_dir} に残っています）"
+        )
+
+    evict_transcode_cache(tmp_dir, keep=converted_files)
 
     concat_list = tmp_dir / "list.txt"
 
@@ -135,39 +693,246 @@ def concat_videos(input_dir: Path, output_file: Path):
         str(output_file)
     ]
 
-    subprocess.run(cmd, check=True)
+    run_ffmpeg(cmd, "concat", concat_list, output_file,
+               sum(get_video_duration(c) for c in converted_files))
 
     print("結合完了:", output_file)
 
 
+# =========================
+# 取り込み中の事前変換
+# =========================
+
+def watch_and_prepare(input_dir: Path, workers: int = None,
+                      copy_conformant: bool = True,
+                      stable_seconds: float = watch_folder.STABLE_SECONDS):
+    """
+    input_dir を監視し、コピーが終わった動画から結合用の中間ファイルを作る
+    中間ファイルは concat_videos と同じ tmp_concat に入るため、
+    取り込み後の結合はキャッシュを使ったストリームコピーだけで済む。
+    取り込んだクリップは tmp_concat/manifest.json に作成日時順で記録する。
+    Ctrl+C で終了（実行中の変換を待ってから KeyboardInterrupt を送り直す）。
+    """
+    tmp_dir = input_dir / "tmp_concat"
+    tmp_dir.mkdir(exist_ok=True)
+    manifest = watch_folder.IngestManifest(tmp_dir / "manifest.json")
+    workers = max(1, int(workers if workers is not None else default_workers()))
+    threads = convert_threads(workers)
+
+    stopping = threading.Event()
+
+    def ingest(f: Path):
+        try:
+            duration = get_video_duration(f)
+            if duration <= 1.0:
+                print("スキップ（動画として読めないか短すぎます）:", f.name)
+                return
+            out, mode = cached_prepare_clip(f, tmp_dir, threads, copy_conformant)
+            manifest.update(f, creation_time=get_media_creation_time(f),
+                            duration=duration, intermediate=out.name, mode=mode)
+            print("取り込み完了:", f.name, "->", out.name)
+        except Exception as e:
+            if stopping.is_set():
+                # Ctrl+C で ffprobe などが止められただけなので失敗として残さない
+                print("取り込み中止:", f.name)
+                return
+            manifest.update(f, error=str(e))
+            print("取り込み失敗:", f.name, e)
+
+    watcher = watch_folder.FolderWatcher(input_dir, stable_seconds=stable_seconds)
+    print(f"監視中 ({watcher.mode}):", input_dir)
+    # 実行中の ffmpeg には Ctrl+C を届けず、最後まで変換させる
+    with ffmpeg_runner.detached(), ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for f in watcher.watch():
+                ffmpeg_runner.submit(pool, ingest, f)
+        except KeyboardInterrupt:
+            # 未着手の取り込みは取り消し、実行中のものだけ終わるまで待つ
+            stopping.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            print("監視を終了します（実行中の変換が終わるまで待ちます）")
+            interrupted = True
+        else:
+            interrupted = False
+    if interrupted:
+        raise KeyboardInterrupt
+
+
 # =========================
 # 分割
 # =========================
 
-def split_video(input_file: Path, output_dir: Path, seconds: int):
+# 無音に合わせるとき、分割位置を動かしてよい範囲（seconds に対する割合と上限秒）
+SILENCE_SNAP_RATIO = 0.25
+SILENCE_SNAP_MAX = 15.0
+
+
+def split_points(input_file: Path, seconds: float, duration: float,
+                 silence: bool = False) -> list:
+    """
+    分割位置（0 と終端を除く）
+    silence : 各位置を近くの無音区間の中央に寄せる（audio_analysis 参照）
+    """
+    points = []
+    n = 1
+    while n * seconds < duration - smart_cut.KEYFRAME_TOLERANCE:
+        points.append(float(n * seconds))
+        n += 1
+    if not silence or not points:
+        return points
+
+    import audio_analysis  # numpy の読み込みは起動時間に響くので使うときだけ
+    record = audio_analysis.analysis(input_file)
+    if not record or not record["silences"]:
+        return points
+    window = min(seconds * SILENCE_SNAP_RATIO, SILENCE_SNAP_MAX)
+    snapped = []
+    for t in points:
+        mid = audio_analysis.nearest_silence(record["silences"], t, window)
+        t = mid if mid is not None else t
+        # 前の位置より後ろ・終端より前に限る
+        if t > (snapped[-1] if snapped else 0.0) + smart_cut.KEYFRAME_TOLERANCE \
+                and t < duration - smart_cut.KEYFRAME_TOLERANCE:
+            snapped.append(round(t, 3))
+    return snapped
+
+
+def plan_split(input_file: Path, seconds: float, silence: bool = False):
+    """
+    seconds ごとの正確な分割計画
+    各区間をキーフレーム境界でコピー部分と再エンコード部分に分ける
+    （キーフレームは media_index にキャッシュされる）
+    silence : 分割位置を近くの無音に寄せる（split_points 参照）
+    戻り値: (メディア情報, [{"index", "start", "end", "parts"}, ...])
+    """
+    info = media_info(input_file)
+    if not info or not info["width"]:
+        raise ValueError(f"動画情報を取得できません: {input_file}")
+
+    duration = info["duration"]
+    if not duration or duration <= 0:
+        raise ValueError(f"動画の長さを取得できません: {input_file}")
+    keyframes = keyframe_times(input_file)
+    # 分割位置がない（seconds より短い・無音に寄せた結果すべて外れた）ときは1区間
+    points = split_points(input_file, seconds, duration, silence)
+    bounds = [0.0, *points, duration]
+
+    plan = []
+    for n, (start, end) in enumerate(zip(bounds, bounds[1:])):
+        plan.append({
+            "index": n,
+            "start": start,
+            "end": end,
+            "parts": smart_cut.plan_range(keyframes, start, end, duration),
+        })
+
+    return info, plan
+
+
+def print_split_plan(plan):
+    for seg in plan:
+        parts = " + ".join(f"{mode} {s:.3f}-{e:.3f}" for mode, s, e in seg["parts"])
+        print(f"{seg['index']:03d}: {seg['start']:.3f} - {seg['end']:.3f}  [{parts}]")
+
+
+def split_segment(input_file: Path, info, seg, out: Path, work_dir: Path):
+    """計画の1区間を書き出す（音声は同じ区間をコピー）"""
+    files = smart_cut.render_parts(input_file, seg["parts"], info, work_dir,
+                                   prefix=f"seg{seg['index']:03d}")
+    smart_cut.join_parts(files, input_file, out, work_dir,
+                         audio_start=seg["start"],
+                         audio_duration=seg["end"] - seg["start"])
+
+
+def split_video(input_file: Path, output_dir: Path, seconds: int,
+                accurate: bool = False,
+                workers: int = None,
+                dry_run: bool = False,
+                silence: bool = False):
+    """
+    accurate : 区間の長さを seconds に揃える（境界の GOP だけ再エンコード）
+               False のときは従来どおり segment muxer でキーフレーム単位に分割
+    workers  : accurate のとき同時に書き出す区間の数（None ならプロファイルの値）
+    dry_run  : accurate の分割計画を表示するだけで何も書き出さない
+    silence  : 分割位置を近くの無音に寄せる（会話の途中で切らない）
+    """
+
+    if dry_run:
+        _, plan = plan_split(input_file, seconds, silence)
+        print_split_plan(plan)
+        return plan
 
     output_dir.mkdir(exist_ok=True)
 
+    if accurate:
+        info, plan = plan_split(input_file, seconds, silence)
+        if smart_cut.supports(info):
+            split_video_accurate(input_file, output_dir, info, plan, workers)
+            print("分割完了:", output_dir)
+            return
+        print("このコーデックは正確な分割に未対応のため、キーフレーム単位で分割します")
+
+    duration = get_video_duration(input_file)
+    points = split_points(input_file, seconds, duration, silence) if silence else []
+    if points:
+        segment_args = ["-segment_times", ",".join(f"{t:.3f}" for t in points)]
+    else:
+        # segment muxer は空の -segment_times を受け付けない
+        segment_args = ["-segment_time", str(seconds)]
+
     cmd = [
         "ffmpeg", "-y",
         "-i", str(input_file),
         "-c", "copy",
         "-map", "0",
-        "-segment_time", str(seconds),
+        *segment_args,
         "-f", "segment",
         "-reset_timestamps", "1",
         str(output_dir / f"{input_file.stem}_%03d.mp4")
     ]
 
-    subprocess.run(cmd, check=True)
+    run_ffmpeg(cmd, "split", input_file, output_dir, duration)
 
     print("分割完了:", output_dir)
 
 
+def split_video_accurate(input_file: Path, output_dir: Path, info, plan,
+                         workers: int = None):
+    """計画どおりに区間を並列で書き出す"""
+    if workers is None:
+        workers = default_workers()
+    work_dir = Path(tempfile.mkdtemp(prefix=".split_", dir=output_dir))
+    failed = []
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+            futures = {
+                ffmpeg_runner.submit(
+                    pool, split_segment, input_file, info, seg,
+                    output_dir / f"{input_file.stem}_{seg['index']:03d}.mp4",
+                    work_dir): seg
+                for seg in plan
+            }
+            for future in as_completed(futures):
+                seg = futures[future]
+                try:
+                    future.result()
+                    print(f"区間 {seg['index']:03d} 完了")
+                except Exception as e:
+                    print(f"区間 {seg['index']:03d} 失敗:", e)
+                    failed.append(seg["index"])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if failed:
+        raise RuntimeError(f"{len(failed)} 区間の書き出しに失敗しました: {sorted(failed)}")
+
+
 # =========================
 # クレジット追加
 # =========================
-def add_credit(input_file, text_file, align, color, fontsize, output_file):
+def add_credit(input_file, text_file, align, color, fontsize, output_file,
+               start=None, end=None, smart=False):
     """
     input_file : 入力動画
     text_file  : クレジットテキストファイル（改行ごとに1行）
@@ -175,9 +940,41 @@ def add_credit(input_file, text_file, align, color, fontsize, output_file):
     color      : #RRGGBB
     fontsize   : int
     output_file: 出力動画
+    start, end : スクロール区間（秒）。省略時は開始3秒～終了3秒前
+    smart      : クレジット区間だけ再エンコードし、前後はストリームコピー
+    """
+    fontsize = int(fontsize)
+    info, lines, timing = _credit_setup(input_file, text_file, align, fontsize,
+                                        start, end)
+
+    # クレジットを画像として1回だけ描画し、overlay でスクロールさせる
+    print(f"Running ffmpeg... Lines: {len(lines)}, Speed: {timing['speed']:.2f}px/s")
+    if smart:
+        mode = render_credits_smart(input_file, lines, info, timing,
+                                    align, color, fontsize, output_file)
+        print("部分再エンコード" if mode == "smart" else "全体を再エンコード")
+    else:
+        render_credits(input_file, lines, int(info["width"]), timing,
+                       align, color, fontsize, output_file)
+    print(f"Done! Output: {output_file}")
+
+
+def preview_credit(input_file, text_file, align, color, fontsize, out_prefix,
+                   start=None, end=None, clip=False):
+    """
+    add_credit と同じ設定で、スクロール区間の数か所だけを描画する
+    clip=False なら静止画、True なら区間中央の短い縮小動画（render_preview 参照）
+    戻り値: [(時刻, ファイル), ...]
     """
-    fontsize = int(fontsize)  
+    fontsize = int(fontsize)
+    info, lines, timing = _credit_setup(input_file, text_file, align, fontsize,
+                                        start, end)
+    return render_preview(input_file, lines, int(info["width"]), int(info["height"]),
+                          timing, align, color, fontsize, out_prefix, clip)
 
+
+def _credit_setup(input_file, text_file, align, fontsize, start, end):
+    """入力の確認とスクロールの計算。戻り値: (メディア情報, 行, タイミング)"""
     # ファイル存在チェック
     if not os.path.isfile(input_file):
         raise FileNotFoundError(f"入力ファイルがありません: {input_file}")
@@ -187,116 +984,212 @@ def add_credit(input_file, text_file, align, color, fontsize, output_file):
         raise ValueError("alignはleft, center, rightのいずれかです")
 
     # 動画情報取得
-    result = subprocess.run(
-        ["ffprobe", "-v", "quiet", "-print_format", "json",
-         "-show_format", "-show_streams", "-select_streams", "v:0", input_file],
-        capture_output=True, text=True, check=True
-    )
-    import json
-    info = json.loads(result.stdout)
-    duration = float(info["format"]["duration"])
-    video_width = int(info["streams"][0]["width"])
-    video_height = int(info["streams"][0]["height"])
+    info = media_info(input_file)
+    if not info or not info["width"]:
+        raise ValueError(f"動画情報を取得できません: {input_file}")
+    duration = info["duration"]
+    video_height = int(info["height"])
 
     # クレジット行読み込み
-    with open(text_file, "r", encoding="utf-8") as f:
-        lines = [line.rstrip("\n") if line.strip() else " " for line in f]
-
-    line_height  = int(fontsize * 1.5)
-    total_text_h = len(lines) * line_height
-
-    # スクロール範囲：開始3秒～終了3秒前
-    scroll_start = 3.0
-    scroll_end   = duration - 3.0
-    scroll_dur   = scroll_end - scroll_start
-    scroll_dist  = video_height + total_text_h
-    speed        = scroll_dist / scroll_dur  # px/sec
-
-    # 色変換
-    ffmpeg_color = "0x" + color.lstrip("#").upper()
-
-    # x座標
-    if align == "left":
-        x_expr = "50"
-    elif align == "right":
-        x_expr = "w-tw-50"
-    else:
-        x_expr = "(w-tw)/2"
-
-    # enable 式
-    enable_expr = f"gte(t\\,{scroll_start})*lte(t\\,{scroll_end})"
-
-    # drawtext フィルタ作成
-    filters = []
-    for i, line in enumerate(lines):
-        escaped = line.replace("\\", "\\\\").replace("'", "\u2019").replace(":", "\\:").replace(",", "\\,")
-        y_offset = i * line_height
-        y_expr = f"h-{speed:.4f}*(t-{scroll_start})+{y_offset}"
-        filters.append(
-            f"drawtext=text='{escaped}':fontsize={fontsize}:fontcolor={ffmpeg_color}:x={x_expr}:y={y_expr}:enable='{enable_expr}'"
-        )
-
-    vf = ",".join(filters)
-
-    # 実行
-    cmd = [
-        "ffmpeg", "-y",
-        "-i", input_file,
-        "-vf", vf,
-        "-codec:a", "copy",
-        output_file
-    ]
+    lines = read_credit_lines(text_file)
 
-    print(f"Running ffmpeg... Lines: {len(lines)}, Speed: {speed:.2f}px/s")
-    subprocess.run(cmd, check=True)
-    print(f"Done! Output: {output_file}")
+    # スクロール範囲：指定がなければ開始3秒～終了3秒前
+    timing = credit_timing(duration, video_height, len(lines), fontsize,
+                           start, end)
+    return info, lines, timing
 
 
 # =========================
 # PowerPoint用圧縮
 # =========================
 
-def compress_for_powerpoint(input_file: Path, output_file: Path, remove_audio=False):
-
-    vf_filter = "scale=960:-2,fps=15"
+def compress_for_powerpoint(input_file: Path, output_file: Path, remove_audio=False,
+                            chunks: int = 1, target_mb: float = None, farm=None):
+    """
+    chunks    : 1 なら1プロセスでエンコード
+                2 以上ならその数、0 なら長さとコア数から決めた数の区間に分けて
+                並列エンコードする（chunk_encode 参照）
+    target_mb : 出力をこのサイズ (MB) 以下にする（size_target 参照）
+    farm      : encode_farm.Coordinator。区間のエンコードを他のマシンに分散する
+                （chunks が 1 なら 0 と同じ扱い）
+    """
+    if farm is not None and chunks == 1:
+        chunks = 0
+    duration = get_video_duration(input_file)
+    info = media_info(input_file)
+    has_audio = not remove_audio and bool(info and info["acodec"])
+
+    video_args = ppt_video_args()
+    two_pass = False
+    if target_mb:
+        plan = size_target.plan_target_size(
+            input_file, duration, target_mb * 1000 ** 2, PPT_VIDEO_FILTER,
+            video_args, PPT_AUDIO_BITRATE if has_audio else 0)
+        video_args = plan["video_args"]
+        two_pass = plan["mode"] == "2pass" and chunks == 1
+        print(f"目標サイズ {target_mb}MB: {plan['mode']} "
+              f"映像 {plan['bitrate'] // 1000}kbps 以下, "
+              f"予測 {plan['predicted'] / 1000 ** 2:.1f}MB")
+
+    if chunks != 1:
+        used = chunk_encode.encode_chunked(
+            input_file, output_file, duration, PPT_VIDEO_FILTER, video_args,
+            PPT_AUDIO_ARGS if has_audio else None,
+            count=chunks or None, cpu_count=CPU_COUNT,
+            extra_args=["-movflags", "+faststart"], farm=farm)
+        print(f"圧縮完了（{used} 区間）:", output_file)
+        return
 
     cmd = [
         "ffmpeg", "-y",
         "-i", str(input_file),
-        "-vf", vf_filter,
-        "-c:v", "libx264",
-        "-crf", "28",
-        "-preset", "veryfast",
+        "-vf", PPT_VIDEO_FILTER,
+        *video_args,
         "-movflags", "+faststart"
     ]
 
     if remove_audio:
         cmd.append("-an")
     else:
-        cmd += ["-c:a", "aac", "-b:a", "96k"]
+        cmd += PPT_AUDIO_ARGS
 
-    cmd.append(str(output_file))
+    if not two_pass:
+        cmd.append(str(output_file))
+        run_ffmpeg(cmd, "compress", input_file, output_file, duration)
+        print("圧縮完了:", output_file)
+        return
 
-    subprocess.run(cmd, check=True)
+    work_dir = tempfile.mkdtemp(prefix="2pass_")
+    try:
+        passlog = Path(work_dir) / "passlog"
+        size_target.two_pass_first(input_file, PPT_VIDEO_FILTER, video_args,
+                                   passlog, duration)
+        cmd += ["-pass", "2", "-passlogfile", str(passlog), str(output_file)]
+        run_ffmpeg(cmd, "compress", input_file, output_file, duration)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
     print("圧縮完了:", output_file)
 
 
 # =========================
-# GUI
+# 一括書き出し（1回のデコードで複数出力）
 # =========================
 
-def launch_gui():
+def _tee_path(path: Path) -> str:
+    """tee マルチプレクサの出力先として書けるパス（区切り文字をエスケープ）"""
+    text = Path(path).as_posix()
+    for ch in "\\|[]":
+        text = text.replace(ch, "\\" + ch)
+    return text
+
+
+def fan_out(input_path: Path, master_file: Path, ppt_file: Path = None,
+            ppt_remove_audio: bool = False, segment_dir: Path = None,
+            seconds: int = None):
+    """
+    入力を1回だけデコードし、1つの ffmpeg で次をまとめて書き出す
+      master_file : 結合用に正規化したマスター（convert_video と同じ設定）
+      ppt_file    : PowerPoint 用（compress_for_powerpoint と同じ設定）
+      segment_dir : seconds 秒ごとに分割したマスター（tee で同じエンコード結果を分割）
 
+    input_path がフォルダなら concat_videos と同じ順で結合したものを入力にする。
+    分割位置にはキーフレームを置くので、区間の長さは正確になる。
+    """
+    if Path(input_path).is_dir():
+        with timed_stage("probe", input_path):
+            files = scan_media(Path(input_path))
+        if not files:
+            print("動画がありません")
+            return
+    else:
+        files = [Path(input_path)]
+    if segment_dir is not None and not seconds:
+        raise ValueError("分割する場合は秒数を指定してください")
+
+    extra_inputs, graph = concat_filter_graph(files)
+    ppt_audio = ppt_file is not None and not ppt_remove_audio
+    v_master, a_master = "[v]", "[a]"
+    if ppt_file is not None:
+        graph += f";\n[v]split=2[vm][vp0];\n[vp0]{PPT_VIDEO_FILTER}[vp]"
+        v_master = "[vm]"
+        if ppt_audio:
+            graph += ";\n[a]asplit=2[am][ap]"
+            a_master = "[am]"
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf-8",
+                                     delete=False) as script:
+        script.write(graph)
+
+    cmd = ["ffmpeg", "-y"]
+    for f in files:
+        cmd += ["-i", str(f)]
+    cmd += extra_inputs
+    cmd += [
+        *ffmpeg_runner.filter_script_args(script.name),
+        "-map", v_master, "-map", a_master,
+        *convert_video_args(),
+        *CONVERT_AUDIO_ARGS,
+    ]
+    if segment_dir is not None:
+        segment_dir.mkdir(parents=True, exist_ok=True)
+        pattern = segment_dir / f"{Path(master_file).stem}_%03d.mp4"
+        outputs = [f"[movflags=+faststart]{_tee_path(master_file)}"
+                   f"|[f=segment:segment_time={seconds}:reset_timestamps=1]"
+                   f"{_tee_path(pattern)}"]
+        cmd += [
+            "-force_key_frames", f"expr:gte(t,n_forced*{seconds})",
+            "-flags", "+global_header",
+            "-f", "tee",
+            outputs[0],
+        ]
+    else:
+        outputs = [str(master_file)]
+        cmd += ["-movflags", "+faststart", outputs[0]]
+
+    if ppt_file is not None:
+        outputs.append(str(ppt_file))
+        cmd += ["-map", "[vp]"]
+        cmd += ["-map", "[ap]", *PPT_AUDIO_ARGS] if ppt_audio else ["-an"]
+        cmd += [*ppt_video_args(), "-movflags", "+faststart", outputs[-1]]
+
+    try:
+        run_ffmpeg(cmd, "fan_out", input_path, master_file,
+                   sum(get_video_duration(f) for f in files), outputs)
+    finally:
+        os.unlink(script.name)
+
+    print("書き出し完了:", master_file)
+    if ppt_file is not None:
+        print("PowerPoint 用:", ppt_file)
+    if segment_dir is not None:
+        print("分割:", segment_dir)
+
+
+# =========================
+# GUI
+# =========================
 
+def launch_gui():
+    # GUI ツールキットは GUI を起動するときだけ読み込む
+    # （CLI・batch・ワーカーや他のモジュールからの import を軽くする）
+    import tkinter as tk
+    from tkinter import filedialog
+    import flet as ft
 
     def main(page: ft.Page):
 
-        ffmpeg_ok = check_ffmpeg()
+        caps = ffmpeg_runner.ffmpeg_capabilities()
 
-        if ffmpeg_ok:
+        if caps is not None and "libx264" not in caps["encoders"]:
+            ffmpeg_status = ft.Text(
+                f"⚠ ffmpeg に libx264 がありません（{caps['version']}）",
+                color=ft.Colors.ORANGE,
+                weight="bold"
+            )
+        elif caps is not None:
             ffmpeg_status = ft.Text(
-                "✅ ffmpeg が利用可能です（PATH OK）",
+                f"✅ ffmpeg が利用可能です（{caps['version']}）",
                 color=ft.Colors.GREEN,
                 weight="bold"
             )
@@ -307,10 +1200,70 @@ def launch_gui():
                 weight="bold"
             )
 
+        # ===== ジョブキュー =====
+        # ボタンは処理をキューに登録するだけで、実行は別スレッドで行う
+        jobs = JobQueue(1)
+        job_rows = {}
+        job_list = ft.Column(scroll=ft.ScrollMode.AUTO, height=180)
+
+        status_labels = {
+            "queued": "待機中", "running": "実行中", "done": "完了",
+            "failed": "失敗", "cancelled": "キャンセル",
+        }
+
+        def on_job_change(job):
+            if job.id not in job_rows:
+                text = ft.Text(job.name, expand=True)
+                bar = ft.ProgressBar(value=0, width=200)
+                cancel_btn = ft.ElevatedButton(
+                    "キャンセル", on_click=lambda e, i=job.id: jobs.cancel(i))
+                job_rows[job.id] = (text, bar, cancel_btn)
+                job_list.controls.append(ft.Row([text, bar, cancel_btn]))
+            text, bar, cancel_btn = job_rows[job.id]
+            label = status_labels[job.status]
+            if job.error is not None:
+                label += f": {job.error}"
+            text.value = f"{job.name} [{label}]"
+            if job.status == "done":
+                bar.value = 1
+            elif job.status in ("failed", "cancelled"):
+                bar.value = 0
+            cancel_btn.disabled = job.status not in ("queued", "running")
+            page.update()
+
+        jobs.listeners.append(on_job_change)
+
+        def on_ffmpeg_event(event):
+            row = job_rows.get(event.get("job"))
+            if row is None:
+                return
+            text, bar, _ = row
+            job = jobs.jobs[event["job"]]
+            name = Path(event.get("output") or event.get("input") or "").name
+            if event["event"] == "progress":
+                if event.get("percent") is not None:
+                    bar.value = event["percent"] / 100
+                speed = f" {event['speed']:.2f}x" if event.get("speed") else ""
+                fps = f" {event['fps']:.0f}fps" if event.get("fps") else ""
+                text.value = f"{job.name} [{event['stage']}] {name}{fps}{speed}"
+            elif event["event"] == "start":
+                bar.value = None  # 長さがわかるまでは不定表示
+                text.value = f"{job.name} [{event['stage']}] {name}"
+            else:
+                return
+            page.update()
+
+        ffmpeg_runner.add_listener(on_ffmpeg_event)
+
+        job_limit = ft.TextField(label="同時に実行するジョブ数", value="1", width=200,
+            on_change=lambda e: jobs.set_limit(int(e.control.value))
+                if e.control.value.isdigit() and int(e.control.value) > 0 else None)
+
         page.title = "動画処理ツール"
         page.window_width = 950
         page.window_height = 750
         page.theme_mode = ft.ThemeMode.LIGHT
+        page.scroll = ft.ScrollMode.AUTO
 
         def toggle_theme(e):
             if page.theme_mode == ft.ThemeMode.LIGHT:
@@ -331,6 +1284,75 @@ def launch_gui():
 
         theme_switch = ft.Switch(label="ダークモード", on_change=toggle_theme)
 
+        # ===== プレビュー（proxy） =====
+        # サムネイルはバックグラウンドで作り、できたものから表示する
+        # 分割・クレジットのタブではプロキシ動画を再生し、サムネイルでその時刻へ移動する
+        proxies = proxy.ProxyBuilder()
+
+        def format_time(t):
+            return f"{int(t // 60)}:{t % 60:04.1f}"
+
+        def thumb_strip(manifest, marks=(), on_select=None):
+            """
+            サムネイルを横に並べる
+            marks の各時刻を含むサムネイル（その時刻の直前のもの）を赤枠で示す
+            on_select(時刻) : サムネイルをクリックしたときに呼ぶ
+            """
+            thumbs = manifest["thumbs"]
+            marked = set()
+            for t in marks:
+                before = [i for i, th in enumerate(thumbs) if th["time"] <= t]
+                if before:
+                    marked.add(before[-1])
+            return ft.Row([
+                ft.Container(
+                    ft.Column([ft.Image(src=th["image"], width=proxy.THUMB_WIDTH),
+                               ft.Text(format_time(th["time"]), size=10)],
+                              spacing=2),
+                    border=ft.border.all(2, ft.Colors.RED) if i in marked else None,
+                    padding=2,
+                    on_click=(lambda e, t=th["time"]: on_select(t)) if on_select else None)
+                for i, th in enumerate(thumbs)
+            ], scroll=ft.ScrollMode.AUTO)
+
+        def proxy_player(manifest):
+            """プロキシ動画のプレーヤー（プロキシがない・flet に Video がなければ None）"""
+            if not manifest["proxy"] or not hasattr(ft, "Video"):
+                return None
+            return ft.Video(playlist=[ft.VideoMedia(manifest["proxy"])],
+                            autoplay=False, width=proxy.PROXY_WIDTH * 2,
+                            height=proxy.PROXY_WIDTH * 9 // 8)
+
+        def show_proxy(file, holder, marks=lambda manifest: (), player=False):
+            """
+            file のサムネイルを holder（ft.Column）に表示する
+            player : プロキシ動画も表示し、サムネイルのクリックでその時刻へ移動する
+            """
+            holder.controls = [ft.Text("プレビュー作成中...", size=12)]
+            page.update()
+
+            def ready(_, manifest, error):
+                if error is not None:
+                    holder.controls = [ft.Text(f"プレビュー失敗: {error}",
+                                               color=ft.Colors.RED, size=12)]
+                elif manifest is not None:
+                    video = proxy_player(manifest) if player else None
+                    if video is None:
+                        holder.controls = [thumb_strip(manifest, marks(manifest))]
+                    else:
+                        holder.controls = [
+                            video,
+                            thumb_strip(manifest, marks(manifest),
+                                        lambda t: video.seek(int(t * 1000)))]
+                else:
+                    return
+                page.update()
+
+            proxies.request(file, ready)
+
+        def in_background(fn, *args):
+            threading.Thread(target=fn, args=args, daemon=True).start()
+
         def select_file(field, save=False, folder=False):
             root = tk.Tk()
             root.withdraw()
@@ -348,12 +1370,62 @@ def launch_gui():
         # ===== 結合 =====
         concat_in = ft.TextField(label="入力フォルダ", expand=True)
         concat_out = ft.TextField(label="出力ファイル", expand=True)
+        concat_workers = ft.TextField(label="並列数（空欄でこのマシンの設定）",
+                                      value="")
+        concat_copy = ft.Checkbox(label="形式が一致するクリップは映像を再エンコードしない",
+                                  value=True)
+        concat_rebuild = ft.Checkbox(label="キャッシュを使わず作り直す",
+                                     value=False)
+        concat_mode = ft.Dropdown(label="結合モード", value="files",
+            options=[ft.dropdown.Option("files", "クリップごとに変換（多数のクリップ向け）"),
+                     ft.dropdown.Option("stream", "1パス（少数・大容量のクリップ向け）"),
+                     ft.dropdown.Option("auto", "自動")])
+        concat_loudness = ft.Dropdown(label="音量の揃え方", value="dynaudnorm",
+            options=[ft.dropdown.Option("dynaudnorm", "動的に正規化"),
+                     ft.dropdown.Option("gain", "クリップごとに一定のゲイン（解析）")])
 
         concat_btn = ft.ElevatedButton("結合実行",
-            on_click=lambda e: concat_videos(
-                Path(concat_in.value), Path(concat_out.value))
+            on_click=lambda e: jobs.submit(
+                f"結合: {Path(concat_out.value).name}", concat_videos,
+                Path(concat_in.value), Path(concat_out.value),
+                int(concat_workers.value) if concat_workers.value else None,
+                concat_copy.value,
+                concat_rebuild.value,
+                concat_mode.value,
+                concat_loudness.value,
+                outputs=[concat_out.value])
         )
 
+        # 結合する順（作成日時順）にクリップとサムネイルを並べる
+        concat_preview = ft.Column(scroll=ft.ScrollMode.AUTO, height=300)
+
+        def preview_concat():
+            proxies.cancel_pending()
+            concat_preview.controls = [ft.Text("クリップを確認中...", size=12)]
+            page.update()
+            try:
+                files = scan_media(Path(concat_in.value))
+            except OSError as e:
+                concat_preview.controls = [ft.Text(f"フォルダを読めません: {e}",
+                                                   color=ft.Colors.RED, size=12)]
+                page.update()
+                return
+            concat_preview.controls = []
+            for n, f in enumerate(files, 1):
+                holder = ft.Column()
+                info = media_info(f)
+                length = format_time(info["duration"]) if info else "-"
+                concat_preview.controls.append(ft.Column([
+                    ft.Text(f"{n:03d}  {f.name}  ({length})", weight="bold", size=12),
+                    holder]))
+                show_proxy(f, holder)
+            if not files:
+                concat_preview.controls = [ft.Text("動画がありません", size=12)]
+            page.update()
+
+        concat_preview_btn = ft.ElevatedButton("クリップを確認",
+            on_click=lambda e: in_background(preview_concat))
+
         concat_ui = ft.Column([
             ft.Row([concat_in,
                 ft.ElevatedButton("参照",
@@ -361,21 +1433,60 @@ def launch_gui():
             ft.Row([concat_out,
                 ft.ElevatedButton("保存先",
                     on_click=lambda e: select_file(concat_out, save=True))]),
-            concat_btn
+            concat_workers,
+            concat_copy,
+            concat_rebuild,
+            concat_mode,
+            concat_loudness,
+            ft.Row([concat_btn, concat_preview_btn]),
+            concat_preview
         ])
 
         # ===== 分割 =====
         split_in = ft.TextField(label="入力動画", expand=True)
         split_out = ft.TextField(label="出力フォルダ", expand=True)
         split_sec = ft.TextField(label="秒数", value="10")
+        split_accurate = ft.Checkbox(label="正確な長さで分割（境界だけ再エンコード）",
+                                     value=False)
+        split_silence = ft.Checkbox(label="無音の位置で分割（会話の途中で切らない）",
+                                    value=False)
 
         split_btn = ft.ElevatedButton("分割実行",
-            on_click=lambda e: split_video(
+            on_click=lambda e: jobs.submit(
+                f"分割: {Path(split_in.value).name}", split_video,
                 Path(split_in.value),
                 Path(split_out.value),
-                int(split_sec.value))
+                int(split_sec.value),
+                split_accurate.value,
+                silence=split_silence.value,
+                outputs=[Path(split_out.value) / f"{Path(split_in.value).stem}_*.mp4"])
         )
 
+        split_plan_btn = ft.ElevatedButton("分割計画を表示",
+            on_click=lambda e: jobs.submit(
+                f"分割計画: {Path(split_in.value).name}", split_video,
+                Path(split_in.value),
+                Path(split_out.value),
+                int(split_sec.value),
+                dry_run=True,
+                silence=split_silence.value)
+        )
+
+        # 分割位置（赤枠）をサムネイル上に示す
+        split_preview = ft.Column()
+
+        def split_marks(manifest):
+            if not split_sec.value.isdigit() or int(split_sec.value) <= 0:
+                return ()
+            duration = manifest["duration"] or 0.0
+            # 実行時と同じ位置を示す（無音に合わせる場合は音声解析の結果を使う）
+            return split_points(Path(split_in.value), int(split_sec.value), duration,
+                                silence=split_silence.value)
+
+        split_preview_btn = ft.ElevatedButton("プレビュー",
+            on_click=lambda e: show_proxy(Path(split_in.value), split_preview,
+                                          split_marks, player=True))
+
         split_ui = ft.Column([
             ft.Row([split_in,
                 ft.ElevatedButton("参照",
@@ -384,7 +1495,10 @@ def launch_gui():
                 ft.ElevatedButton("参照",
                     on_click=lambda e: select_file(split_out, folder=True))]),
             split_sec,
-            split_btn
+            split_accurate,
+            split_silence,
+            ft.Row([split_btn, split_plan_btn, split_preview_btn]),
+            split_preview
         ])
 
         # ===== クレジット =====
@@ -397,17 +1511,86 @@ def launch_gui():
                      ft.dropdown.Option("right")])
         color = ft.TextField(label="カラーコード", value="#FFFFFF")
         size = ft.TextField(label="フォントサイズ", value="36")
+        credit_start = ft.TextField(label="開始秒（空欄で3秒後）", value="")
+        credit_end = ft.TextField(label="終了秒（空欄で終了3秒前）", value="")
+        credit_smart = ft.Checkbox(label="クレジット区間だけ再エンコード", value=False)
 
         credit_btn = ft.ElevatedButton("クレジット追加",
-            on_click=lambda e: add_credit(
+            on_click=lambda e: jobs.submit(
+                f"クレジット: {Path(credit_out.value).name}", add_credit,
                 credit_in.value,
                 credit_txt.value,
                 align.value,
                 color.value,
                 size.value,
-                credit_out.value)
+                credit_out.value,
+                float(credit_start.value) if credit_start.value else None,
+                float(credit_end.value) if credit_end.value else None,
+                credit_smart.value,
+                outputs=[credit_out.value])
         )
 
+        # スクロール区間の開始・終了（赤枠）をサムネイル上に示す
+        credit_preview = ft.Column()
+
+        def credit_marks(manifest):
+            duration = manifest["duration"] or 0.0
+            try:
+                start = float(credit_start.value) if credit_start.value else SCROLL_MARGIN
+                end = float(credit_end.value) if credit_end.value \
+                    else duration - SCROLL_MARGIN
+            except ValueError:
+                return ()
+            return (start, end)
+
+        credit_preview_btn = ft.ElevatedButton("プレビュー",
+            on_click=lambda e: show_proxy(Path(credit_in.value), credit_preview,
+                                          credit_marks, player=True))
+
+        # クレジットの見え方だけを数か所描画する（全体はエンコードしない）
+        credit_render_preview = ft.Column()
+        preview_runs = []
+
+        def preview_credit_render(clip):
+            credit_render_preview.controls = [ft.Text("描画中...", size=12)]
+            page.update()
+            # 表示中の画像が上書きされないよう毎回別のフォルダに作る
+            for old in preview_runs:
+                shutil.rmtree(old, ignore_errors=True)
+            preview_runs.clear()
+            root = media_index.cache_dir() / "credit_preview"
+            root.mkdir(exist_ok=True)
+            run_dir = Path(tempfile.mkdtemp(dir=root))
+            preview_runs.append(run_dir)
+            try:
+                results = preview_credit(
+                    credit_in.value, credit_txt.value, align.value, color.value,
+                    size.value, run_dir / "preview",
+                    float(credit_start.value) if credit_start.value else None,
+                    float(credit_end.value) if credit_end.value else None,
+                    clip)
+            except Exception as e:
+                credit_render_preview.controls = [
+                    ft.Text(f"プレビュー失敗: {e}", color=ft.Colors.RED, size=12)]
+                page.update()
+                return
+            if clip:
+                t, out = results[0]
+                credit_render_preview.controls = [
+                    ft.Text(f"{format_time(t)} から: {out}", size=12, selectable=True)]
+            else:
+                credit_render_preview.controls = [ft.Row([
+                    ft.Column([ft.Image(src=str(out), width=280),
+                               ft.Text(format_time(t), size=10)], spacing=2)
+                    for t, out in results
+                ], scroll=ft.ScrollMode.AUTO)]
+            page.update()
+
+        credit_still_btn = ft.ElevatedButton("クレジットを試し描画",
+            on_click=lambda e: in_background(preview_credit_render, False))
+        credit_clip_btn = ft.ElevatedButton("短い動画で試す",
+            on_click=lambda e: in_background(preview_credit_render, True))
+
         credit_ui = ft.Column([
             ft.Row([credit_in,
                 ft.ElevatedButton("参照",
@@ -419,28 +1602,43 @@ def launch_gui():
                 ft.ElevatedButton("保存先",
                     on_click=lambda e: select_file(credit_out, save=True))]),
             align, color, size,
-            credit_btn
+            ft.Row([credit_start, credit_end]),
+            credit_smart,
+            ft.Row([credit_btn, credit_preview_btn, credit_still_btn, credit_clip_btn]),
+            credit_preview,
+            credit_render_preview
         ])
 
         # ===== PowerPoint圧縮 =====
         comp_in = ft.TextField(label="入力動画", expand=True)
         comp_out = ft.TextField(label="出力動画", expand=True)
+        comp_target = ft.TextField(label="目標サイズ MB（空欄で指定なし）", value="")
+        comp_chunked = ft.Checkbox(label="区間に分けて並列エンコード（長い動画向け）",
+                                   value=False)
 
         comp_audio_btn = ft.ElevatedButton(
             "音声あり圧縮",
-            on_click=lambda e: compress_for_powerpoint(
+            on_click=lambda e: jobs.submit(
+                f"圧縮: {Path(comp_out.value).name}", compress_for_powerpoint,
                 Path(comp_in.value),
                 Path(comp_out.value),
-                False
+                False,
+                0 if comp_chunked.value else 1,
+                float(comp_target.value) if comp_target.value else None,
+                outputs=[comp_out.value]
             )
         )
 
         comp_noaudio_btn = ft.ElevatedButton(
             "音声なし圧縮",
-            on_click=lambda e: compress_for_powerpoint(
+            on_click=lambda e: jobs.submit(
+                f"圧縮: {Path(comp_out.value).name}", compress_for_powerpoint,
                 Path(comp_in.value),
                 Path(comp_out.value),
-                True
+                True,
+                0 if comp_chunked.value else 1,
+                float(comp_target.value) if comp_target.value else None,
+                outputs=[comp_out.value]
             )
         )
 
@@ -451,6 +1649,8 @@ def launch_gui():
             ft.Row([comp_out,
                 ft.ElevatedButton("保存先",
                     on_click=lambda e: select_file(comp_out, save=True))]),
+            comp_target,
+            comp_chunked,
             ft.Row([
                 comp_audio_btn,
                 comp_noaudio_btn
@@ -464,6 +1664,8 @@ def launch_gui():
                     theme_switch
                     ]),
                 ffmpeg_status,  # ← ここに追加
+                job_limit,
+                job_list,
                 ft.Divider()
             ]),
             ft.Tabs(tabs=[
@@ -474,6 +1676,13 @@ def launch_gui():
             ])
         )
 
+        # 起動時間の計測用（benchmarks/startup.py）: 表示できた時刻を書いて終了する
+        probe = os.environ.get("MOVIEPROCESS_STARTUP_PROBE")
+        if probe:
+            with open(probe, "w", encoding="utf-8") as f:
+                json.dump({"window": time.time()}, f)
+            page.window_destroy()
+
     ft.app(target=main)
 
 
@@ -481,5 +1690,182 @@ def launch_gui():
 # メイン
 # =========================
 
+def main():
+    """
+    引数なし : GUI を起動
+    concat   : コマンドラインから結合を実行
+    watch    : フォルダを監視して結合用の中間ファイルを事前に作る
+    split    : コマンドラインから分割を実行
+    compress : コマンドラインから PowerPoint 用に圧縮
+    worker   : 他のマシンの --farm からエンコードタスクを受け取って実行
+    fanout   : マスター・PowerPoint 用・分割を1回のデコードで書き出す
+    proxy    : GUI のプレビュー用のプロキシとサムネイルを事前に作る
+    calibrate: このマシン向けのエンコード設定を測定して保存
+    batch    : JSON マニフェストのジョブをまとめて実行（batch.py 参照）
+    """
+    use_bundled_ffmpeg()
+
+    parser = argparse.ArgumentParser(description="動画処理ツール")
+    sub = parser.add_subparsers(dest="command")
+
+    p_concat = sub.add_parser("concat", help="フォルダ内の動画を作成日時順に結合")
+    p_concat.add_argument("input_dir", type=Path)
+    p_concat.add_argument("output_file", type=Path)
+    p_concat.add_argument("--workers", type=int,
+                          help="同時に実行する変換の数（省略時はこのマシンの設定）")
+    p_concat.add_argument("--no-copy", action="store_true",
+                          help="形式が一致するクリップも映像を再エンコードする")
+    p_concat.add_argument("--rebuild", action="store_true",
+                          help="中間ファイルのキャッシュを使わず作り直す")
+    p_concat.add_argument("--mode", choices=CONCAT_MODES, default="files",
+                          help="files: クリップごとに変換, stream: 1パス, auto: 自動選択")
+    p_concat.add_argument("--loudness", choices=LOUDNESS_MODES, default="dynaudnorm",
+                          help="dynaudnorm: 動的に正規化, gain: 解析したゲインで揃える")
+    p_concat.add_argument("--farm", metavar="ADDRESS",
+                          help="ワーカーを待ち受けて変換を分散する（ホスト:ポート / unix:パス。"
+                               "他のマシンから受け付けるには MOVIEPROCESS_FARM_TOKEN が必要。"
+                               "未設定なら表示されるトークンを使う）")
+    p_concat.add_argument("--local-workers", type=int, default=0,
+                          help="このマシンで動かすワーカーの数（--farm の試験用）")
+
+    p_watch = sub.add_parser("watch",
+                             help="フォルダを監視し、追加された動画を結合用に事前変換")
+    p_watch.add_argument("input_dir", type=Path)
+    p_watch.add_argument("--workers", type=int,
+                         help="同時に実行する変換の数（省略時はこのマシンの設定）")
+    p_watch.add_argument("--no-copy", action="store_true",
+                         help="形式が一致するクリップも映像を再エンコードする")
+    p_watch.add_argument("--stable", type=float, default=watch_folder.STABLE_SECONDS,
+                         help="この秒数サイズが変わらなければコピー完了とみなす")
+
+    p_split = sub.add_parser("split", help="動画を一定秒数ごとに分割")
+    p_split.add_argument("input_file", type=Path)
+    p_split.add_argument("output_dir", type=Path)
+    p_split.add_argument("seconds", type=int)
+    p_split.add_argument("--accurate", action="store_true",
+                         help="区間の長さを正確にする（境界の GOP だけ再エンコード）")
+    p_split.add_argument("--workers", type=int,
+                         help="同時に書き出す区間の数（--accurate のとき。省略時はこのマシンの設定）")
+    p_split.add_argument("--dry-run", action="store_true",
+                         help="分割計画を表示するだけで書き出さない")
+    p_split.add_argument("--silence", action="store_true",
+                         help="分割位置を近くの無音に寄せる")
+
+    p_compress = sub.add_parser("compress", help="PowerPoint 用に圧縮")
+    p_compress.add_argument("input_file", type=Path)
+    p_compress.add_argument("output_file", type=Path)
+    p_compress.add_argument("--no-audio", action="store_true", help="音声を削除する")
+    p_compress.add_argument("--chunks", type=int, default=1,
+                            help="区間に分けて並列エンコード（0: 自動, 1: 分けない）")
+    p_compress.add_argument("--target-mb", type=float,
+                            help="出力をこのサイズ (MB) 以下にする")
+    p_compress.add_argument("--farm", metavar="ADDRESS",
+                            help="ワーカーを待ち受けて区間のエンコードを分散する"
+                                 "（他のマシンから受け付けるには MOVIEPROCESS_FARM_TOKEN が必要。"
+                                 "未設定なら表示されるトークンを使う）")
+    p_compress.add_argument("--local-workers", type=int, default=0,
+                            help="このマシンで動かすワーカーの数（--farm の試験用）")
+
+    p_worker = sub.add_parser("worker", help="他のマシンの concat / compress --farm を手伝う")
+    p_worker.add_argument("address",
+                          help="コーディネータのアドレス（ホスト:ポート / unix:パス。"
+                               "MOVIEPROCESS_FARM_TOKEN にコーディネータと同じトークンが必要）")
+    p_worker.add_argument("--slots", type=int, default=1,
+                          help="同時に実行するタスクの数")
+    p_worker.add_argument("--name", help="ワーカー名（省略時はホスト名）")
+    p_worker.add_argument("--map", nargs=2, action="append", default=[],
+                          metavar=("REMOTE", "LOCAL"),
+                          help="コーディネータ側のパスの先頭をこのマシンのパスに置き換える")
+
+    p_fan = sub.add_parser("fanout",
+                           help="1回のデコードでマスター・PowerPoint 用・分割をまとめて書き出す")
+    p_fan.add_argument("input", type=Path, help="入力動画または動画のフォルダ")
+    p_fan.add_argument("master_file", type=Path)
+    p_fan.add_argument("--ppt", type=Path, help="PowerPoint 用の出力")
+    p_fan.add_argument("--ppt-no-audio", action="store_true",
+                       help="PowerPoint 用の音声を削除する")
+    p_fan.add_argument("--segments", type=Path, help="分割したマスターの出力フォルダ")
+    p_fan.add_argument("--seconds", type=int, help="分割の秒数")
+
+    p_proxy = sub.add_parser("proxy", help="プレビュー用のプロキシとサムネイルを作る")
+    p_proxy.add_argument("inputs", type=Path, nargs="+", help="動画または動画のフォルダ")
+    p_proxy.add_argument("--scene", action="store_true",
+                         help="一定間隔ではなくシーンの切り替わりでサムネイルを取る")
+    p_proxy.add_argument("--rebuild", action="store_true",
+                         help="キャッシュを使わず作り直す")
+
+    p_calib = sub.add_parser("calibrate",
+                             help="試験エンコードでこのマシン向けの設定を作る")
+    p_calib.add_argument("--sample", type=Path,
+                         help="試験に使う動画（省略時は合成動画）")
+    p_calib.add_argument("--seconds", type=float, default=10.0,
+                         help="試験エンコードの長さ（秒）")
+    p_calib.add_argument("--presets", nargs="+", default=encoder_profile.PRESETS,
+                         help="試す x264 プリセット")
+
+    p_batch = sub.add_parser("batch", help="マニフェストのジョブを依存関係順に実行")
+    p_batch.add_argument("manifest", type=Path)
+    p_batch.add_argument("--jobs", "-j", type=int, default=1,
+                         help="同時に実行するジョブの数")
+    p_batch.add_argument("--force", action="store_true",
+                         help="出力が最新でも実行する")
+    p_batch.add_argument("--dry-run", action="store_true",
+                         help="実行するジョブを表示するだけで実行しない")
+
+    args = parser.parse_args()
+
+    if args.command == "concat":
+        with open_farm(args.farm, args.local_workers) as farm:
+            concat_videos(args.input_dir, args.output_file, args.workers,
+                          not args.no_copy, args.rebuild, args.mode, args.loudness,
+                          farm)
+    elif args.command == "watch":
+        try:
+            watch_and_prepare(args.input_dir, args.workers, not args.no_copy, args.stable)
+        except KeyboardInterrupt:
+            sys.exit(130)
+    elif args.command == "split":
+        split_video(args.input_file, args.output_dir, args.seconds,
+                    args.accurate, args.workers, args.dry_run, args.silence)
+    elif args.command == "compress":
+        with open_farm(args.farm, args.local_workers) as farm:
+            compress_for_powerpoint(args.input_file, args.output_file,
+                                    args.no_audio, args.chunks, args.target_mb, farm)
+    elif args.command == "worker":
+        encode_farm.run_worker(args.address, args.slots, args.name,
+                               path_map=[tuple(m) for m in args.map])
+    elif args.command == "fanout":
+        fan_out(args.input, args.master_file, args.ppt, args.ppt_no_audio,
+                args.segments, args.seconds)
+    elif args.command == "proxy":
+        files = []
+        for item in args.inputs:
+            files += scan_media(item) if item.is_dir() else [item]
+        for f in files:
+            manifest = proxy.make_proxy(f, "scene" if args.scene else "interval",
+                                        args.rebuild)
+            print(f"{f.name}: サムネイル {len(manifest['thumbs'])} 枚 ->",
+                  Path(manifest["proxy"]).parent)
+    elif args.command == "calibrate":
+        profile = encoder_profile.calibrate(
+            {"convert": concat_vf_filter(), "compress": PPT_VIDEO_FILTER},
+            args.sample, args.seconds, args.presets)
+        for operation in ("convert", "compress"):
+            print(operation, profile[operation]["settings"])
+        print("保存:", encoder_profile.profile_path())
+    elif args.command == "batch":
+        jobs = batch.load_manifest(args.manifest)
+        result = batch.run_manifest(jobs, {
+            "concat": concat_videos,
+            "credit": add_credit,
+            "compress": compress_for_powerpoint,
+            "split": split_video,
+        }, args.jobs, args.force, args.dry_run)
+        if any(s in (batch.FAILED, batch.BLOCKED) for s in result.values()):
+            sys.exit(1)
+    else:
+        launch_gui()
+
+
 if __name__ == "__main__":
-    launch_gui()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -1,4 +1,17 @@
 # -*- mode: python ; coding: utf-8 -*-
+#
+# ビルド方法
+#   pyinstaller movieProcess.spec
+#       1ファイルの EXE（配布しやすいが、起動のたびに一時フォルダへ展開する）
+#   set MOVIEPROCESS_BUILD=onedir  (PowerShell: $env:MOVIEPROCESS_BUILD="onedir")
+#   pyinstaller movieProcess.spec
+#       dist/movieProcess/ フォルダ版（展開・UPX 解凍がないので起動が速い）
+#
+# 起動時間は benchmarks/startup.py --exe <EXE> で比較できる
+
+import os
+
+ONEDIR = os.environ.get("MOVIEPROCESS_BUILD", "onefile") == "onedir"
 
 block_cipher = None
 
@@ -7,8 +20,12 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
+    # GUI と numpy は関数内で import しているので明示する
     hiddenimports = [
-        'flet'
+        'flet',
+        'tkinter',
+        'tkinter.filedialog',
+        'numpy',
     ],
 
     hookspath=[],
@@ -118,14 +135,34 @@ a = Analysis(
 
 pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
 
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.datas,
-    [],
-    name='movieProcess',
-    debug=False,
-    upx=True,
-    console=True,
-)
+if ONEDIR:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        [],
+        exclude_binaries=True,
+        name='movieProcess',
+        debug=False,
+        upx=False,
+        console=True,
+    )
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.datas,
+        strip=False,
+        upx=False,
+        name='movieProcess',
+    )
+else:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        a.binaries,
+        a.datas,
+        [],
+        name='movieProcess',
+        debug=False,
+        upx=True,
+        console=True,
+    )
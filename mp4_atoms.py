@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+MP4 / MOV (ISO-BMFF) の作成日時をファイル上で直接書き換える
+
+ffmpeg でコピーし直す代わりに、ファイルをメモリマップして box をたどり、
+mvhd / tkhd / mdhd の creation_time・modification_time を上書きする。
+udta の ©day や meta の com.apple.quicktime.creationdate があれば、
+同じ長さの文字列で書ける場合に限りこれも更新する。
+ファイルサイズは変わらないので数 GB の動画でも一瞬で終わる。
+"""
+
+import mmap
+import os
+import struct
+from datetime import datetime, timezone
+
+
+PATCHABLE_SUFFIXES = {".mp4", ".mov", ".m4v"}
+
+# 1904-01-01 から 1970-01-01 までの秒数
+MAC_EPOCH_OFFSET = 2082844800
+
+# 子 box を持つコンテナ
+CONTAINERS = {b"moov", b"trak", b"mdia", b"udta", b"meta", b"ilst"}
+
+CREATIONDATE_KEY = b"com.apple.quicktime.creationdate"
+
+
+class Mp4PatchError(ValueError):
+    """書き換えできないファイル"""
+
+
+# =========================
+# box の走査
+# =========================
+
+def iter_boxes(buf, start, end):
+    """
+    [start, end) にある box を順に返す
+    戻り値: (type, box 先頭, 中身の先頭, box 末尾)
+    """
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", buf, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                raise Mp4PatchError("box ヘッダが壊れています")
+            size = struct.unpack_from(">Q", buf, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise Mp4PatchError(f"box のサイズが不正です: {box_type!r}")
+        yield box_type, pos, pos + header, pos + size
+        pos += size
+
+
+def _meta_children_start(buf, body, end):
+    """
+    meta は MP4 では FullBox（4 バイトの version/flags が先頭にある）、
+    QuickTime では通常の box。直後が hdlr かどうかで見分ける
+    """
+    if body + 8 <= end and buf[body + 4:body + 8] == b"hdlr":
+        return body
+    return body + 4
+
+
+# =========================
+# 書き換え
+# =========================
+# 途中で壊れた box が見つかっても中途半端に書き換えないよう、
+# まず書き込み内容 (オフセット, バイト列) を集めてから最後にまとめて反映する
+
+def _header_times(buf, body, end, box_type, mac_time):
+    """mvhd / tkhd / mdhd の creation_time と modification_time"""
+    if body >= end:
+        raise Mp4PatchError(f"box が短すぎます: {box_type!r}")
+    if buf[body] == 1:
+        data = struct.pack(">QQ", mac_time, mac_time)
+    else:
+        data = struct.pack(">II", mac_time, mac_time)
+    # 次の box に書き込まないよう、version/flags(4) + 2 つの時刻が box に収まるか確かめる
+    if body + 4 + len(data) > end:
+        raise Mp4PatchError(f"box が短すぎます: {box_type!r}")
+    return (body + 4, data)
+
+
+def _format_like(old, when):
+    """既存の文字列と同じ長さの書式（タイムゾーン付き / 日付のみ など）"""
+    local = when.astimezone()
+    candidates = [
+        local.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        local.isoformat(timespec="seconds"),
+        when.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        local.strftime("%Y-%m-%d"),
+    ]
+    for text in candidates:
+        data = text.encode("utf-8")
+        if len(data) == len(old):
+            return data
+    return None
+
+
+def _text_write(buf, start, length, when):
+    """同じ長さで書ける場合だけ書き込み内容を返す"""
+    data = _format_like(bytes(buf[start:start + length]), when)
+    return [(start, data)] if data else []
+
+
+def _ilst_writes(buf, start, end, keys, when):
+    """ilst の ©day / creationdate（data box の値）"""
+    writes = []
+    for item_type, _, item_body, item_end in iter_boxes(buf, start, end):
+        if item_type == b"\xa9day":
+            name = item_type
+        else:
+            name = keys.get(struct.unpack(">I", item_type)[0])
+        if name not in (b"\xa9day", CREATIONDATE_KEY):
+            continue
+        for data_type, _, data_body, data_end in iter_boxes(buf, item_body, item_end):
+            if data_type == b"data":
+                value_start = data_body + 8  # type(4) + locale(4)
+                writes += _text_write(buf, value_start, data_end - value_start, when)
+    return writes
+
+
+def _parse_keys(buf, body, end):
+    """meta/keys（1 始まりのインデックス → キー名）"""
+    keys = {}
+    if body + 8 > end:
+        raise Mp4PatchError("keys box が短すぎます")
+    count = struct.unpack_from(">I", buf, body + 4)[0]
+    pos = body + 8
+    for index in range(1, count + 1):
+        if pos + 8 > end:
+            break
+        size = struct.unpack_from(">I", buf, pos)[0]
+        if size < 8 or pos + size > end:
+            raise Mp4PatchError("keys box のエントリが壊れています")
+        keys[index] = bytes(buf[pos + 8:pos + size])
+        pos += size
+    return keys
+
+
+def _collect_writes(buf, start, end, mac_time, when):
+    writes = []
+    keys = {}
+    for box_type, _, body, box_end in iter_boxes(buf, start, end):
+        if box_type in (b"mvhd", b"tkhd", b"mdhd"):
+            writes.append(_header_times(buf, body, box_end, box_type, mac_time))
+        elif box_type == b"keys":
+            keys = _parse_keys(buf, body, box_end)
+        elif box_type == b"ilst":
+            writes += _ilst_writes(buf, body, box_end, keys, when)
+        elif box_type == b"\xa9day" and body + 4 <= box_end:
+            # QuickTime 形式の udta テキスト: 長さ(2) + 言語(2) + 文字列
+            length = struct.unpack_from(">H", buf, body)[0]
+            writes += _text_write(buf, body + 4, min(length, box_end - body - 4), when)
+        elif box_type == b"meta":
+            writes += _collect_writes(buf, _meta_children_start(buf, body, box_end),
+                                      box_end, mac_time, when)
+        elif box_type in CONTAINERS:
+            writes += _collect_writes(buf, body, box_end, mac_time, when)
+    return writes
+
+
+def set_creation_time(path, when: datetime) -> int:
+    """
+    path の作成日時を when に書き換える（タイムゾーンなしはローカル時刻）
+    戻り値: 書き換えたフィールド数
+    moov / mvhd が見つからない・box が壊れている場合は Mp4PatchError
+    （その場合ファイルは変更しない）
+    """
+    mac_time = int(when.timestamp()) + MAC_EPOCH_OFFSET
+
+    with open(path, "r+b") as f:
+        if os.fstat(f.fileno()).st_size < 8:
+            raise Mp4PatchError("ファイルが空です")
+        with mmap.mmap(f.fileno(), 0) as buf:
+            moov = None
+            for box_type, _, body, box_end in iter_boxes(buf, 0, len(buf)):
+                if box_type == b"moov":
+                    moov = (body, box_end)
+                    break
+            if moov is None:
+                raise Mp4PatchError("moov box がありません")
+
+            try:
+                writes = _collect_writes(buf, moov[0], moov[1], mac_time, when)
+            except (struct.error, IndexError) as e:
+                raise Mp4PatchError(f"box が壊れています: {e}") from e
+            if not writes:
+                raise Mp4PatchError("mvhd box がありません")
+
+            for offset, data in writes:
+                buf[offset:offset + len(data)] = data
+            buf.flush()
+
+    return len(writes)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+並列 ffprobe（フォルダ走査用）
+
+asyncio で ffprobe を同時に最大 limit 個まで起動し、終わった順に結果を返す。
+media_index のキャッシュにあるファイルは ffprobe を起動せずにすぐ返し、
+新しく取得した結果はキャッシュに保存する。
+1ファイルが timeout 秒を超えたら打ち切って None を返す（キャッシュはしない）。
+ffprobe が失敗した場合も、メディアではないと判断したとき以外はキャッシュしない
+（media_index.is_invalid_media 参照）。
+"""
+
+import asyncio
+import json
+import os
+import queue
+import subprocess
+import threading
+
+from media_index import get_index, is_invalid_media, parse_probe, probe_command
+
+
+# 同時に起動する ffprobe の数（ネットワークドライブでは待ち時間が大半なので多め）
+PROBE_CONCURRENCY = min(32, (os.cpu_count() or 1) * 4)
+
+# 1ファイルあたりの制限時間（秒）
+PROBE_TIMEOUT = 30.0
+
+_DONE = object()
+
+
+def _kill(proc):
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+
+
+async def _probe_one(file, semaphore, timeout):
+    """戻り値: (ファイル, レコード, キャッシュしてよいか)"""
+    async with semaphore:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *probe_command(file),
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError:
+            return file, None, False
+        try:
+            out, err = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            _kill(proc)
+            await proc.wait()
+            return file, None, False
+        except asyncio.CancelledError:
+            # 打ち切られたら ffprobe を残さない
+            _kill(proc)
+            await proc.wait()
+            raise
+    if proc.returncode != 0:
+        stderr = err.decode("utf-8", errors="replace")
+        return file, None, is_invalid_media(proc.returncode, stderr)
+    try:
+        return file, parse_probe(json.loads(out)), True
+    except ValueError:
+        return file, None, True
+
+
+async def probe_stream(files, limit=PROBE_CONCURRENCY, timeout=PROBE_TIMEOUT):
+    """
+    (ファイル, レコード) を終わった順に返す非同期ジェネレータ
+    レコードは media_index.parse_probe の形式。読めない・時間切れは None
+    """
+    index = get_index()
+    semaphore = asyncio.Semaphore(max(1, int(limit)))
+    tasks = []
+    try:
+        for file in files:
+            try:
+                hit, record = index.lookup(file)
+            except OSError:
+                yield file, None
+                continue
+            if hit:
+                yield file, record
+            else:
+                tasks.append(asyncio.ensure_future(_probe_one(file, semaphore, timeout)))
+
+        for next_done in asyncio.as_completed(tasks):
+            file, record, cacheable = await next_done
+            if cacheable:
+                try:
+                    index.store(file, record)
+                except OSError:
+                    pass
+            yield file, record
+    finally:
+        # 途中で閉じられたら残りを打ち切り、ffprobe の終了まで待つ
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def iter_probe(files, limit=PROBE_CONCURRENCY, timeout=PROBE_TIMEOUT):
+    """
+    probe_stream の同期版（for 文で使う）
+    イベントループは別スレッドで動かすので、GUI などのループの中からでも呼べる
+    途中で break した場合は残りの ffprobe を打ち切る（終了を待ってから戻る）
+    """
+    results = queue.Queue()
+    loop = asyncio.new_event_loop()
+
+    async def produce():
+        stream = probe_stream(files, limit, timeout)
+        try:
+            async for item in stream:
+                results.put(item)
+        except Exception as e:
+            results.put(e)
+        finally:
+            await stream.aclose()
+            results.put(_DONE)
+
+    main = loop.create_task(produce())
+
+    def run():
+        try:
+            loop.run_until_complete(main)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # 終わっていなければ打ち切る（終わっていれば何もしない）
+        loop.call_soon_threadsafe(main.cancel)
+        thread.join()
+        loop.close()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+プレビュー用のプロキシ動画とサムネイル
+
+入力ごとに、低解像度でデコードの軽いプロキシ動画と、一定間隔または
+シーンの切り替わりで取ったサムネイルを1回の ffmpeg で作る。
+結果はキャッシュフォルダの proxies/<キー>/ に置き、キーは入力のパス・サイズ・
+更新時刻と設定から作る（ファイルが変われば作り直す）。
+manifest.json が書かれていれば作成完了。
+
+  {"source": ..., "duration": ..., "proxy": "proxy.mp4",
+   "thumbs": [{"time": 秒, "image": "thumb_001.jpg"}, ...]}
+
+GUI からは ProxyBuilder でバックグラウンドに作らせ、できたものから表示する。
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import ffmpeg_runner
+from ffmpeg_runner import run_ffmpeg
+from media_index import cache_dir, media_info
+
+
+PROXY_VERSION = 1
+
+# プロキシ動画: 小さく・キーフレーム間隔を短くしてシークを速くする
+PROXY_WIDTH = 320
+PROXY_FPS = 15
+PROXY_VIDEO_ARGS = ["-c:v", "libx264", "-preset", "ultrafast", "-tune", "fastdecode",
+                    "-crf", "30", "-g", str(PROXY_FPS), "-pix_fmt", "yuv420p"]
+PROXY_AUDIO_ARGS = ["-c:a", "aac", "-b:a", "64k", "-ac", "1"]
+
+# サムネイル
+THUMB_WIDTH = 160
+THUMB_INTERVAL = 5.0      # interval のときの間隔（秒、長い動画では広げる）
+THUMB_MAX = 40            # 1本あたりの最大枚数
+SCENE_THRESHOLD = 0.3     # scene のときの切り替わり判定のしきい値
+THUMB_MODES = ("interval", "scene")
+
+# バックグラウンドで同時に作る数
+PROXY_WORKERS = 2
+
+
+def proxy_root() -> Path:
+    path = cache_dir() / "proxies"
+    path.mkdir(exist_ok=True)
+    return path
+
+
+def proxy_key(file, thumbs: str = "interval") -> str:
+    path = Path(file).resolve()
+    st = path.stat()
+    params = {
+        "version": PROXY_VERSION,
+        "src": str(path),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "thumbs": thumbs,
+        "video": [PROXY_WIDTH, PROXY_FPS, PROXY_VIDEO_ARGS],
+        "thumb": [THUMB_WIDTH, THUMB_INTERVAL, THUMB_MAX, SCENE_THRESHOLD],
+    }
+    data = json.dumps(params, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def _filter_path(path: Path) -> str:
+    """フィルタ引数に書くパス（: と \\ をエスケープ）"""
+    return str(path).replace("\\", "/").replace(":", "\\:")
+
+
+def thumb_interval(duration: float) -> float:
+    return max(THUMB_INTERVAL, (duration or 0.0) / THUMB_MAX)
+
+
+def _load(folder: Path):
+    """作成済みの manifest（パスは絶対パスにして返す）"""
+    try:
+        with open(folder / "manifest.json", "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    manifest["proxy"] = str(folder / manifest["proxy"]) if manifest["proxy"] else None
+    for thumb in manifest["thumbs"]:
+        thumb["image"] = str(folder / thumb["image"])
+    return manifest
+
+
+def cached_proxy(file, thumbs: str = "interval"):
+    """キャッシュにあるプロキシ（なければ None。ffmpeg は実行しない）"""
+    try:
+        return _load(proxy_root() / proxy_key(file, thumbs))
+    except OSError:
+        return None
+
+
+def _render(file, work: Path, thumbs: str, info) -> dict:
+    duration = info["duration"] if info else None
+    has_audio = bool(info and info["acodec"])
+    scenes = work / "scenes.txt"
+    if thumbs == "scene":
+        pick = (f"select='eq(n\\,0)+gt(scene\\,{SCENE_THRESHOLD})',"
+                f"metadata=print:file='{_filter_path(scenes)}'")
+    else:
+        interval = thumb_interval(duration)
+        pick = f"fps=1/{interval}"
+
+    graph = (f"[0:v:0]scale={PROXY_WIDTH}:-2,fps={PROXY_FPS},split[p][t];"
+             f"[t]{pick},scale={THUMB_WIDTH}:-2[th]")
+    cmd = ["ffmpeg", "-y", "-v", "error", "-i", str(file),
+           "-filter_complex", graph,
+           "-map", "[p]", *PROXY_VIDEO_ARGS]
+    if has_audio:
+        cmd += ["-map", "0:a:0", *PROXY_AUDIO_ARGS]
+    outputs = [str(work / "proxy.mp4"), str(work / "thumb_%03d.jpg")]
+    cmd += [outputs[0], "-map", "[th]", "-q:v", "5", outputs[1]]
+    run_ffmpeg(cmd, "proxy", file, work / "proxy.mp4", duration, outputs)
+
+    images = sorted(p.name for p in work.glob("thumb_*.jpg"))
+    if thumbs == "scene":
+        with open(scenes, "r", encoding="utf-8") as f:
+            times = [float(t) for t in re.findall(r"pts_time:([0-9.]+)", f.read())]
+        scenes.unlink()
+    else:
+        times = [n * interval for n in range(len(images))]
+    entries = [{"time": round(t, 3), "image": name} for t, name in zip(times, images)]
+
+    # 切り替わりが多すぎる場合は均等に間引く
+    if len(entries) > THUMB_MAX:
+        keep = {round(i * (len(entries) - 1) / (THUMB_MAX - 1)) for i in range(THUMB_MAX)}
+        for i, entry in enumerate(entries):
+            if i not in keep:
+                (work / entry["image"]).unlink()
+        entries = [e for i, e in enumerate(entries) if i in keep]
+
+    return {"source": str(Path(file).resolve()), "duration": duration,
+            "proxy": "proxy.mp4", "thumbs": entries}
+
+
+def make_proxy(file, thumbs: str = "interval", rebuild: bool = False) -> dict:
+    """
+    プロキシとサムネイルを作る（キャッシュにあればそれを返す）
+    thumbs : "interval"（一定間隔）または "scene"（シーンの切り替わり）
+    """
+    if thumbs not in THUMB_MODES:
+        raise ValueError(f"thumbsは{', '.join(THUMB_MODES)}のいずれかです")
+    folder = proxy_root() / proxy_key(file, thumbs)
+    if not rebuild:
+        manifest = _load(folder)
+        if manifest is not None:
+            return manifest
+
+    info = media_info(file)
+    if not info or not info["width"]:
+        raise ValueError(f"動画情報を取得できません: {file}")
+
+    # 別の名前で作ってから置き換える（途中で止まっても壊れたものが残らない）
+    work = Path(tempfile.mkdtemp(prefix=".tmp_", dir=proxy_root()))
+    try:
+        manifest = _render(file, work, thumbs, info)
+        with open(work / "manifest.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        shutil.rmtree(folder, ignore_errors=True)
+        try:
+            os.replace(work, folder)
+        except OSError:
+            # 同じファイルを別スレッドが先に作り終えた
+            if _load(folder) is None:
+                raise
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return _load(folder)
+
+
+class ProxyBuilder:
+    """
+    builder.request(file, callback) でバックグラウンドにプロキシを作らせる
+    callback(file, manifest, error) はワーカースレッドから呼ばれる
+    （キャッシュにあればその場で呼ぶ）。cancel_pending で未着手の分を取り消す
+    """
+
+    def __init__(self, workers: int = PROXY_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def request(self, file, callback, thumbs: str = "interval"):
+        manifest = cached_proxy(file, thumbs)
+        if manifest is not None:
+            callback(file, manifest, None)
+            return
+        key = (str(file), thumbs)
+        with self._lock:
+            if key in self._futures:
+                self._futures[key].add_done_callback(
+                    lambda f: callback(file, *self._result(f)))
+                return
+            future = ffmpeg_runner.submit(self._pool, make_proxy, file, thumbs)
+            self._futures[key] = future
+
+        def done(f):
+            with self._lock:
+                self._futures.pop(key, None)
+            callback(file, *self._result(f))
+
+        future.add_done_callback(done)
+
+    @staticmethod
+    def _result(future):
+        """(manifest, エラー)"""
+        if future.cancelled():
+            return None, None
+        error = future.exception()
+        return (None, error) if error else (future.result(), None)
+
+    def cancel_pending(self):
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+
+    def shutdown(self):
+        self.cancel_pending()
+        self._pool.shutdown(wait=False)
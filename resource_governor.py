@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+"""
+ffmpeg 子プロセスの同時実行の調整
+
+すべての ffmpeg 起動（run_ffmpeg と音声解析）はここで許可を得てから始める。
+許可の判断にはその時点の
+  CPU 使用率   : /proc/stat（Linux）・GetSystemTimes（Windows）・loadavg（その他）
+  空きメモリ   : /proc/meminfo の MemAvailable（Linux）・GlobalMemoryStatusEx（Windows）
+  I/O 待ち     : /proc/stat の iowait（Linux のみ）
+を使い、どれかが上限を超えていれば、実行中のジョブが終わるか値が下がるまで待たせる。
+このプロセスの ffmpeg が1つも動いていなければ必ず許可する（止まったままにならない）。
+
+許可したジョブには
+  threads : 空いているコア数（コマンドに -threads があればそのまま）
+  nice    : CHILD_NICE（Windows は BELOW_NORMAL_PRIORITY_CLASS）
+  ionice  : ベストエフォートの最低優先度（Linux で ionice コマンドがあれば）
+を設定し、判断の内容を timing ログの "governor" に残す。
+
+  MOVIEPROCESS_GOVERNOR=off : 調整しない（待たせず、スレッド数・優先度も変えない）
+  MOVIEPROCESS_MAX_JOBS     : 同時に動かす ffmpeg の上限（既定は CPU 数）
+"""
+
+import contextvars
+import errno
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+CPU_COUNT = os.cpu_count() or 1
+
+# これを超えていたら新しいジョブを待たせる
+CPU_HIGH = 0.9            # CPU 使用率（0〜1）
+IOWAIT_HIGH = 0.25        # I/O 待ちの割合（0〜1）
+MEMORY_RESERVE = 1024 ** 3  # 起動後も残しておく空きメモリ（バイト）
+
+# 1ジョブが使うメモリの見込み（同じ段階の実績 rss がなければこの値）
+DEFAULT_JOB_MEMORY = 512 * 1024 ** 2
+
+# 起動直後のジョブはまだ使用率に表れないため、この秒数は見込みで数える
+RAMP_SECONDS = 5.0
+
+# CPU・I/O の使用率を測る間隔（秒）。待っている間もこの間隔で見直す
+SAMPLE_SECONDS = 0.5
+
+# 子プロセスの優先度
+CHILD_NICE = 10
+IONICE_ARGS = ["-t", "-c", "2", "-n", "7"]
+_CAN_RENICE = hasattr(os, "setpriority") or sys.platform == "win32"
+
+# ストリームコピーだけのジョブ（CPU をほとんど使わない）の判定に使うオプション
+_CODEC_OPTIONS = ("-c", "-c:v", "-c:a", "-vcodec", "-acodec", "-codec")
+_FILTER_OPTIONS = ("-vf", "-af", "-filter_complex", "-filter:v", "-filter:a",
+                   "-lavfi")
+
+
+# True の間に起動する ffmpeg は調整しない（bypassed を使う）
+_bypass = contextvars.ContextVar("governor_bypass", default=False)
+
+
+def governor_enabled() -> bool:
+    if _bypass.get():
+        return False
+    return os.environ.get("MOVIEPROCESS_GOVERNOR", "").lower() not in ("off", "0", "no")
+
+
+@contextmanager
+def bypassed():
+    """
+    この中（ffmpeg_runner.submit で渡したスレッドを含む）で起動する ffmpeg は
+    調整しない。並列数・スレッド数そのものを測る較正などで使う
+    """
+    reset = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(reset)
+
+
+def max_jobs() -> int:
+    try:
+        return max(1, int(os.environ.get("MOVIEPROCESS_MAX_JOBS", "")))
+    except ValueError:
+        return CPU_COUNT
+
+
+# =========================
+# システムの状態
+# =========================
+
+def _windows_system_times():
+    """Windows: GetSystemTimes の (アイドル, 合計) [100ns]"""
+    import ctypes
+    from ctypes import wintypes
+
+    idle, kernel, user = (wintypes.FILETIME() for _ in range(3))
+    if not ctypes.windll.kernel32.GetSystemTimes(
+            ctypes.byref(idle), ctypes.byref(kernel), ctypes.byref(user)):
+        return None
+    to_100ns = lambda t: (t.dwHighDateTime << 32) | t.dwLowDateTime
+    # kernel にはアイドル時間が含まれる
+    return to_100ns(idle), to_100ns(kernel) + to_100ns(user)
+
+
+def cpu_times():
+    """累積の (アイドル, I/O 待ち, 合計)。取れなければ None"""
+    if sys.platform == "win32":
+        try:
+            times = _windows_system_times()
+        except Exception:
+            return None
+        return None if times is None else (times[0], 0, times[1])
+    try:
+        with open("/proc/stat", "r", encoding="ascii") as f:
+            fields = [int(v) for v in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    # user nice system idle iowait irq softirq steal（guest は user に含まれる）
+    return fields[3], fields[4] if len(fields) > 4 else 0, sum(fields[:8])
+
+
+def _windows_available_memory():
+    import ctypes
+
+    class MEMORYSTATUSEX(ctypes.Structure):
+        _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                    ("ullTotalPhys", ctypes.c_ulonglong),
+                    ("ullAvailPhys", ctypes.c_ulonglong),
+                    ("ullTotalPageFile", ctypes.c_ulonglong),
+                    ("ullAvailPageFile", ctypes.c_ulonglong),
+                    ("ullTotalVirtual", ctypes.c_ulonglong),
+                    ("ullAvailVirtual", ctypes.c_ulonglong),
+                    ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+    status = MEMORYSTATUSEX()
+    status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+    if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+        return None
+    return status.ullAvailPhys
+
+
+def available_memory():
+    """使える物理メモリ（バイト）。取れなければ None"""
+    if sys.platform == "win32":
+        try:
+            return _windows_available_memory()
+        except Exception:
+            return None
+    try:
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _loadavg():
+    try:
+        return min(1.0, os.getloadavg()[0] / CPU_COUNT)
+    except (AttributeError, OSError):
+        return None
+
+
+# =========================
+# 子プロセスの設定
+# =========================
+
+def is_copy_only(cmd) -> bool:
+    """エンコード・フィルタを使わないストリームコピーだけのコマンドか"""
+    codecs = [cmd[i + 1] for i, arg in enumerate(cmd[:-1]) if arg in _CODEC_OPTIONS]
+    return (bool(codecs) and all(c == "copy" for c in codecs)
+            and not any(arg in _FILTER_OPTIONS for arg in cmd))
+
+
+def requested_threads(cmd):
+    """コマンドで指定済みの -threads（なければ None）"""
+    for i, arg in enumerate(cmd[:-1]):
+        if arg == "-threads":
+            try:
+                return int(cmd[i + 1])
+            except ValueError:
+                return None
+    return None
+
+
+def output_positions(cmd, outputs=None) -> list:
+    """
+    出力ファイルの位置（cmd の添字）
+    outputs : 出力の引数（cmd の要素と同じ文字列）。呼び出し元が明示する
+              （fan_out などは複数）。None なら最後の引数だけ
+    オプションの値と区別できないので argv の解析では探さない
+    outputs にあるのに cmd に見つからなければ ValueError
+    """
+    if not outputs:
+        return [len(cmd) - 1]
+    positions = []
+    for out in outputs:
+        matches = [i for i, arg in enumerate(cmd) if i > 0 and arg == str(out)]
+        if not matches:
+            raise ValueError(f"出力がコマンドにありません: {out}")
+        positions.append(matches[-1])
+    return sorted(set(positions))
+
+
+def child_command(cmd, decision, outputs=None) -> list:
+    """
+    decision に従ってスレッド数を指定したコマンド
+    -filter_threads（グローバルオプション）は実行ファイルの直後に、
+    -threads は出力ごとに、その出力の直前に入れる（outputs は output_positions 参照）
+    -threads が指定済みなら変えない
+    """
+    cmd = list(cmd)
+    threads = decision.get("threads")
+    if not (threads and decision.get("set_threads")):
+        return cmd
+    for i in reversed(output_positions(cmd, outputs)):
+        cmd[i:i] = ["-threads", str(threads)]
+    global_options = ["-filter_threads", str(threads)]
+    if any(arg in ("-filter_complex", "-filter_complex_script", "-/filter_complex",
+                   "-lavfi") for arg in cmd):
+        global_options += ["-filter_complex_threads", str(threads)]
+    cmd[1:1] = global_options
+    return cmd
+
+
+def launch_command(cmd, decision) -> list:
+    """
+    実際に起動するコマンド（ionice を前に付ける。exec されるので pid は ffmpeg のもの）
+    ffmpeg が見つからないときは ionice のエラーではなく FileNotFoundError にする
+    """
+    if not decision.get("ionice"):
+        return list(cmd)
+    if shutil.which(cmd[0]) is None:
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), cmd[0])
+    return [decision["ionice"], *IONICE_ARGS, *cmd]
+
+
+def popen_options(decision) -> dict:
+    """subprocess.Popen に渡す追加の引数"""
+    if decision.get("nice") and sys.platform == "win32":
+        return {"creationflags": subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+    return {}
+
+
+def apply_priority(proc, decision):
+    """POSIX: 起動した子プロセスの nice 値を下げる"""
+    nice = decision.get("nice")
+    if not nice or not hasattr(os, "setpriority"):
+        return
+    try:
+        current = os.getpriority(os.PRIO_PROCESS, 0)
+        os.setpriority(os.PRIO_PROCESS, proc.pid, max(current, nice))
+    except OSError:
+        # 既に終了している・権限がない
+        pass
+
+
+# =========================
+# 許可
+# =========================
+
+class _Job:
+    def __init__(self, stage, threads, memory):
+        self.stage = stage
+        self.threads = threads
+        self.memory = memory
+        self.started = time.monotonic()
+
+    def ramping(self, now) -> bool:
+        return now - self.started < RAMP_SECONDS
+
+
+class ResourceGovernor:
+    """
+    with governor.admit(stage, cmd) as decision: で許可を待ってから ffmpeg を起動する
+    終了後に decision["rss"] を入れておくと、その段階のメモリの見込みに使う
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._running = set()
+        self._memory = {}     # 段階ごとの実績 rss（最大値）
+        self._last_times = None
+        self._last_sample = 0.0
+        self._busy = _loadavg() or 0.0
+        self._iowait = 0.0
+        self._ionice = shutil.which("ionice") if sys.platform.startswith("linux") else None
+
+    def _sample(self):
+        """CPU 使用率・I/O 待ちを更新する（SAMPLE_SECONDS より短い間隔では前の値）"""
+        now = time.monotonic()
+        if now - self._last_sample < SAMPLE_SECONDS:
+            return
+        self._last_sample = now
+        times = cpu_times()
+        if times is None:
+            load = _loadavg()
+            if load is not None:
+                self._busy = load
+            return
+        if self._last_times is not None:
+            idle = times[0] - self._last_times[0]
+            iowait = times[1] - self._last_times[1]
+            total = times[2] - self._last_times[2]
+            if total > 0:
+                self._busy = max(0.0, min(1.0, 1.0 - (idle + iowait) / total))
+                self._iowait = max(0.0, min(1.0, iowait / total))
+        self._last_times = times
+
+    def _check(self, copy_only, memory_needed):
+        """(許可するか, 待たせる理由, 判断に使った値)"""
+        now = time.monotonic()
+        ramping = [job for job in self._running if job.ramping(now)]
+        # 起動直後のジョブは使うはずのスレッド数・メモリを見込みで足す
+        busy = min(1.0, self._busy + sum(job.threads for job in ramping) / CPU_COUNT)
+        memory = available_memory()
+        if memory is not None:
+            memory -= sum(job.memory for job in ramping)
+        state = {"cpu": round(busy, 3), "iowait": round(self._iowait, 3),
+                 "mem_available": memory, "running": len(self._running)}
+
+        if not self._running:
+            return True, None, state
+        if len(self._running) >= max_jobs():
+            return False, "jobs", state
+        if not copy_only and busy >= CPU_HIGH:
+            return False, "cpu", state
+        if self._iowait >= IOWAIT_HIGH:
+            return False, "iowait", state
+        if memory is not None and memory - memory_needed < MEMORY_RESERVE:
+            return False, "memory", state
+        return True, None, state
+
+    @contextmanager
+    def admit(self, stage: str, cmd, token=None, threads=None):
+        """
+        許可されるまで待ち、判断の内容を dict で返す
+          {"threads", "set_threads", "nice", "ionice", "waited", "reason",
+           "cpu", "iowait", "mem_available", "mem_estimate", "running"}
+        threads : コマンドに書かずに使うスレッド数がわかっていれば指定する
+        token がキャンセルされたら待つのをやめて JobCancelled
+        """
+        if not governor_enabled():
+            yield {"enabled": False}
+            return
+
+        copy_only = is_copy_only(cmd)
+        requested = threads if threads is not None else requested_threads(cmd)
+        started = time.monotonic()
+        reason = None
+        with self._cond:
+            memory_needed = self._memory.get(stage, DEFAULT_JOB_MEMORY)
+            while True:
+                if token is not None:
+                    token.check()
+                self._sample()
+                ok, why, state = self._check(copy_only, memory_needed)
+                if ok:
+                    break
+                reason = why
+                self._cond.wait(SAMPLE_SECONDS)
+
+            if requested is not None:
+                threads = requested or CPU_COUNT   # 0 は ffmpeg の自動設定
+            elif copy_only:
+                threads = 1
+            else:
+                # 空いているコアを使う（何も動いていなければ全コア）
+                threads = max(1, min(CPU_COUNT, round(CPU_COUNT * (1.0 - state["cpu"]))))
+            job = _Job(stage, threads, memory_needed)
+            self._running.add(job)
+
+        decision = {
+            "threads": threads,
+            "set_threads": requested is None and not copy_only,
+            "nice": CHILD_NICE if _CAN_RENICE else None,
+            "ionice": self._ionice,
+            "waited": round(time.monotonic() - started, 3),
+            "reason": reason,
+            "mem_estimate": memory_needed,
+            **state,
+        }
+        try:
+            yield decision
+        finally:
+            with self._cond:
+                self._running.discard(job)
+                rss = decision.get("rss")
+                if rss:
+                    self._memory[stage] = max(rss, self._memory.get(stage, 0))
+                self._cond.notify_all()
+
+
+_default_governor = None
+_default_lock = threading.Lock()
+
+
+def get_governor() -> ResourceGovernor:
+    global _default_governor
+    with _default_lock:
+        if _default_governor is None:
+            _default_governor = ResourceGovernor()
+        return _default_governor
+
+
+def log_fields(decision) -> dict:
+    """timing ログに残す項目"""
+    if not decision.get("enabled", True):
+        return {"enabled": False}
+    keys = ("threads", "nice", "waited", "reason", "cpu", "iowait",
+            "mem_available", "mem_estimate", "running")
+    fields = {key: decision.get(key) for key in keys}
+    fields["ionice"] = bool(decision.get("ionice"))
+    return fields
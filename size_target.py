@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+目標ファイルサイズに収める圧縮設定の予測
+
+動画の数か所から短い区間を切り出して実際にエンコードし、その CRF での
+映像ビットレートを見積もる。見積もりが目標に収まればその CRF を使い
+（念のため -maxrate で上限も付ける）、収まらなければ CRF を上げて再度見積もる。
+区間ごとのばらつきが大きく見積もりが当てにならない場合は 2 パスエンコードにする。
+"""
+
+import math
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import ffmpeg_runner
+from ffmpeg_runner import run_ffmpeg
+
+
+# 見積もりに使う区間の数と長さ（秒）
+SAMPLE_COUNT = 4
+SAMPLE_SECONDS = 4.0
+
+# 見積もりにこれだけ余裕があれば CRF で1回エンコードする
+SAFETY = 0.9
+
+# コンテナなどのオーバーヘッド（全体に対する割合）
+OVERHEAD = 0.02
+
+# 区間ごとのビットレートの変動係数がこれを超えたら見積もりは不確か
+UNCERTAIN_CV = 0.35
+
+# CRF の上限。これ以上上げないと収まらない場合は 2 パス
+MAX_CRF = 40
+
+# x264 は CRF +6 でビットレートがおよそ半分になる
+CRF_DOUBLING = 6.0
+
+
+def replace_option(args, option, value):
+    """["-crf", "28", ...] のような引数リストの値を置き換える（なければ追加）"""
+    args = list(args)
+    if option in args:
+        args[args.index(option) + 1] = str(value)
+    else:
+        args += [option, str(value)]
+    return args
+
+
+def sample_points(duration: float):
+    """見積もりに使う区間 [(開始, 長さ), ...]。短い動画は全体を1区間にする"""
+    if duration <= SAMPLE_COUNT * SAMPLE_SECONDS * 2:
+        return [(0.0, duration)]
+    return [
+        (duration * (n + 0.5) / SAMPLE_COUNT - SAMPLE_SECONDS / 2, SAMPLE_SECONDS)
+        for n in range(SAMPLE_COUNT)
+    ]
+
+
+def _encode_sample(input_file, start, length, out, video_filter, video_args):
+    cmd = ["ffmpeg", "-y", "-v", "error", "-ss", f"{start}", "-i", str(input_file),
+           "-t", f"{length}", "-an"]
+    if video_filter:
+        cmd += ["-vf", video_filter]
+    cmd += [*video_args, str(out)]
+    run_ffmpeg(cmd, "size_sample", input_file, out, length)
+    return Path(out).stat().st_size * 8 / length
+
+
+def measure_bitrate(input_file, duration, video_filter, video_args):
+    """
+    サンプル区間をエンコードして映像ビットレート (bps) を見積もる
+    戻り値: (平均ビットレート, 変動係数)
+    """
+    points = sample_points(duration)
+    work_dir = Path(tempfile.mkdtemp(prefix="size_"))
+    try:
+        with ThreadPoolExecutor(max_workers=len(points)) as pool:
+            futures = [
+                ffmpeg_runner.submit(pool, _encode_sample, input_file, start, length,
+                                     work_dir / f"sample_{n}.mp4",
+                                     video_filter, video_args)
+                for n, (start, length) in enumerate(points)
+            ]
+            rates = [f.result() for f in futures]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    mean = sum(rates) / len(rates)
+    if len(rates) < 2 or mean <= 0:
+        return mean, 0.0
+    std = math.sqrt(sum((r - mean) ** 2 for r in rates) / (len(rates) - 1))
+    return mean, std / mean
+
+
+def plan_target_size(input_file, duration, target_bytes, video_filter,
+                     video_args, audio_bitrate=0):
+    """
+    target_bytes に収まる映像の設定を決める
+    video_args    : 基準の映像設定（-crf を含むこと）
+    audio_bitrate : 音声のビットレート (bps)。音声なしなら 0
+
+    戻り値: {"mode": "crf" | "2pass", "video_args": [...],
+             "bitrate": 映像ビットレートの上限 (bps), "predicted": 予測サイズ}
+    "2pass" の video_args は 1 パス分の設定（-b:v 指定）で、
+    2 パスにできない場合（区間並列など）はそのまま使える。
+    """
+    if not duration or duration <= 0:
+        raise ValueError(f"動画の長さを取得できないため目標サイズを計算できません: {input_file}")
+    budget = target_bytes * 8 * (1 - OVERHEAD) / duration - audio_bitrate
+    if budget <= 0:
+        raise ValueError("目標サイズが小さすぎます")
+    budget = int(budget)
+    capped = ["-maxrate", str(budget), "-bufsize", str(budget * 2)]
+
+    def predicted(rate):
+        return int((rate + audio_bitrate) * duration / 8 / (1 - OVERHEAD))
+
+    crf = float(video_args[video_args.index("-crf") + 1])
+    rate, cv = measure_bitrate(input_file, duration, video_filter, video_args)
+
+    if rate > budget * SAFETY and cv <= UNCERTAIN_CV:
+        # 収まる CRF を推定してもう一度見積もる
+        crf = min(MAX_CRF, math.ceil(
+            crf + CRF_DOUBLING * math.log2(rate / (budget * SAFETY))))
+        video_args = replace_option(video_args, "-crf", crf)
+        rate, cv = measure_bitrate(input_file, duration, video_filter, video_args)
+
+    if rate <= budget * SAFETY and cv <= UNCERTAIN_CV:
+        return {"mode": "crf", "video_args": [*video_args, *capped],
+                "bitrate": budget, "predicted": predicted(rate)}
+
+    abr_args = list(video_args)
+    i = abr_args.index("-crf")
+    del abr_args[i:i + 2]
+    return {"mode": "2pass", "video_args": [*abr_args, "-b:v", str(budget), *capped],
+            "bitrate": budget, "predicted": predicted(budget)}
+
+
+def two_pass_first(input_file, video_filter, video_args, passlog, duration=None):
+    """2 パスエンコードの 1 パス目（解析のみ・出力は捨てる）"""
+    cmd = ["ffmpeg", "-y", "-v", "error", "-i", str(input_file), "-an"]
+    if video_filter:
+        cmd += ["-vf", video_filter]
+    cmd += [*video_args, "-pass", "1", "-passlogfile", str(passlog),
+            "-f", "null", os.devnull]
+    run_ffmpeg(cmd, "size_pass1", input_file, None, duration)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+キーフレーム単位のストリームコピーと部分再エンコードを組み合わせた切り貼り
+
+キーフレームで始まりキーフレームで終わる区間はコピー、
+それ以外（境界にかかる GOP の一部）だけを元と同じコーデックで再エンコードする。
+区間ごとに SPS/PPS が違っても再生できるよう、映像は Annex B の MPEG-TS で
+切り出してから concat demuxer で結合し、音声は元ファイルから別にコピーする。
+"""
+
+import bisect
+from pathlib import Path
+
+from ffmpeg_runner import run_ffmpeg
+
+
+# 部分再エンコードに対応する映像コーデック → エンコーダ
+ENCODERS = {"h264": "libx264", "hevc": "libx265"}
+ANNEXB_BSF = {"h264": "h264_mp4toannexb", "hevc": "hevc_mp4toannexb"}
+
+# 再エンコード部分の画質
+REENCODE_CRF = 18
+
+# キーフレーム位置とみなす誤差（秒）
+KEYFRAME_TOLERANCE = 0.001
+
+# ffprobe のプロファイル名 → エンコーダの -profile:v
+PROFILES = {
+    "h264": {"constrained baseline": "baseline", "baseline": "baseline",
+             "main": "main", "high": "high", "high 10": "high10",
+             "high 4:2:2": "high422", "high 4:4:4 predictive": "high444"},
+    "hevc": {"main": "main", "main 10": "main10",
+             "main still picture": "mainstillpicture"},
+}
+
+# ffprobe の値のうち「指定なし」の意味のもの
+_UNSET = (None, "", "unknown", "unspecified", "reserved")
+
+
+def supports(info) -> bool:
+    """部分再エンコードで扱えるコーデックか"""
+    return bool(info) and info.get("vcodec") in ENCODERS
+
+
+# =========================
+# 区間の計画
+# =========================
+
+def plan_range(keyframes, start, end, duration=None):
+    """
+    [start, end) をコピー区間と再エンコード区間に分ける
+    keyframes・start・end はいずれも入力の -ss と同じ start_time 基準の秒数
+    （media_index.keyframe_times の値をそのまま使う）
+    戻り値: [("encode" | "copy", 開始, 終了), ...]
+
+      start ─ 再エンコード ─ ka ─── コピー ─── kb ─ 再エンコード ─ end
+      ka: start 以降の最初のキーフレーム
+      kb: end より前の最後のキーフレーム
+    end がキーフレーム（または動画の終わり）ならコピーで終われる。
+    """
+    tol = KEYFRAME_TOLERANCE
+
+    i = bisect.bisect_left(keyframes, start - tol)
+    ka = keyframes[i] if i < len(keyframes) else None
+    if ka is None or ka >= end - tol:
+        # 区間内にキーフレームがない → 全体を再エンコード
+        return [("encode", start, end)]
+
+    # start がほぼ ka なら再エンコード部分は不要。コピーは ka の実際の時刻から
+    # 始める（start から -ss すると1つ前のキーフレームまで戻ってしまう）
+    parts = []
+    if ka - start > tol:
+        parts.append(("encode", start, ka))
+
+    j = bisect.bisect_left(keyframes, end - tol)
+    end_on_keyframe = (
+        (j < len(keyframes) and keyframes[j] - end <= tol)
+        or (duration is not None and end >= duration - tol)
+    )
+    if end_on_keyframe:
+        parts.append(("copy", ka, end))
+        return parts
+
+    kb = keyframes[j - 1]
+    if kb - ka > tol:
+        parts.append(("copy", ka, kb))
+        parts.append(("encode", kb, end))
+    elif parts:
+        # キーフレームが ka だけ → 区間全体を1回で再エンコード
+        parts = [("encode", start, end)]
+    else:
+        parts.append(("encode", ka, end))
+    return parts
+
+
+# =========================
+# 切り出し
+# =========================
+
+def copy_range(input_file, start, end, out, info):
+    """キーフレームで始まる区間を映像だけストリームコピー（end=None で最後まで）"""
+    cmd = ["ffmpeg", "-y", "-v", "error"]
+    if start > 0:
+        cmd += ["-ss", f"{start}"]
+    cmd += ["-i", str(input_file)]
+    if end is not None:
+        cmd += ["-t", f"{end - start}"]
+    cmd += [
+        "-map", "0:v:0", "-c", "copy",
+        "-bsf:v", ANNEXB_BSF[info["vcodec"]],
+        str(out)
+    ]
+    run_ffmpeg(cmd, "copy_range", input_file, out,
+               end - start if end is not None else None)
+
+
+def encoder_args(info) -> list:
+    """
+    再エンコード部分を元の映像ストリームに合わせる設定
+    （プロファイル・レベル・参照フレーム数・B フレームの有無・色情報）
+    コピー部分と SPS の内容を揃え、MP4 の1本のトラックにつないでも
+    デコーダが設定を切り替えずに済むようにする
+    """
+    vcodec = info["vcodec"]
+    args = ["-c:v", ENCODERS[vcodec], "-crf", str(REENCODE_CRF),
+            "-pix_fmt", info["pix_fmt"]]
+
+    profile = PROFILES[vcodec].get(str(info.get("profile") or "").lower())
+    if profile:
+        args += ["-profile:v", profile]
+
+    level = info.get("level")
+    refs = info.get("refs")
+    if vcodec == "h264":
+        if level and level > 0:
+            args += ["-level:v", f"{level / 10:.1f}"]
+        if refs and refs > 0:
+            args += ["-refs", str(refs)]
+        if info.get("has_b_frames") == 0:
+            args += ["-bf", "0"]
+    else:
+        params = []
+        if level and level > 0:
+            params.append(f"level-idc={level / 30:.1f}")
+        if refs and refs > 0:
+            params.append(f"ref={min(refs, 16)}")
+        if info.get("has_b_frames") == 0:
+            params.append("bframes=0")
+        if params:
+            args += ["-x265-params", ":".join(params)]
+
+    for option, key in (("-color_range", "color_range"),
+                        ("-colorspace", "color_space"),
+                        ("-color_trc", "color_transfer"),
+                        ("-color_primaries", "color_primaries")):
+        if info.get(key) not in _UNSET:
+            args += [option, info[key]]
+    return args
+
+
+def encode_range(input_file, start, end, out, info,
+                 extra_inputs=(), filter_complex=None):
+    """
+    区間を元と同じコーデック・エンコーダ設定で再エンコード（映像のみ、encoder_args 参照）
+    filter_complex を渡す場合は出力ラベルを [v] にすること。
+    extra_inputs は入力 1 番以降として追加される。
+    """
+    cmd = ["ffmpeg", "-y", "-v", "error", "-ss", f"{start}", "-i", str(input_file)]
+    for extra in extra_inputs:
+        cmd += ["-i", str(extra)]
+    cmd += ["-t", f"{end - start}"]
+    if filter_complex:
+        cmd += ["-filter_complex", filter_complex, "-map", "[v]"]
+    else:
+        cmd += ["-map", "0:v:0"]
+    cmd += [*encoder_args(info), str(out)]
+    run_ffmpeg(cmd, "encode_range", input_file, out, end - start)
+
+
+def render_parts(input_file, parts, info, work_dir, prefix="part"):
+    """plan_range の結果を TS ファイルに切り出す"""
+    work_dir = Path(work_dir)
+    files = []
+    for n, (mode, s, e) in enumerate(parts):
+        out = work_dir / f"{prefix}_{n:03d}.ts"
+        if mode == "copy":
+            copy_range(input_file, s, e, out, info)
+        else:
+            encode_range(input_file, s, e, out, info)
+        files.append(out)
+    return files
+
+
+def join_parts(parts, audio_source, output_file, work_dir,
+               audio_start=None, audio_duration=None):
+    """
+    映像の TS を結合し、audio_source の音声（区間指定可）をコピーして多重化する
+    """
+    concat_list = Path(work_dir) / f"{Path(output_file).stem}_list.txt"
+    with open(concat_list, "w", encoding="utf-8") as f:
+        for p in parts:
+            f.write(f"file '{p}'\n")
+
+    cmd = ["ffmpeg", "-y", "-v", "error",
+           "-f", "concat", "-safe", "0", "-i", str(concat_list)]
+    if audio_start:
+        cmd += ["-ss", f"{audio_start}"]
+    if audio_duration is not None:
+        cmd += ["-t", f"{audio_duration}"]
+    cmd += [
+        "-i", str(audio_source),
+        "-map", "0:v", "-map", "1:a?",
+        "-c", "copy",
+        str(output_file)
+    ]
+    run_ffmpeg(cmd, "join", concat_list, output_file, audio_duration)
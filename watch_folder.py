@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+フォルダ監視（取り込み中の事前変換用）
+
+フォルダに動画が追加されるのを監視し、サイズと更新時刻が一定時間変わらなくなった
+（コピーが終わった）ファイルを順に返す。
+Linux では inotify で変更を待ち、それ以外の環境や inotify が使えない場合は
+一定間隔でフォルダを走査する。ネットワークドライブでは inotify が他のマシンからの
+書き込みを通知しないことがあるため、inotify 使用時も時々全体を走査し直す。
+"""
+
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+
+from media_index import MEDIA_SUFFIXES
+
+
+# この秒数サイズ・更新時刻が変わらなければ書き込み完了とみなす
+STABLE_SECONDS = 5.0
+
+# 書き込み中のファイルを確認する間隔（秒）
+POLL_INTERVAL = 1.0
+
+# inotify 使用時もこの間隔でフォルダ全体を走査する（秒）
+RESCAN_SECONDS = 30.0
+
+
+# =========================
+# inotify
+# =========================
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+_EVENT = struct.Struct("iIII")
+
+
+class _Inotify:
+    """ctypes で libc の inotify を使う（Linux のみ）"""
+
+    def __init__(self, folder: Path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                           use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 に失敗しました")
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch に失敗しました: {folder}")
+
+    def read(self, timeout: float) -> set:
+        """timeout 秒まで待ち、変更のあったファイル名を返す"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        names = set()
+        pos = 0
+        while pos + _EVENT.size <= len(data):
+            _, _, _, length = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = data[pos:pos + length].rstrip(b"\0")
+            pos += length
+            if name:
+                names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+# =========================
+# 監視
+# =========================
+
+class FolderWatcher:
+    """
+    for path in FolderWatcher(folder).watch(): ...
+    書き込みが終わった動画を1回ずつ返す（後で書き換えられたら再度返す）
+    最初の走査で見つかった既存のファイルも対象にする
+    """
+
+    def __init__(self, folder, suffixes=MEDIA_SUFFIXES,
+                 stable_seconds: float = STABLE_SECONDS,
+                 use_inotify: bool = True):
+        self.folder = Path(folder)
+        self.suffixes = tuple(suffixes)
+        self.stable_seconds = stable_seconds
+        self._pending = {}   # パス → ((サイズ, 更新時刻), 最後に変化を見た時刻)
+        self._done = {}      # パス → 返したときの (サイズ, 更新時刻)
+        self._inotify = None
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self._inotify = _Inotify(self.folder)
+            except (OSError, AttributeError):
+                self._inotify = None
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self._inotify else "polling"
+
+    def _is_target(self, path: Path) -> bool:
+        return (path.suffix.lower() in self.suffixes
+                and ".part" not in path.suffixes
+                and not path.name.startswith("."))
+
+    def _touch(self, path: Path, now: float):
+        """ファイルの状態を記録し、変化があれば待ち時間をリセット"""
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            self._pending.pop(path, None)
+            return
+        if not path.is_file():
+            return
+        state = (st.st_size, st.st_mtime_ns)
+        if self._done.get(path) == state:
+            return
+        prev = self._pending.get(path)
+        if prev is None or prev[0] != state:
+            self._pending[path] = (state, now)
+
+    def _scan(self, now: float):
+        for path in self.folder.iterdir():
+            if self._is_target(path):
+                self._touch(path, now)
+
+    def poll(self, timeout: float = POLL_INTERVAL):
+        """
+        timeout 秒まで変更を待ち、書き込みが終わったファイルのリストを返す
+        （ファイル名順）
+        """
+        if self._inotify:
+            names = self._inotify.read(timeout)
+            now = time.monotonic()
+            for name in names:
+                path = self.folder / name
+                if self._is_target(path):
+                    self._touch(path, now)
+        else:
+            time.sleep(timeout)
+            now = time.monotonic()
+
+        # 書き込み中のファイルは inotify の通知がなくても状態を確認する
+        for path in list(self._pending):
+            self._touch(path, now)
+
+        ready = []
+        for path, (state, since) in list(self._pending.items()):
+            if state[0] > 0 and now - since >= self.stable_seconds:
+                del self._pending[path]
+                self._done[path] = state
+                ready.append(path)
+        return sorted(ready)
+
+    def watch(self):
+        """書き込みが終わったファイルを返し続けるジェネレータ（止めるまで終わらない）"""
+        last_scan = None
+        try:
+            while True:
+                now = time.monotonic()
+                if last_scan is None or not self._inotify or \
+                        now - last_scan >= RESCAN_SECONDS:
+                    self._scan(now)
+                    last_scan = now
+                yield from self.poll()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+
+
+# =========================
+# 取り込み済みリスト
+# =========================
+
+class IngestManifest:
+    """
+    取り込んだクリップの一覧（作成日時順）を JSON に保存する
+    [{"file": 名前, "creation_time": ..., "duration": ..., "intermediate": ..., ...}]
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.entries = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for entry in json.load(f):
+                    self.entries[entry["file"]] = entry
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def ordered(self) -> list:
+        return sorted(self.entries.values(),
+                      key=lambda e: (e.get("creation_time") or 0.0, e["file"]))
+
+    def update(self, file, **fields):
+        with self._lock:
+            self.entries[Path(file).name] = {"file": Path(file).name, **fields}
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.ordered(), f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)